@@ -1,47 +1,75 @@
-from PIL import ImageDraw
+from profiler import PROFILER
+from roi_proposals import rect_to_output
 
-def draw_annotations(image_pil, app):
-    draw = ImageDraw.Draw(image_pil)
+TICK_RADIUS = 5
+TICK_COLORS = {"horizontal": "blue", "vertical": "green"}
 
-    # Draw horizontal ticks
-    if hasattr(app, "horizontal_ticks"):
-        for idx, (x, y) in enumerate(app.horizontal_ticks):
-            draw.ellipse((x-5, y-5, x+5, y+5), fill="blue", outline="black")
-            draw.text((x+6, y-6), f"H{idx+1}", fill="blue")
+def _place(app, live, key, kind, coords, **options):
+    """Create a canvas item for key, or move/restyle the existing one in place"""
+    item = app.annotation_items.get(key)
+    if item is None:
+        create = getattr(app.canvas, f"create_{kind}")
+        app.annotation_items[key] = create(*coords, tags=("annotation",), **options)
+    else:
+        app.canvas.coords(item, *coords)
+        if options:
+            app.canvas.itemconfig(item, **options)
+    live.add(key)
 
-    # Draw vertical ticks
-    if hasattr(app, "vertical_ticks"):
-        for idx, (x, y) in enumerate(app.vertical_ticks):
-            draw.ellipse((x-5, y-5, x+5, y+5), fill="green", outline="black")
-            draw.text((x+6, y-6), f"V{idx+1}", fill="green")
+@PROFILER.timed("annotations.draw")
+def draw_annotations(app):
+    """Sync tick, ROI, crop and metadata overlays as canvas items; pixels are never touched"""
+    if app.canvas is None or app.display_scale is None:
+        return
+    s = app.display_scale
+    live = set()
+
+    # Draw horizontal and vertical ticks
+    for kind in ("horizontal", "vertical"):
+        ticks = getattr(app, f"{kind}_ticks", [])
+        color = TICK_COLORS[kind]
+        for idx, (x, y) in enumerate(ticks):
+            cx, cy = x * s, y * s
+            r = TICK_RADIUS
+            _place(app, live, (kind, idx, "dot"), "oval", (cx - r, cy - r, cx + r, cy + r),
+                   fill=color, outline="black")
+            _place(app, live, (kind, idx, "label"), "text", (cx + r + 1, cy - r - 1),
+                   text=f"{kind[0].upper()}{idx+1}", fill=color, anchor="sw")
 
     # Draw ROI rectangles
-    if hasattr(app, "roi_rectangles"):
-        for rect in app.roi_rectangles:
+    for idx, (x0, y0, x1, y1, mode) in enumerate(getattr(app, "roi_rectangles", [])):
+        color = "red" if mode == "ECG" else "blue"
+        _place(app, live, ("roi", idx, "rect"), "rectangle", (x0 * s, y0 * s, x1 * s, y1 * s),
+               outline=color, width=2)
+        _place(app, live, ("roi", idx, "label"), "text", (x0 * s, y0 * s - 2),
+               text=mode, fill=color, anchor="sw")
+
+    # Draw pending automatic proposals (source pixels) until they are accepted or ROIs are drawn by hand
+    if not getattr(app, "roi_rectangles", None) and getattr(app, "geometry", None) is not None:
+        for idx, rect in enumerate(getattr(app, "proposed_rois", [])):
+            rect = rect_to_output(rect, app.geometry)
+            if rect is None:
+                continue
             x0, y0, x1, y1, mode = rect
             color = "red" if mode == "ECG" else "blue"
-            draw.rectangle([x0, y0, x1, y1], outline=color, width=2)
-            draw.text((x0, y0-12), mode, fill=color)
+            _place(app, live, ("proposal", idx, "rect"), "rectangle", (x0 * s, y0 * s, x1 * s, y1 * s),
+                   outline=color, width=1, dash=(6, 4))
+            _place(app, live, ("proposal", idx, "label"), "text", (x0 * s, y0 * s - 2),
+                   text=f"{mode}?", fill=color, anchor="sw")
 
     # Draw current ROI (while dragging)
-    if hasattr(app, "crop_rect") and app.crop_rect:
+    if getattr(app, "crop_rect", None):
         x0, y0, x1, y1 = app.crop_rect
-        draw.rectangle([x0, y0, x1, y1], outline="orange", width=2)
-        try:
-            from PIL import Image
-            overlay = Image.new("RGBA", image_pil.size, (0,0,0,0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            overlay_draw.rectangle([x0, y0, x1, y1], fill=(255, 200, 0, 70))  # RGBA
-            image_pil = Image.alpha_composite(image_pil.convert("RGBA"), overlay)
-            image_pil = image_pil.convert("RGB")
-        except Exception:
-            pass
+        _place(app, live, ("crop",), "rectangle", (x0 * s, y0 * s, x1 * s, y1 * s),
+               outline="orange", width=2, fill="orange", stipple="gray25")
 
     # Display free-text boxes if filled
     if hasattr(app, "location_entry") and hasattr(app, "protocol_entry"):
         loc = app.location_entry.get().strip()
         protocol = app.protocol_entry.get().strip()
-        draw.text((10, 10), f"Location: {loc}", fill="purple")
-        draw.text((10, 30), f"Protocol: {protocol}", fill="purple")
+        _place(app, live, ("location",), "text", (10, 10), text=f"Location: {loc}", fill="purple", anchor="nw")
+        _place(app, live, ("protocol",), "text", (10, 30), text=f"Protocol: {protocol}", fill="purple", anchor="nw")
 
-    return image_pil
+    for key in [k for k in app.annotation_items if k not in live]:
+        app.canvas.delete(app.annotation_items.pop(key))
+    app.canvas.tag_raise("annotation")
@@ -1,22 +1,96 @@
+"""Launcher: the folder picker appears before the image stack (numpy, OpenCV, Pillow) is imported.
+
+    python app.py [--import-report]
+
+While the picker is open a warm-up thread imports the heavy modules, so
+choosing a folder rarely has to wait for them. --import-report prints how
+long each of them takes to import and exits.
+"""
+import time
+
+START = time.perf_counter()
+
+import sys
+import argparse
+import importlib
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from image_logic import MedicalImageProcessor
 
-def main():
+# In dependency order, so each time excludes the ones before it
+HEAVY_MODULES = ("numpy", "cv2", "PIL.ImageTk", "image_logic")
+
+def warm_up(timings):
+    """Import HEAVY_MODULES, recording seconds per module (or the error) in timings"""
+    for name in HEAVY_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            timings[name] = e
+            return
+        timings[name] = time.perf_counter() - start
+
+def import_report():
+    timings = {}
+    warm_up(timings)
+    total = 0.0
+    for name in HEAVY_MODULES:
+        seconds = timings.get(name)
+        if isinstance(seconds, float):
+            total += seconds
+            print(f"{name:<14}{seconds * 1000:8.0f} ms")
+        elif seconds is not None:
+            print(f"{name:<14}  failed: {seconds}")
+    print(f"{'total':<14}{total * 1000:8.0f} ms (run with python -X importtime for a per-module tree)")
+
+def report_startup(app, picker_at, ready_at, waited, timings):
+    """Log the startup timeline and warn when the picker missed STARTUP_BUDGET_MS"""
+    from file_utils import log_to_console
+    from profiler import PROFILER
+    PROFILER.record("startup.picker", picker_at)
+    PROFILER.record("startup.ready", ready_at)
+    log_to_console(app, f"Startup: folder picker after {picker_at * 1000:.0f} ms, first image after "
+                        f"{ready_at * 1000:.0f} ms ({waited * 1000:.0f} ms waiting for imports)")
+    for name in HEAVY_MODULES:
+        if isinstance(timings.get(name), float):
+            log_to_console(app, f"Imported {name} in {timings[name] * 1000:.0f} ms", "DEBUG")
+    budget = app.config["STARTUP_BUDGET_MS"]
+    if picker_at * 1000 > budget:
+        log_to_console(app, f"Folder picker took {picker_at * 1000:.0f} ms, over the {budget} ms startup budget",
+                       "WARNING")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medical image split and calibration tool.")
+    parser.add_argument("--import-report", action="store_true", help="time the heavy imports and exit")
+    args = parser.parse_args(argv)
+    if args.import_report:
+        import_report()
+        return
+
     root = tk.Tk()
     root.title("Medical Image Split and Calibration Tool")
 
+    timings = {}
+    warm = threading.Thread(target=warm_up, args=(timings,), name="import-warm-up", daemon=True)
+    warm.start()
+
     # Prompt user for image directory
+    picker_at = time.perf_counter() - START
     image_dir = filedialog.askdirectory(title="Select image directory")
     if not image_dir:
         messagebox.showerror("No folder selected", "You must select a folder to continue.")
         root.destroy()
         return
 
+    wait_start = time.perf_counter()
+    warm.join()
+    waited = time.perf_counter() - wait_start
+    from image_logic import MedicalImageProcessor
     app = MedicalImageProcessor(root, image_dir=image_dir)
+    report_startup(app, picker_at, time.perf_counter() - START, waited, timings)
     app.log_images_found()  # Log total and remaining images at startup
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
-    
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+"""Headless batch mode: apply a saved ROI/calibration template to every image in a directory.
+
+    python batch.py template.json /path/to/images [--workers N] [--report report.csv] [--db results.sqlite]
+"""
+import os
+import csv
+import json
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from file_utils import find_all_images, load_config
+from image_cache import read_full
+from image_ops import apply_operations, export_rois, image_write_params, metadata_row, roi_format
+from results_store import ResultsStore, default_db_path
+
+def load_template(path):
+    with open(path) as f:
+        template = json.load(f)
+    template.setdefault("operations", [])
+    template.setdefault("roi_rectangles", [])
+    template.setdefault("horizontal_ticks", [])
+    template.setdefault("vertical_ticks", [])
+    template.setdefault("tick_values", {"horizontal": [], "vertical": []})
+    template.setdefault("tick_units", {"horizontal": "", "vertical": ""})
+    return template
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+
+def process_file(path, template):
+    """Crop/rotate and export ROIs for one image; returns (path, seconds, error, metadata row)"""
+    start = time.perf_counter()
+    row = None
+    try:
+        img = read_full(path)[0]
+        if img is None:
+            raise IOError("could not read image")
+        img = apply_operations(img, template["operations"])
+        ext = roi_format(template["roi_format"], img.dtype)
+        rois = export_rois(img, template["roi_rectangles"], path, ext,
+                           image_write_params(ext, template["png_compression"]))
+        if len(rois) != len(template["roi_rectangles"]):
+            raise ValueError(f"{len(template['roi_rectangles']) - len(rois)} ROI(s) fall outside the image")
+        row = metadata_row(template["horizontal_ticks"], template["vertical_ticks"],
+                           template["tick_values"], template["tick_units"],
+                           waveform_type=template.get("waveform_type", ""),
+                           location=template.get("location", ""),
+                           protocol=template.get("protocol", ""),
+                           co_present=template.get("co_present", ""),
+                           roi_rectangles=template["roi_rectangles"],
+                           operations=template["operations"])
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return path, time.perf_counter() - start, error, row
+
+def run_batch(template_path, image_dir, workers=None, report_path=None, db_path=None):
+    template = load_template(template_path)
+    config = load_config()
+    template.setdefault("roi_format", config["ROI_FORMAT"])
+    template.setdefault("png_compression", config["PNG_COMPRESSION"])
+    store = ResultsStore(db_path or default_db_path(image_dir), batch_size=500)
+    files = find_all_images(directory=image_dir)
+    workers = workers or os.cpu_count() or 1
+    print(f"Applying {template_path} to {len(files)} images with {workers} workers")
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        chunksize = max(1, min(32, len(files) // (workers * 4) or 1))
+        for path, seconds, error, row in pool.map(partial(process_file, template=template), files, chunksize=chunksize):
+            results.append((path, seconds, error))
+            if row is not None:
+                store.put(path, row)
+            status = "FAILED" if error else "ok"
+            print(f"[{status}] {seconds * 1000:.0f} ms {path}" + (f" - {error}" if error else ""))
+    store.close()
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if r[2]]
+    print(f"Processed {len(results)} images in {elapsed:.1f} s "
+          f"({len(results) / elapsed if elapsed else 0:.1f} images/s), {len(failed)} failed")
+    for path, _, error in failed:
+        print(f"  {path}: {error}")
+
+    if report_path:
+        with open(report_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "seconds", "error"])
+            for path, seconds, error in results:
+                writer.writerow([path, f"{seconds:.4f}", error or ""])
+        print(f"Wrote report to: {report_path}")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a saved ROI/calibration template to a directory of images.")
+    parser.add_argument("template", help="template JSON written by 'Save Template'")
+    parser.add_argument("image_dir", help="directory searched recursively for images")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--report", default=None, help="optional CSV with per-file timing and errors")
+    parser.add_argument("--db", default=None, help="results store (default: results.sqlite in image_dir)")
+    args = parser.parse_args(argv)
+    results = run_batch(args.template, args.image_dir, workers=args.workers, report_path=args.report,
+                        db_path=args.db)
+    return 1 if any(error for _, _, error in results) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
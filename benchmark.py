@@ -0,0 +1,298 @@
+"""Headless benchmark: replay an interaction trace against synthetic scans.
+
+    python benchmark.py [--sizes 1,12,50] [--modes gray,color] [--trace session.jsonl]
+                        [--repeat 1] [--json report.json]
+
+Each scenario writes a few synthetic scans of the given megapixels to a
+temporary folder, opens it in MedicalImageProcessor with stand-in widgets
+(no display needed) and replays the trace: canvas clicks, drags and
+releases plus UI actions such as rotate, crop, zoom, next/previous and
+saves. Per-operation latency (p50/p95/max) and throughput are reported,
+together with the hot-path timers from profiler.PROFILER. Without --trace
+a built-in trace covering every operation is used; record a real one by
+setting TRACE_FILE in config.txt.
+
+Tk blitting is not measured: PhotoImage is replaced by a stand-in that
+only keeps the tile.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+import events
+from file_utils import load_config
+from image_index import DirectoryIndex
+from image_logic import MedicalImageProcessor
+from profiler import PROFILER
+from session_trace import load_trace
+
+# Built-in session in window coordinates of the fit-to-window view
+DEFAULT_TRACE = (
+    [{"op": "rotate_image", "args": [90]}, {"op": "rotate_image", "args": [-0.5]},
+     {"op": "start_crop", "args": []}, {"op": "click", "args": [40, 30]}]
+    + [{"op": "drag", "args": [40 + 25 * i, 30 + 18 * i]} for i in range(1, 21)]
+    + [{"op": "release", "args": [540, 390]},
+       {"op": "start_roi_mode", "args": ["ECG"]}, {"op": "click", "args": [20, 20]}]
+    + [{"op": "drag", "args": [20 + 15 * i, 20 + 8 * i]} for i in range(1, 21)]
+    + [{"op": "release", "args": [320, 180]},
+       {"op": "set_tick_mode", "args": ["horizontal"]}, {"op": "click", "args": [60, 200]},
+       {"op": "click", "args": [260, 200]},
+       {"op": "start_erase", "args": []}, {"op": "click", "args": [100, 100]}]
+    + [{"op": "drag", "args": [100 + 8 * i, 100 + 3 * i]} for i in range(1, 41)]
+    + [{"op": "release", "args": [420, 220]},
+       {"op": "undo_edit", "args": []}, {"op": "redo_edit", "args": []},
+       {"op": "zoom_at", "args": [1, 200, 150]}, {"op": "scroll_view", "args": ["y", "scroll", 3, "units"]},
+       {"op": "zoom_at", "args": [1, 200, 150]}, {"op": "zoom_to_fit", "args": []},
+       {"op": "accept_roi_proposals", "args": []}, {"op": "save_all_rois", "args": []}, {"op": "save_data", "args": []},
+       {"op": "next_image", "args": []}, {"op": "next_image", "args": []},
+       {"op": "previous_image", "args": []}]
+)
+
+MOUSE_HANDLERS = {"click": events.on_image_click, "drag": events.on_image_drag,
+                  "release": events.on_image_release}
+
+def make_scan(megapixels, color, seed=0):
+    """Synthetic 4:3 monitor capture: grid, labelled waveform strips and noise"""
+    rng = np.random.default_rng(seed)
+    h = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    w = int(round(h * 4 / 3))
+    img = np.full((h, w, 3), 250, np.uint8)
+    step = max(8, w // 60)
+    img[::step] = (200, 200, 255)
+    img[:, ::step] = (200, 200, 255)
+    xs = np.arange(0, w, 2)
+    thickness = max(1, w // 1500)
+    for strip in range(4):
+        base = h * (strip + 1) // 5
+        amp = h / 14
+        ys = base - amp * np.sin(xs / (w / (12 + 5 * strip))) * (1 + 0.3 * rng.standard_normal(len(xs)).clip(-1, 1))
+        pts = np.stack([xs, ys], axis=1).astype(np.int32)
+        cv2.polylines(img, [pts], False, (30 + 50 * strip, 90, 20), thickness)
+        cv2.putText(img, f"II {strip}", (step, base - int(amp)), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(0.5, w / 2500), (0, 0, 0), thickness)
+    noise = rng.integers(-6, 7, size=img.shape, dtype=np.int16)
+    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return img if color else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+class HeadlessRoot:
+    """Tk root stand-in: after() callbacks run when the benchmark pumps them"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, ms, func=None, *args):
+        self.callbacks.append((func, args))
+
+    def after_idle(self, func, *args):
+        self.callbacks.append((func, args))
+
+    def pump(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for func, args in callbacks:
+            func(*args)
+        return len(callbacks)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class HeadlessCanvas:
+    """Canvas stand-in tracking item ids and the scrolled view origin"""
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.scrollregion = (0, 0, width, height)
+        self.origin = [0.0, 0.0]
+        self.next_item = 0
+
+    def _create(self, *args, **kwargs):
+        self.next_item += 1
+        return self.next_item
+
+    create_image = create_oval = create_text = create_rectangle = create_line = _create
+
+    def config(self, **kwargs):
+        if "scrollregion" in kwargs:
+            self.scrollregion = kwargs["scrollregion"]
+        self.width = kwargs.get("width", self.width)
+        self.height = kwargs.get("height", self.height)
+
+    configure = config
+
+    def canvasx(self, x):
+        return self.origin[0] + x
+
+    def canvasy(self, y):
+        return self.origin[1] + y
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def _moveto(self, axis, fraction):
+        extent = self.scrollregion[2 + axis] - (self.width, self.height)[axis]
+        self.origin[axis] = max(0.0, min(float(fraction) * self.scrollregion[2 + axis], max(0, extent)))
+
+    def xview_moveto(self, fraction):
+        self._moveto(0, fraction)
+
+    def yview_moveto(self, fraction):
+        self._moveto(1, fraction)
+
+    def _view(self, axis, *args):
+        if args and args[0] == "scroll":
+            self.origin[axis] = max(0.0, self.origin[axis] + int(args[1]) * 20)
+        elif args and args[0] == "moveto":
+            self._moveto(axis, args[1])
+
+    def xview(self, *args):
+        self._view(0, *args)
+
+    def yview(self, *args):
+        self._view(1, *args)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class HeadlessWidget:
+    """Entry/Text/Label stand-in; text widgets stay empty"""
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def get(self):
+        return self.text
+
+    def index(self, index):
+        return "1.0"
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class HeadlessPhoto:
+    def __init__(self, image):
+        self.image = image
+
+    def paste(self, image):
+        self.image = image
+
+def headless_ui(app, img_width=1200, img_height=900):
+    """setup_ui stand-in: same attributes, no Tk"""
+    app.display_width = img_width
+    app.display_height = img_height
+    app.canvas = HeadlessCanvas(img_width, img_height)
+    app.progress_label = HeadlessWidget()
+    app.log_text = HeadlessWidget()
+    app.location_entry = HeadlessWidget("Benchmark")
+    app.protocol_entry = HeadlessWidget("Synthetic")
+    for name in ("horz_tick1_entry", "horz_tick2_entry", "horizontal_units_entry", "save_horizontal_ticks_btn",
+                 "clear_horizontal_ticks_btn", "vert_tick1_entry", "vert_tick2_entry", "vertical_units_entry",
+                 "save_vertical_ticks_btn", "clear_vertical_ticks_btn"):
+        setattr(app, name, HeadlessWidget())
+    app.get_location = lambda: app.location_entry.get()
+    app.get_type = lambda: "ECG"
+    app.get_protocol = lambda: app.protocol_entry.get()
+
+class MouseEvent:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+def replay(app, root, trace):
+    """Run trace entries in order; returns {op: [seconds, ...]} including the after() work each one queued"""
+    latencies = {}
+    for entry in trace:
+        op, args = entry["op"], entry.get("args", [])
+        start = time.perf_counter()
+        if op in MOUSE_HANDLERS:
+            MOUSE_HANDLERS[op](app, MouseEvent(*args))
+        else:
+            getattr(app, op)(*args)
+        root.pump()
+        latencies.setdefault(op, []).append(time.perf_counter() - start)
+    return latencies
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def run_scenario(megapixels, color, trace, repeat=1, images=3, config=None):
+    """Benchmark one scan size/colour; returns a report dict"""
+    config = dict(config or load_config())
+    config.update({"LOG_LEVEL": "ERROR", "TRACE_FILE": "", "PROFILE_FILE": "", "DUPLICATE_ACTION": "off"})
+    folder = tempfile.mkdtemp(prefix="hemo_bench_")
+    try:
+        for i in range(images):
+            cv2.imwrite(os.path.join(folder, f"scan_{i:03d}.jpg"), make_scan(megapixels, color, seed=i))
+        PROFILER.reset()
+        root = HeadlessRoot()
+        start = time.perf_counter()
+        app = MedicalImageProcessor(root, folder, config=config, ui=headless_ui, photo_image=HeadlessPhoto)
+        deadline = time.time() + 60
+        while app.source_image is None and time.time() < deadline:
+            if not root.pump():
+                time.sleep(0.01)
+        first_paint = time.perf_counter() - start
+        latencies = {}
+        for _ in range(repeat):
+            for op, values in replay(app, root, trace).items():
+                latencies.setdefault(op, []).extend(values)
+        drain_start = time.perf_counter()
+        app.on_close()
+        root.pump()
+        drain = time.perf_counter() - drain_start
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            os.remove(DirectoryIndex(folder).manifest_file)
+        except OSError:
+            pass
+
+    ops = {}
+    for op, values in latencies.items():
+        values.sort()
+        ops[op] = {"count": len(values), "p50_ms": round(_percentile(values, 0.5) * 1000, 3),
+                   "p95_ms": round(_percentile(values, 0.95) * 1000, 3), "max_ms": round(values[-1] * 1000, 3),
+                   "ops_per_s": round(len(values) / sum(values), 1) if sum(values) else None}
+    total = sum(sum(v) for v in latencies.values())
+    return {"megapixels": megapixels, "mode": "color" if color else "gray", "first_paint_s": round(first_paint, 3),
+            "replay_s": round(total, 3), "events": sum(len(v) for v in latencies.values()),
+            "save_drain_s": round(drain, 3), "operations": ops, "timers": PROFILER.summary()}
+
+def print_report(report):
+    print(f"\n== {report['megapixels']} MP {report['mode']}: first paint {report['first_paint_s'] * 1000:.0f} ms, "
+          f"{report['events']} events in {report['replay_s']:.2f} s, saves drained in {report['save_drain_s']:.2f} s")
+    print(f"{'operation':<24}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'ops/s':>10}")
+    for op, s in sorted(report["operations"].items()):
+        print(f"{op:<24}{s['count']:>5}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['max_ms']:>10.1f}"
+              f"{s['ops_per_s'] or 0:>10.1f}")
+    print(f"{'timer':<24}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, s in report["timers"].items():
+        print(f"{name:<24}{s['count']:>5}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['max_ms']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an interaction trace against synthetic scans, headless.")
+    parser.add_argument("--sizes", default="1,12,50", help="comma-separated scan sizes in megapixels")
+    parser.add_argument("--modes", default="gray,color", help="comma-separated: gray, color")
+    parser.add_argument("--trace", help="JSON-lines trace recorded with TRACE_FILE (default: built-in trace)")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the trace this many times per scenario")
+    parser.add_argument("--json", help="also write the full report to this JSON file")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else DEFAULT_TRACE
+    reports = []
+    for size in (float(s) for s in args.sizes.split(",")):
+        for mode in args.modes.split(","):
+            report = run_scenario(size, mode.strip() == "color", trace, repeat=args.repeat)
+            print_report(report)
+            reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nWrote report to {args.json}")
+
+if __name__ == "__main__":
+    main()
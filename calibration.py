@@ -0,0 +1,170 @@
+"""Calibration templates: tick positions, values and units remembered per Protocol/Location.
+
+Images from one device and protocol share their axis layout, so once one of
+them is calibrated the ticks can be found again on the next. With every
+tick a small grayscale patch around it is kept; on a new image each patch
+is located with cv2.matchTemplate, coarse to fine on an image pyramid and
+within a search window around the stored position. The worst patch's
+normalised correlation is the confidence of the whole calibration.
+
+Templates live in the per-user cache, one .npz per key, so they carry over
+between image folders.
+"""
+import io
+import os
+import json
+import hashlib
+import cv2
+import numpy as np
+from image_index import cache_path
+from roi_proposals import as_uint8
+
+AXES = ("horizontal", "vertical")
+PATCH_RADIUS = 48  # source pixels kept on each side of a tick
+
+def template_key(protocol, location):
+    """Case-insensitive key of a Protocol/Location pair, or None when both are empty"""
+    protocol, location = protocol.strip().lower(), location.strip().lower()
+    return f"{protocol}/{location}" if protocol or location else None
+
+def to_gray(img):
+    img = as_uint8(img)
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def _smooth(gray):
+    # Sensor and JPEG noise would otherwise dominate the correlation of mostly flat patches
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+def cut_patch(gray, x, y, radius):
+    """Smoothed square of gray centred on (x, y), clamped to the image; returns it and (x, y) within it"""
+    h, w = gray.shape
+    x0, y0 = max(0, x - radius), max(0, y - radius)
+    x1, y1 = min(w, x + radius + 1), min(h, y + radius + 1)
+    return _smooth(gray[y0:y1, x0:x1]), (x - x0, y - y0)
+
+def _pyramid(img, levels):
+    pyramid = [img]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+def _best(window, patch):
+    scores = cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (x, y) = cv2.minMaxLoc(scores)
+    return x, y, score
+
+def match_patch(gray, patch, expected, search, min_side=12):
+    """Top-left corner of the best match of patch within search pixels of expected, and its score.
+
+    patch comes from cut_patch. Window and patch are halved with pyrDown while the patch keeps at least
+    min_side pixels; the whole window is only searched at the coarsest level,
+    every finer level re-checks +/-2 pixels around the hit of the one above.
+    The corner may lie outside gray for ticks near its border.
+    A patch without contrast cannot be located and scores 0.
+    """
+    ph, pw = patch.shape
+    if ph < min_side or pw < min_side or patch.std() < 2:
+        return None, 0.0
+    h, w = gray.shape
+    ex, ey = expected
+    x0, y0 = ex - search, ey - search
+    x1, y1 = ex + search + pw, ey + search + ph
+    cx0, cy0, cx1, cy1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+    if cx1 - cx0 < pw // 2 or cy1 - cy0 < ph // 2:
+        return None, 0.0
+    # Replicate the border so ticks near the edge of a shifted capture can still be matched
+    window = cv2.copyMakeBorder(gray[cy0:cy1, cx0:cx1], cy0 - y0, y1 - cy1, cx0 - x0, x1 - cx1, cv2.BORDER_REPLICATE)
+    levels = 0
+    while min(ph, pw) >> (levels + 1) >= min_side:
+        levels += 1
+    windows = _pyramid(_smooth(window), levels)
+    patches = _pyramid(patch, levels)
+    bx, by, score = _best(windows[-1], patches[-1])
+    for window, level_patch in zip(windows[-2::-1], patches[-2::-1]):
+        lh, lw = level_patch.shape
+        sx0, sy0 = max(0, 2 * bx - 2), max(0, 2 * by - 2)
+        sx1 = min(window.shape[1], 2 * bx + 3 + lw)
+        sy1 = min(window.shape[0], 2 * by + 3 + lh)
+        bx, by, score = _best(window[sy0:sy1, sx0:sx1], level_patch)
+        bx, by = bx + sx0, by + sy0
+    return (x0 + bx, y0 + by), float(score) if np.isfinite(score) else 0.0
+
+class CalibrationTemplates:
+    """Calibration templates by template_key, loaded from the cache on first use.
+
+    Tick positions are full-resolution source pixels; images passed in may
+    be reduced decodes, with scale their pixels per source pixel.
+    """
+
+    def __init__(self, min_score=0.8, search=0.1):
+        self.min_score = min_score
+        self.search = search
+        self._templates = {}
+
+    def _path(self, key):
+        return cache_path("calibration", f"{hashlib.sha1(key.encode()).hexdigest()[:16]}.npz")
+
+    def get(self, key):
+        if key not in self._templates:
+            self._templates[key] = self._load(key)
+        return self._templates[key]
+
+    def _load(self, key):
+        try:
+            with np.load(self._path(key)) as data:
+                template = json.loads(str(data["meta"]))
+                patches = {name: data[name] for name in data.files if name != "meta"}
+        except (OSError, ValueError, KeyError):
+            return None
+        if template.get("key") != key:
+            return None
+        template["patches"] = patches
+        return template
+
+    def put(self, key, image, scale, ticks, tick_values, tick_units):
+        """Remember ticks {axis: [(x, y), (x, y)]} with their values and units, and patches of image around them"""
+        gray = to_gray(image)
+        radius = max(8, int(round(PATCH_RADIUS * scale)))
+        patches, offsets = {}, {}
+        for axis in AXES:
+            for i, (x, y) in enumerate(ticks[axis]):
+                patch, offset = cut_patch(gray, int(round(x * scale)), int(round(y * scale)), radius)
+                patches[f"{axis}{i}"] = patch
+                offsets[f"{axis}{i}"] = offset
+        template = {"key": key, "scale": scale, "ticks": {axis: [list(t) for t in ticks[axis]] for axis in AXES},
+                    "offsets": offsets, "tick_values": tick_values, "tick_units": tick_units}
+        buffer = io.BytesIO()
+        np.savez(buffer, meta=json.dumps(template), **patches)
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(path + ".tmp", path)
+        template["patches"] = patches
+        self._templates[key] = template
+
+    def match(self, key, image, scale):
+        """Locate key's ticks in image: ({axis: [(x, y), (x, y)]} in source pixels, template, confidence), or None"""
+        template = self.get(key)
+        if template is None:
+            return None
+        gray = to_gray(image)
+        resize = scale / template["scale"]
+        search = max(8, int(self.search * max(gray.shape)))
+        ticks, scores = {}, []
+        for axis in AXES:
+            ticks[axis] = []
+            for i, (x, y) in enumerate(template["ticks"][axis]):
+                name = f"{axis}{i}"
+                patch = template["patches"][name]
+                ox, oy = template["offsets"][name]
+                if abs(resize - 1) > 1e-3:
+                    patch = cv2.resize(patch, None, fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+                    ox, oy = ox * resize, oy * resize
+                expected = (int(round(x * scale - ox)), int(round(y * scale - oy)))
+                corner, score = match_patch(gray, patch, expected, search)
+                scores.append(score)
+                if corner is None:
+                    ticks[axis].append((x, y))
+                else:
+                    ticks[axis].append((int(round((corner[0] + ox) / scale)), int(round((corner[1] + oy) / scale))))
+        return ticks, template, min(scores) if scores else 0.0
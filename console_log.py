@@ -0,0 +1,108 @@
+import sys
+import json
+import logging
+import threading
+from collections import deque
+from tkinter import TclError
+from logging.handlers import RotatingFileHandler
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LEVEL_COLORS = {"WARNING": "#b36b00", "ERROR": "#c00000"}
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({"time": round(record.created, 3), "level": record.levelname, "msg": record.getMessage()})
+
+class ConsoleLog:
+    """Leveled log shown in the Tk console widget, written in batches.
+
+    Messages go into a bounded ring buffer and are inserted into the widget
+    (and stdout) once per flush tick, so a burst of messages costs one
+    insert and one scroll. The widget keeps at most `max_lines` lines. With a
+    `log_file`, every message is also written as a JSON line to a
+    size-rotated file.
+    """
+
+    def __init__(self, root, widget=None, max_lines=2000, flush_ms=100, level="INFO",
+                 log_file="", log_file_max_mb=10, log_file_backups=3):
+        self.root = root
+        self.widget = widget
+        self.max_lines = max_lines
+        self.flush_ms = flush_ms
+        self.level = LEVELS.get(str(level).upper(), LEVELS["INFO"])
+        self.pending = deque(maxlen=max_lines)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._styled = False
+        self.file_logger = None
+        if log_file:
+            handler = RotatingFileHandler(log_file, maxBytes=int(log_file_max_mb * 1024 * 1024),
+                                          backupCount=log_file_backups, encoding="utf-8")
+            handler.setFormatter(JsonLinesFormatter())
+            self.file_logger = logging.getLogger(f"hemodynamics_cleaner.{id(self)}")
+            self.file_logger.propagate = False
+            self.file_logger.setLevel(logging.DEBUG)
+            self.file_logger.addHandler(handler)
+
+    def log(self, msg, level="INFO"):
+        """Queue msg for the next flush tick"""
+        levelno = LEVELS.get(level, LEVELS["INFO"])
+        if levelno < self.level:
+            return
+        msg = str(msg)
+        if self.file_logger is not None:
+            self.file_logger.log(levelno, msg)
+        with self._lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append((level, msg))
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            try:
+                self.root.after(self.flush_ms, self.flush)
+            except (TclError, RuntimeError, AttributeError):
+                # no Tk loop (yet, or any more): write straight through
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+            self._scheduled = False
+        if not entries:
+            return
+        if dropped:
+            entries.insert(0, ("WARNING", f"({dropped} older messages not shown)"))
+        sys.stdout.write("".join(f"{msg}\n" if level == "INFO" else f"[{level}] {msg}\n"
+                                 for level, msg in entries))
+        if self.widget is not None:
+            self._insert(entries)
+
+    def _insert(self, entries):
+        if not self._styled:
+            for level, color in LEVEL_COLORS.items():
+                self.widget.tag_configure(level, foreground=color)
+            self._styled = True
+        run, run_level = [], None
+        for level, msg in entries:
+            if level != run_level and run:
+                self.widget.insert("end", "".join(run), run_level)
+                run = []
+            run_level = level
+            run.append(msg + "\n")
+        self.widget.insert("end", "".join(run), run_level)
+        # every message ends in a newline, so "end-1c" sits on an empty line after the last one
+        lines = int(self.widget.index("end-1c").split(".")[0]) - 1
+        if lines > self.max_lines:
+            self.widget.delete("1.0", f"{lines - self.max_lines + 1}.0")
+        self.widget.see("end")
+
+    def close(self):
+        self.flush()
+        if self.file_logger is not None:
+            for handler in list(self.file_logger.handlers):
+                handler.close()
+                self.file_logger.removeHandler(handler)
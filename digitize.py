@@ -0,0 +1,241 @@
+"""Turn saved ECG/Waveform ROIs into calibrated time series.
+
+    python digitize.py /path/to/images [--db results.sqlite] [--workers N] [--parquet traces.parquet]
+
+For every image in the results store that has ROIs and a complete tick
+calibration, each saved ROI file is read, the trace is extracted column by
+column and mapped to physical units through the horizontal (time) and
+vertical (value) ticks. Each ROI gets a .npy beside it: a structured array
+with fields "t" and "value" in the row's horizontal_units/vertical_units.
+--parquet also writes every sample of every ROI to one long table.
+"""
+import os
+import json
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from file_utils import load_config
+from results_store import ResultsStore, default_db_path
+from roi_proposals import trace_mask
+
+SERIES_DTYPE = np.dtype([("t", "<f8"), ("value", "<f4")])
+
+def _axis_map(p1, p2, v1, v2):
+    """(slope, offset) mapping a pixel coordinate to units through two ticks, or None if degenerate"""
+    try:
+        p1, p2, v1, v2 = float(p1), float(p2), float(v1), float(v2)
+    except (TypeError, ValueError):
+        return None
+    if p1 == p2:
+        return None
+    slope = (v2 - v1) / (p2 - p1)
+    return slope, v1 - slope * p1
+
+def calibration_from_row(row):
+    """Pixel->unit maps from a metadata_row: {"t": (slope, offset), "value": (slope, offset), units}, or None.
+
+    Horizontal ticks calibrate x (time), vertical ticks calibrate y (value).
+    """
+    t = _axis_map(row.get("horizontal_tick1_px"), row.get("horizontal_tick2_px"),
+                  row.get("horizontal_tick1_value"), row.get("horizontal_tick2_value"))
+    value = _axis_map(row.get("vertical_tick1_py"), row.get("vertical_tick2_py"),
+                      row.get("vertical_tick1_value"), row.get("vertical_tick2_value"))
+    if t is None or value is None:
+        return None
+    return {"t": t, "value": value, "t_units": row.get("horizontal_units", ""),
+            "value_units": row.get("vertical_units", "")}
+
+def _runs(rows):
+    """(first, last) of every run of consecutive indices in sorted rows"""
+    if not rows.size:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    return list(zip(np.concatenate(([rows[0]], rows[breaks + 1])).tolist(),
+                    np.concatenate((rows[breaks], [rows[-1]])).tolist()))
+
+def grid_rows(mask, max_thickness=3):
+    """Rows of thin bands spanning (almost) the whole width: grid lines and panel borders rather than a trace"""
+    grid = np.zeros(mask.shape[0], bool)
+    for first, last in _runs(np.flatnonzero(mask.mean(axis=1) > 0.8)):
+        if last - first < max_thickness:
+            grid[first:last + 1] = True
+    return grid
+
+def _nearest_run(runs, last):
+    """Run closest to the run last (0 if they touch or overlap) and that distance"""
+    def gap(r):
+        return max(r[0] - last[1] - 1, last[0] - r[1] - 1, 0)
+    run = min(runs, key=lambda r: (gap(r), abs(r[0] + r[1] - last[0] - last[1])))
+    return run, gap(run)
+
+def _follow(mask, grid, trace, cols, last, missed=0):
+    """Follow the trace through cols from the run last, setting trace at each column it is found in"""
+    in_grid = np.concatenate(([0], np.cumsum(grid))).tolist()
+    for c in cols:
+        runs = _runs(np.flatnonzero(mask[:, c]))
+        # A run that is nothing but grid line only counts right where the trace was
+        off_grid = [r for r in runs if in_grid[r[1] + 1] - in_grid[r[0]] <= r[1] - r[0]]
+        run, distance = _nearest_run(off_grid, last) if off_grid else (None, None)
+        if run is None or distance > 3 * missed:
+            run, distance = _nearest_run(runs, last) if runs else (None, None)
+            if run is None or distance > 1:
+                missed += 1
+                continue
+        last, missed = run, 0
+        trace[c] = (run[0] + run[1]) / 2
+
+def extract_trace(roi, max_gap=3):
+    """Trace row (float, NaN where a column has no trace pixels) for every column of roi.
+
+    Grid lines are set aside and every column with a single run of trace
+    pixels left takes its centre, so a line several pixels thick yields its
+    centre. Only columns with several runs (text, other curves, the trace
+    cut by a grid line) are followed one by one from their resolved
+    neighbours, taking the run nearest (ideally touching) the previous
+    column's. Gaps of up to max_gap columns (e.g. where a vertical grid line
+    was dropped) are interpolated.
+    """
+    mask = trace_mask(roi, drop_rows=False)
+    grid = grid_rows(mask)
+    clean = mask & ~grid[:, None]
+    if not clean.any():
+        # Nothing but full-width lines: a flat trace, or no trace at all
+        grid = np.zeros_like(grid)
+        clean = mask
+    h, w = mask.shape
+    rows = np.arange(h, dtype=np.float64)[:, None]
+    counts = clean.sum(axis=0)
+    sums = (clean * rows).sum(axis=0)
+    trace = np.divide(sums, counts, out=np.full(w, np.nan), where=counts > 0)
+    n_runs = clean[0].astype(np.int32) + (clean[1:] & ~clean[:-1]).sum(axis=0)
+    ambiguous = n_runs > 1
+    trace[ambiguous] = np.nan
+    if ambiguous.any():
+        resolved = np.flatnonzero(~np.isnan(trace))
+        top = np.argmax(clean, axis=0)
+        bottom = h - 1 - np.argmax(clean[::-1], axis=0)
+        for first, last in _runs(np.flatnonzero(ambiguous)):
+            i = np.searchsorted(resolved, first)
+            if i > 0:
+                c = resolved[i - 1]
+                _follow(mask, grid, trace, range(first, last + 1), (top[c], bottom[c]), first - c - 1)
+            elif i < len(resolved):
+                c = resolved[i]
+                _follow(mask, grid, trace, range(last, first - 1, -1), (top[c], bottom[c]), c - last - 1)
+            else:
+                # No column has a single run: seed from the widest component
+                n, labels, stats, _ = cv2.connectedComponentsWithStats(clean.astype(np.uint8), connectivity=8)
+                seed = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_WIDTH]))
+                seed_col = stats[seed, cv2.CC_STAT_LEFT]
+                seed_rows = np.flatnonzero(labels[:, seed_col] == seed)
+                seed_run = (seed_rows[0], seed_rows[-1])
+                _follow(mask, grid, trace, range(seed_col, last + 1), seed_run)
+                _follow(mask, grid, trace, range(seed_col - 1, first - 1, -1), seed_run)
+    missing = np.isnan(trace)
+    for first, last in _runs(np.flatnonzero(missing)):
+        if last - first < max_gap and first > 0 and last < len(trace) - 1:
+            trace[first:last + 1] = np.interp(np.arange(first, last + 1), [first - 1, last + 1],
+                                               [trace[first - 1], trace[last + 1]])
+    return trace
+
+def digitize_roi(roi, rect, calibration):
+    """Structured (t, value) samples for an ROI cut at rect (x0, y0, x1, y1[, mode]) of the calibrated image"""
+    x0, y0 = rect[0], rect[1]
+    ys = extract_trace(roi) + y0
+    xs = np.arange(roi.shape[1], dtype=np.float64) + x0
+    series = np.empty(len(xs), SERIES_DTYPE)
+    slope, offset = calibration["t"]
+    series["t"] = xs * slope + offset
+    slope, offset = calibration["value"]
+    series["value"] = ys * slope + offset
+    return series
+
+def series_path(path):
+    return os.path.splitext(path)[0] + ".npy"
+
+def save_series(path, series):
+    np.save(path, series)
+
+def digitize_image(item, ext=".png"):
+    """Digitize every saved ROI of one results row; returns (image path, [(npy path, series)], error)"""
+    from image_ops import roi_path
+    image_path, row = item
+    out = []
+    try:
+        calibration = calibration_from_row(row)
+        if calibration is None:
+            raise ValueError("incomplete tick calibration")
+        for idx, rect in enumerate(json.loads(row.get("roi_rectangles") or "[]")):
+            x0, y0, x1, y1, mode = rect
+            path = roi_path(image_path, idx, mode, ext)
+            if not os.path.exists(path):
+                # ROIs deeper than 8 bits are saved as PNG or TIFF whatever ROI_FORMAT says
+                path = next((p for p in (roi_path(image_path, idx, mode, e) for e in (".png", ".tiff"))
+                             if os.path.exists(p)), path)
+            roi = cv2.imread(path, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+            if roi is None:
+                raise IOError(f"could not read ROI {path}")
+            series = digitize_roi(roi, (max(0, min(x0, x1)), max(0, min(y0, y1))), calibration)
+            save_series(series_path(path), series)
+            out.append((series_path(path), series))
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return image_path, out, error
+
+def _init_worker():
+    cv2.setNumThreads(1)
+
+def digitize_all(db_path, workers=None, parquet_path=None, ext=None):
+    """Digitize every calibrated image with ROIs in a results store, one worker process per core"""
+    ext = ext or load_config()["ROI_FORMAT"]
+    store = ResultsStore(db_path)
+    columns, rows = store.rows()
+    store.close()
+    items = [(r[0], dict(zip(columns, r))) for r in rows]
+    items = [(path, row) for path, row in items if json.loads(row.get("roi_rectangles") or "[]")]
+    workers = workers or os.cpu_count() or 1
+    print(f"Digitizing ROIs of {len(items)} images with {workers} workers")
+
+    start = time.perf_counter()
+    n_rois = n_samples = 0
+    failed = []
+    tables = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        chunksize = max(1, min(32, len(items) // (workers * 4) or 1))
+        for image_path, out, error in pool.map(partial(digitize_image, ext=ext), items, chunksize=chunksize):
+            if error:
+                failed.append((image_path, error))
+                print(f"[FAILED] {image_path} - {error}")
+            for path, series in out:
+                n_rois += 1
+                n_samples += len(series)
+                if parquet_path:
+                    tables.append((image_path, os.path.basename(path), series))
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {n_rois} series ({n_samples} samples) in {elapsed:.1f} s, {len(failed)} images failed")
+
+    if parquet_path and tables:
+        import pandas as pd
+        frames = [pd.DataFrame({"image": image, "roi": name, "t": series["t"], "value": series["value"]})
+                  for image, name, series in tables]
+        pd.concat(frames, ignore_index=True).to_parquet(parquet_path, index=False)
+        print(f"Wrote {parquet_path}")
+    return n_rois, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Digitize saved ROIs into calibrated time series.")
+    parser.add_argument("image_dir", help="annotated image directory")
+    parser.add_argument("--db", default=None, help="results store (default: results.sqlite in image_dir)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--parquet", default=None, help="also write all samples to this Parquet file")
+    args = parser.parse_args(argv)
+    _, failed = digitize_all(args.db or default_db_path(args.image_dir), workers=args.workers,
+                             parquet_path=args.parquet)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,217 @@
+"""Perceptual-hash index of an image folder, grouping duplicate and near-duplicate frames.
+
+    python duplicates.py /path/to/images [--distance 12] [--workers N]
+
+Every image gets a 256-bit perceptual hash (pHash) of a small grayscale
+thumbnail. Hashes are computed in a process pool and cached per folder,
+keyed by path and mtime, so a re-opened folder only hashes new or changed
+files. Images in sorted order join the group of the first earlier image
+whose hash differs in at most `distance` bits, found through a BK-tree.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from image_index import DirectoryIndex, cache_path
+
+HASH_SIZE = 16
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def phash(img, size=HASH_SIZE):
+    """size*size-bit hash: which of the lowest-frequency DCT coefficients of a 4*size square thumbnail exceed their median.
+
+    Monitor screenshots are mostly flat background, where comparing
+    neighbouring pixels (dHash) flips on sensor and JPEG noise; the low
+    frequencies only change with the layout and the traces.
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (4 * size, 4 * size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coefficients = cv2.dct(small)[:size, :size].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hash_file(path):
+    """(path, pHash or None, error).
+
+    Decodes at 1/2 resolution: JPEG rounds reduced sizes up and PNG rounds
+    them down, and at 1/4 or 1/8 that pixel of difference already moves the
+    thumbnail enough to flip bits between copies of one frame.
+    """
+    try:
+        img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        if img is None:
+            raise IOError("could not read image")
+        return path, phash(img), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+def _init_worker():
+    cv2.setNumThreads(1)
+
+class BKTree:
+    """Burkhard-Keller tree of integer hashes under Hamming distance.
+
+    Nodes are (hash, item, {distance: child}); a radius search only descends
+    into children whose edge distance is within radius of the query's
+    distance to the node.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (h, item, {})
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, item, {})
+                return
+            node = child
+
+    def search(self, h, radius):
+        """(distance, item) for every entry within radius bits of h, nearest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_hash, item, children = stack.pop()
+            d = hamming(h, node_hash)
+            if d <= radius:
+                found.append((d, item))
+            stack.extend(child for edge, child in children.items() if d - radius <= edge <= d + radius)
+        return sorted(found, key=lambda f: f[0])
+
+class DuplicateIndex:
+    """Cached pHashes of one folder and the near-duplicate groups they form.
+
+    representative maps every hashed image to the first image of its group
+    (itself if it starts one); it is replaced in one assignment, so the Tk
+    thread can read it while update() runs in the background.
+    """
+
+    def __init__(self, root, distance=12):
+        self.root = os.path.abspath(root)
+        self.distance = distance
+        key = hashlib.sha1(self.root.encode()).hexdigest()[:16]
+        self.cache_file = cache_path("phash", f"{key}.json")
+        self.hashes = self._load()
+        self.failed = []
+        self.representative = self._group(self.hashes)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Make a running update() stop after the images being hashed now, keeping what it has"""
+        self._cancel.set()
+
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {path: tuple(entry) for path, entry in data.get("hashes", {}).items()} \
+            if data.get("root") == self.root else {}
+
+    def save(self):
+        tmp = self.cache_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"root": self.root, "hashes": self.hashes}, f)
+        os.replace(tmp, self.cache_file)
+
+    def update(self, file_stats, workers=1):
+        """Hash images of {path: (size, mtime)} that are new or changed, regroup and save; returns the number hashed"""
+        hashes = {path: self.hashes[path] for path, (_, mtime) in file_stats.items()
+                  if path in self.hashes and self.hashes[path][0] == mtime}
+        todo = sorted(set(file_stats) - set(hashes))
+        failed = []
+        # Small updates are not worth starting worker processes for
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) \
+            if workers > 1 and len(todo) >= 16 else None
+        try:
+            results = pool.map(hash_file, todo, chunksize=max(1, min(16, len(todo) // (workers * 4)))) \
+                if pool is not None else map(hash_file, todo)
+            for path, h, error in results:
+                if error:
+                    failed.append((path, error))
+                else:
+                    hashes[path] = (file_stats[path][1], h)
+                if self._cancel.is_set():
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        self.hashes = hashes
+        self.failed = failed
+        self.representative = self._group(hashes)
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Could not save hash cache {self.cache_file}: {e}")
+        return len(todo)
+
+    def _group(self, hashes):
+        tree = BKTree()
+        representative = {}
+        for path in sorted(hashes):
+            h = hashes[path][1]
+            match = tree.search(h, self.distance)
+            if match:
+                representative[path] = match[0][1]
+            else:
+                tree.add(h, path)
+                representative[path] = path
+        return representative
+
+    def duplicate_of(self, path):
+        """First image of path's group if path is a near-duplicate of it, else None"""
+        original = self.representative.get(path)
+        return original if original is not None and original != path else None
+
+    def groups(self):
+        """{first image: [its near-duplicates]} for every group with more than one image"""
+        groups = {}
+        for path, original in self.representative.items():
+            if original != path:
+                groups.setdefault(original, []).append(path)
+        return {original: sorted(members) for original, members in sorted(groups.items())}
+
+    def duplicate_count(self):
+        return sum(1 for path, original in self.representative.items() if original != path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List duplicate and near-duplicate images in a folder.")
+    parser.add_argument("image_dir", help="image directory")
+    parser.add_argument("--distance", type=int, default=12, help="largest Hamming distance between near-duplicates")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    listing = DirectoryIndex(args.image_dir)
+    listing.all_files()
+    listing.refresh_stats()
+    index = DuplicateIndex(args.image_dir, args.distance)
+    n = index.update(listing.file_stats(), workers=args.workers or os.cpu_count() or 1)
+    groups = index.groups()
+    for original, members in groups.items():
+        print(original)
+        for path in members:
+            print(f"    {path}")
+    for path, error in index.failed:
+        print(f"[FAILED] {path} - {error}")
+    print(f"Hashed {n} of {len(index.hashes)} images in {time.perf_counter() - start:.1f} s: "
+          f"{index.duplicate_count()} near-duplicates in {len(groups)} groups")
+
+if __name__ == "__main__":
+    main()
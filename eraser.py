@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+def erase_color(image):
+    """White at the image's bit depth (float images are taken to be 0-1)"""
+    white = float(np.iinfo(image.dtype).max) if np.issubdtype(image.dtype, np.integer) else 1.0
+    return (white,) * 3
+
+def _paint_segment(image, p0, p1, radius):
+    color = erase_color(image)
+    if p0 != p1:
+        cv2.line(image, p0, p1, color, 2 * radius)
+    cv2.circle(image, p1, radius, color, -1)
+
+def paint_stroke(image, points, radius):
+    """Replay a recorded stroke into image in place"""
+    for i, p in enumerate(points):
+        _paint_segment(image, tuple(points[i - 1]) if i else tuple(p), tuple(p), radius)
+    return image
+
+class EraserStroke:
+    """One press-drag-release eraser stroke painted into image in place.
+
+    Every added point returns the (x0, y0, x1, y1) image region it changed so
+    the display only has to re-scale that band. The pixels under the whole
+    stroke are kept in `before` so it can be undone as a region delta.
+    """
+
+    def __init__(self, image, radius):
+        self.image = image
+        self.radius = max(1, int(radius))
+        self.points = []
+        self.bbox = None
+        self.before = None
+
+    def add_point(self, x, y):
+        r = self.radius
+        px, py = self.points[-1] if self.points else (x, y)
+        h, w = self.image.shape[:2]
+        box = (max(0, min(px, x) - r), max(0, min(py, y) - r),
+               min(w, max(px, x) + r + 1), min(h, max(py, y) + r + 1))
+        self._capture(box)
+        _paint_segment(self.image, (px, py), (x, y), r)
+        self.points.append((x, y))
+        return box
+
+    def _capture(self, box):
+        """Grow the saved pre-stroke pixels to cover box before it is painted"""
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return
+        if self.bbox is None:
+            self.bbox = box
+            self.before = self.image[box[1]:box[3], box[0]:box[2]].copy()
+            return
+        ox0, oy0, ox1, oy1 = self.bbox
+        ux0, uy0 = min(ox0, box[0]), min(oy0, box[1])
+        ux1, uy1 = max(ox1, box[2]), max(oy1, box[3])
+        if (ux0, uy0, ux1, uy1) == self.bbox:
+            return
+        before = self.image[uy0:uy1, ux0:ux1].copy()
+        before[oy0 - uy0:oy1 - uy0, ox0 - ux0:ox1 - ux0] = self.before
+        self.bbox, self.before = (ux0, uy0, ux1, uy1), before
+
+    def as_operation(self):
+        return ("erase", {"points": list(self.points), "radius": self.radius,
+                          "bbox": self.bbox, "before": self.before})
@@ -1,35 +1,112 @@
-from file_utils import log_to_console, update_progress
+import math
+import time
+from file_utils import log_to_console
+from profiler import PROFILER
+from session_trace import traced_event
+
+class FrameScheduler:
+    """Coalesces redraw requests so at most one frame is rendered per `frame_ms`.
+
+    request(name, callback) queues callback under name, replacing an earlier
+    request with the same name that has not run yet (counted as merged).
+    Pending callbacks run together, in first-request order, from after_idle
+    once the frame budget since the previous frame has passed, or from a
+    timer for the rest of it. Events ignored before they reach the scheduler
+    are counted with drop().
+    """
+
+    def __init__(self, root, frame_ms=16):
+        self.root = root
+        self.frame_ms = frame_ms
+        self._pending = {}
+        self._scheduled = False
+        self._last_frame = 0.0
+        self.requests = 0
+        self.merged = 0
+        self.dropped = 0
+        self.frames = 0
+        self.over_budget = 0
+
+    def request(self, name, callback):
+        self.requests += 1
+        if name in self._pending:
+            self.merged += 1
+        self._pending[name] = callback
+        if not self._scheduled:
+            self._scheduled = True
+            wait = self.frame_ms - (time.perf_counter() - self._last_frame) * 1000
+            if wait > 1:
+                self.root.after(int(wait), self.run)
+            else:
+                self.root.after_idle(self.run)
+
+    def drop(self):
+        self.dropped += 1
+
+    def run(self):
+        """Render everything requested so far; also called directly to flush before a final action"""
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        start = time.perf_counter()
+        with PROFILER.timer("frame.render"):
+            for callback in pending.values():
+                callback()
+        self._last_frame = time.perf_counter()
+        self.frames += 1
+        if (self._last_frame - start) * 1000 > self.frame_ms:
+            self.over_budget += 1
+
+    def stats(self):
+        return {"requests": self.requests, "merged": self.merged, "dropped": self.dropped,
+                "frames": self.frames, "over_budget": self.over_budget}
 
 def bind_events(app):
     """Bind all canvas and window events to their handlers"""
     app.canvas.bind("<Button-1>", lambda e: on_image_click(app, e))
     app.canvas.bind("<B1-Motion>", lambda e: on_image_drag(app, e))
     app.canvas.bind("<ButtonRelease-1>", lambda e: on_image_release(app, e))
+    app.canvas.bind("<Configure>", lambda e: app.scheduler.request("tiles", app.viewer.update_visible))
+    app.canvas.bind("<MouseWheel>", lambda e: on_mouse_wheel(app, e, -1 if e.delta > 0 else 1))
+    app.canvas.bind("<Button-4>", lambda e: on_mouse_wheel(app, e, -1))
+    app.canvas.bind("<Button-5>", lambda e: on_mouse_wheel(app, e, 1))
+    app.canvas.bind("<Shift-MouseWheel>", lambda e: on_mouse_wheel(app, e, -1 if e.delta > 0 else 1, "x"))
+    app.canvas.bind("<Control-MouseWheel>", lambda e: app.zoom_at(1 if e.delta > 0 else -1, e.x, e.y))
+    app.canvas.bind("<Control-Button-4>", lambda e: app.zoom_at(1, e.x, e.y))
+    app.canvas.bind("<Control-Button-5>", lambda e: app.zoom_at(-1, e.x, e.y))
+    if getattr(app, "filmstrip_canvas", None) is not None:
+        app.filmstrip_canvas.bind("<Button-1>", lambda e: app.go_to_image(app.filmstrip.index_at(e.x)))
+        app.filmstrip_canvas.bind("<Configure>", lambda e: app.scheduler.request("filmstrip", app.update_filmstrip))
+        app.filmstrip_canvas.bind("<MouseWheel>", lambda e: app.scroll_filmstrip("scroll", -1 if e.delta > 0 else 1, "units"))
+        app.filmstrip_canvas.bind("<Button-4>", lambda e: app.scroll_filmstrip("scroll", -1, "units"))
+        app.filmstrip_canvas.bind("<Button-5>", lambda e: app.scroll_filmstrip("scroll", 1, "units"))
     app.root.bind("<Configure>", lambda e: on_window_resize(app, e))
     app.root.bind("<Escape>", lambda e: cancel_operations(app))
+    app.root.bind("<Control-z>", lambda e: app.undo_edit())
+    app.root.bind("<Control-y>", lambda e: app.redo_edit())
+    app.root.protocol("WM_DELETE_WINDOW", app.on_close)
 
 def _canvas_to_image_coords(app, canvas_x, canvas_y):
-    """Convert canvas coordinates to image coordinates"""
-    if not hasattr(app, "rotated_image") or app.rotated_image is None:
+    """Convert scrolled canvas coordinates (canvasx/canvasy) to image coordinates at the current zoom"""
+    if not app.display_scale:
         return 0, 0
-    img_w = app.rotated_image.shape[1]
-    img_h = app.rotated_image.shape[0]
-    scale_x = app.displayed_image_width / img_w
-    img_x = int(canvas_x / scale_x)
-    img_y = int(canvas_y / scale_x)
+    img_x = int(math.floor(canvas_x / app.display_scale))
+    img_y = int(math.floor(canvas_y / app.display_scale))
     return img_x, img_y
 
+@traced_event("click")
+@PROFILER.timed("event.click")
 def on_image_click(app, event):
     """Handle mouse click events on the image"""
-    canvas_x = int(app.canvas.canvasx(event.x))
-    canvas_y = int(app.canvas.canvasy(event.y))
+    canvas_x = app.canvas.canvasx(event.x)
+    canvas_y = app.canvas.canvasy(event.y)
     img_x, img_y = _canvas_to_image_coords(app, canvas_x, canvas_y)
 
     if app.drawing_mode == "erase":
-        import cv2
-        cv2.circle(app.cv_image, (img_x, img_y), 10, (255, 255, 255), -1)
-        app.last_erase_point = (img_x, img_y)
-    elif app.crop_mode and app.roi_mode:
+        app.begin_erase_stroke(img_x, img_y)
+        return
+    elif app.crop_mode:
         app.crop_start = (img_x, img_y)
         app.crop_rect = (img_x, img_y, img_x, img_y)
     
@@ -37,7 +114,6 @@ def on_image_click(app, event):
         if len(app.horizontal_ticks) < 2:
             app.horizontal_ticks.append((img_x, img_y))
             log_to_console(app, f"Added horizontal tick at ({img_x}, {img_y})")
-            app.update_display()
         if len(app.horizontal_ticks) == 2:
             app.drawing_mode = None
             app.horz_tick1_entry.config(state='normal')
@@ -50,7 +126,6 @@ def on_image_click(app, event):
         if len(app.vertical_ticks) < 2:
             app.vertical_ticks.append((img_x, img_y))
             log_to_console(app, f"Added vertical tick at ({img_x}, {img_y})")
-            app.update_display()
         if len(app.vertical_ticks) == 2:
             app.drawing_mode = None
             app.vert_tick1_entry.config(state='normal')
@@ -59,32 +134,36 @@ def on_image_click(app, event):
             app.save_vertical_ticks_btn.config(state='normal')
             app.clear_vertical_ticks_btn.config(state='normal')
 
-    app.update_display()
+    app.update_overlays()
 
+@traced_event("drag")
+@PROFILER.timed("event.drag")
 def on_image_drag(app, event):
     """Handle mouse drag events on the image"""
-    if not hasattr(app, "rotated_image") or app.rotated_image is None:
+    if not app.display_scale:
         return
-    
-    canvas_x = int(app.canvas.canvasx(event.x))
-    canvas_y = int(app.canvas.canvasy(event.y))
+
+    canvas_x = app.canvas.canvasx(event.x)
+    canvas_y = app.canvas.canvasy(event.y)
     img_x, img_y = _canvas_to_image_coords(app, canvas_x, canvas_y)
 
-    if app.drawing_mode == "erase" and hasattr(app, 'last_erase_point'):
-        x1, y1 = app.last_erase_point
-        x2, y2 = img_x, img_y
-        app.last_erase_point = (x2, y2)
-        import cv2
-        cv2.line(app.cv_image, (x1, y1), (x2, y2), (255, 255, 255), 10)
+    if app.drawing_mode == "erase" and app.erase_stroke is not None:
+        app.continue_erase_stroke(img_x, img_y)
     elif app.crop_mode and app.crop_start:
         x0, y0 = app.crop_start
         app.crop_rect = (x0, y0, img_x, img_y)
+        app.scheduler.request("overlays", app.update_overlays)
 
-    app.update_display()
-
+@traced_event("release")
+@PROFILER.timed("event.release")
 def on_image_release(app, event):
     """Handle mouse release events on the image"""
-    if app.crop_mode and app.crop_start and app.crop_rect:
+    app.scheduler.run()
+    app.finish_erase_stroke()
+    if app.crop_mode and app.crop_start and app.crop_rect and not app.roi_mode:
+        app.crop_start = None
+        app.crop_image()
+    elif app.crop_mode and app.crop_start and app.crop_rect:
         x0, y0, x1, y1 = map(int, app.crop_rect)
         x0, x1 = sorted([x0, x1])
         y0, y1 = sorted([y0, y1])
@@ -95,12 +174,24 @@ def on_image_release(app, event):
         app.crop_rect = None
         app.crop_mode = False
         app.roi_mode = None
-        app.update_display()
-        update_progress(app)
+        app.update_overlays()
+
+def on_mouse_wheel(app, event, units, axis="y"):
+    """Scroll the zoomed image; the viewer renders tiles that scroll into view"""
+    app.scroll_view(axis, "scroll", units, "units")
 
 def on_window_resize(app, event):
-    """Handle window resize events"""
-    if app.cv_image is not None:
+    """Handle real root window size changes; <Configure> also fires for every child widget and for moves"""
+    size = (event.width, event.height)
+    if event.widget is not app.root or size == app.root_size:
+        app.scheduler.drop()
+        return
+    app.root_size = size
+    app.scheduler.request("resize", lambda: _first_display(app))
+
+def _first_display(app):
+    """The cached bitmap only needs building once"""
+    if app.source_image is not None and app.display_scale is None:
         app.update_display()
 
 def cancel_operations(app):
@@ -110,4 +201,4 @@ def cancel_operations(app):
     app.crop_start = None
     app.crop_rect = None
     app.roi_mode = None
-    app.update_display()
+    app.update_overlays()
@@ -1,20 +1,78 @@
 import os
+import json
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.txt")
+DEFAULT_CONFIG = {
+    "WINDOW_TITLE": "Medical Image Processor",
+    "PREFETCH_AHEAD": 3,
+    "PREFETCH_WORKERS": 2,
+    "CACHE_MAX_MB": 512,
+    "ERASER_RADIUS": 5,
+    "HISTORY_MAX_MB": 256,
+    "HISTORY_KEYFRAME_EVERY": 8,
+    "SAVE_WORKERS": 2,
+    "ROI_FORMAT": ".png",
+    "PNG_COMPRESSION": 3,
+    "TILE_SIZE": 256,
+    "TILE_CACHE": 256,
+    "MAX_ZOOM": 8.0,
+    "PREVIEW_DECODE": True,
+    "LOG_LEVEL": "INFO",
+    "LOG_MAX_LINES": 2000,
+    "LOG_FLUSH_MS": 100,
+    "LOG_FILE": "",
+    "LOG_FILE_MAX_MB": 10,
+    "LOG_FILE_BACKUPS": 3,
+    "PROFILE_ENABLED": True,
+    "PROFILE_WINDOW": 500,
+    "PROFILE_HUD": False,
+    "PROFILE_FILE": "",
+    "TRACE_FILE": "",
+    "AUTO_ROI": True,
+    "DIGITIZE_ON_SAVE": True,
+    "DUPLICATE_ACTION": "inherit",
+    "DUPLICATE_DISTANCE": 12,
+    "DUPLICATE_WORKERS": 2,
+    "SESSION_CHECKPOINT": True,
+    "FRAME_BUDGET_MS": 16,
+    "STARTUP_BUDGET_MS": 500,
+    "CALIBRATION_TEMPLATES": True,
+    "CALIBRATION_MIN_SCORE": 0.8,
+    "CALIBRATION_SEARCH": 0.1,
+    "FILMSTRIP": True,
+    "THUMBNAIL_SIZE": 128,
+    "THUMBNAIL_WORKERS": 2,
+    "WORK_SHARING": False,
+    "ANNOTATOR": "",
+    "LEASE_MINUTES": 15,
+    "ROI_EXPORT": "files",
+    "ROI_SHARD_MB": 1024,
+}
+
+# Stages shown in the progress label when PROFILE_HUD is on
+HUD_TIMERS = ("event.drag", "frame.render", "viewer.update_visible", "annotations.draw", "cache.get")
+
+def load_config(path=CONFIG_PATH):
+    """Read the JSON settings in config.txt over the built-in defaults"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path) as f:
+            config.update(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"Using default settings, could not read {path}: {e}")
+    return config
 
 def find_all_images(directory=".", exts=None):
-    if exts is None:
-        exts = [".png", ".jpg", ".jpeg", ".bmp", ".tiff"]
-    image_files = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in exts):
-                image_files.append(os.path.join(root, file))
-    return sorted(image_files)
-
-def log_to_console(app, msg):
-    if hasattr(app, "log_text") and app.log_text:
-        app.log_text.insert("end", str(msg) + "\n")
-        app.log_text.see("end")
-    print(msg)
+    from image_index import DirectoryIndex, IMAGE_EXTS
+    return DirectoryIndex(directory, exts or IMAGE_EXTS).all_files()
+
+def log_to_console(app, msg, level="INFO"):
+    """Log through the app's batched ConsoleLog, or straight to stdout before it exists"""
+    console = getattr(app, "console", None)
+    if console is not None:
+        console.log(msg, level)
+    else:
+        print(msg if level == "INFO" else f"[{level}] {msg}")
 
 def update_progress(app):
     if hasattr(app, "progress_label") and app.progress_label:
@@ -25,10 +83,30 @@ def update_progress(app):
             status.append(f"HorizTicks: {len(app.horizontal_ticks)}")
         if hasattr(app, "vertical_ticks"):
             status.append(f"VertTicks: {len(app.vertical_ticks)}")
+        if getattr(app, "calibration_score", None) is not None:
+            status.append(f"Calibration match: {app.calibration_score:.2f}")
         # Add images remaining
         if hasattr(app, "image_files") and hasattr(app, "current_index"):
             remaining = len(app.image_files) - app.current_index
             status.append(f"Images left: {remaining}")
+        if getattr(app, "duplicates", None) is not None and app.duplicates.representative:
+            status.append(f"Near-duplicates: {app.duplicates.duplicate_count()}")
+        if getattr(app, "work", None) is not None and app.work_stats:
+            mine = app.work_stats.get(app.work.annotator, {})
+            status.append(f"Done by me: {mine.get('done', 0)} | Team: {len(app.work_stats)} annotators, "
+                          f"{sum(s['per_hour'] for s in app.work_stats.values()):.0f}/h")
+        if hasattr(app, "image_cache"):
+            status.append(f"Cache: {app.image_cache.hits} hit / {app.image_cache.misses} miss")
+        if hasattr(app, "save_queue"):
+            if app.save_queue.pending:
+                status.append(f"Saves pending: {app.save_queue.pending}")
+            if app.save_queue.failed:
+                status.append(f"Saves failed: {len(app.save_queue.failed)}")
+        if getattr(app, "config", {}).get("PROFILE_HUD"):
+            from profiler import PROFILER
+            hud = PROFILER.hud_text(HUD_TIMERS)
+            if hud:
+                status.append(hud)
         app.progress_label.config(text=" | ".join(status))
 
 def log_images_remaining(app):
@@ -0,0 +1,114 @@
+"""Virtualized filmstrip of the folder's thumbnails, for jumping to any image.
+
+Only the cells in view exist as canvas items. A pool of (image, frame,
+label) items one cell wider than the view is re-pointed at whichever images
+scroll in, cell i always using pool slot i % len(pool), so drawing,
+scrolling or jumping costs the same in a folder of any size and a scroll by
+one cell only re-renders the cell that came into view.
+"""
+import cv2
+from PIL import Image, ImageTk
+
+CELL_PAD = 6
+LABEL_HEIGHT = 14
+# Frame colour per annotation_status
+STATUS_COLORS = {"saved": "green3", "edited": "orange", "claimed": "deepskyblue", "duplicate": "purple", None: "gray50"}
+
+class Filmstrip:
+    """Thumbnail strip on a horizontally scrolled canvas.
+
+    status(path) gives an image's annotation status (a STATUS_COLORS key);
+    thumbnails is a ThumbnailCache.
+    """
+
+    def __init__(self, canvas, thumbnails, status, photo_image=None):
+        self.canvas = canvas
+        self.thumbnails = thumbnails
+        self.status = status
+        self.photo_image = photo_image or ImageTk.PhotoImage
+        self.cell = thumbnails.max_side + 2 * CELL_PAD
+        self.height = self.cell + LABEL_HEIGHT
+        self.files = []
+        self.current = None
+        self.pool = []
+        self.shown = []
+
+    def set_files(self, files):
+        self.files = files
+        self.canvas.config(scrollregion=(0, 0, max(1, len(files) * self.cell), self.height))
+        self.update_visible()
+
+    def visible_range(self):
+        left = self.canvas.canvasx(0)
+        first = max(0, int(left // self.cell))
+        last = min(len(self.files), int((left + self.canvas.winfo_width()) // self.cell) + 1)
+        return first, last
+
+    def index_at(self, x):
+        """Image index under window x, or None"""
+        i = int(self.canvas.canvasx(x) // self.cell)
+        return i if 0 <= i < len(self.files) else None
+
+    def _grow_pool(self, size):
+        while len(self.pool) < size:
+            self.pool.append((self.canvas.create_image(0, 0, anchor="n", tags=("filmstrip",)),
+                              self.canvas.create_rectangle(0, 0, 0, 0, width=2, tags=("filmstrip",)),
+                              self.canvas.create_text(0, 0, anchor="n", fill="white", tags=("filmstrip",))))
+        # Slots are assigned by index modulo pool size, so a resize re-renders every cell
+        self.shown = [None] * len(self.pool)
+
+    def update_visible(self):
+        """Draw the cells in view, hide the rest of the pool and queue missing thumbnails"""
+        first, last = self.visible_range()
+        if last - first + 1 > len(self.pool):
+            self._grow_pool(last - first + 1)
+        used = set()
+        for i in range(first, last):
+            slot = i % len(self.pool)
+            used.add(slot)
+            self._draw(slot, i)
+        for slot, items in enumerate(self.pool):
+            if slot not in used and self.shown[slot] is not None:
+                for item in items:
+                    self.canvas.itemconfig(item, state="hidden")
+                self.shown[slot] = None
+        self.thumbnails.request(self.files[first:last])
+
+    def _draw(self, slot, i):
+        path = self.files[i]
+        image_item, frame_item, label_item = self.pool[slot]
+        shown = self.shown[slot]
+        # Placeholders are retried every pass, so a thumbnail shows up as soon as it is written
+        if shown is None or shown[0] != path or shown[1] is None:
+            thumb = self.thumbnails.get(path)
+            photo = self.photo_image(_to_pil(thumb)) if thumb is not None else None
+            x = i * self.cell + self.cell / 2
+            self.canvas.coords(image_item, x, CELL_PAD)
+            self.canvas.coords(frame_item, i * self.cell + 2, 2, (i + 1) * self.cell - 2, self.cell - 2)
+            self.canvas.coords(label_item, x, self.cell)
+            self.canvas.itemconfig(image_item, image=photo or "", state="normal")
+            self.canvas.itemconfig(label_item, text=str(i + 1), state="normal")
+            self.shown[slot] = (path, photo)
+        self.canvas.itemconfig(frame_item, state="normal", outline=STATUS_COLORS.get(self.status(path), "gray50"),
+                               width=4 if i == self.current else 2)
+
+    def refresh(self, paths):
+        """Redraw after thumbnails of paths were written, if any of them is in view"""
+        first, last = self.visible_range()
+        if set(paths).intersection(self.files[first:last]):
+            self.update_visible()
+
+    def show_current(self, index):
+        """Highlight image index and scroll it to the middle of the view if it is outside"""
+        self.current = index
+        first, last = self.visible_range()
+        if not first <= index < last - 1 and self.files:
+            width = self.canvas.winfo_width()
+            left = max(0, index * self.cell + self.cell / 2 - width / 2)
+            self.canvas.xview_moveto(left / (len(self.files) * self.cell))
+        self.update_visible()
+
+def _to_pil(thumb):
+    if thumb.ndim == 2:
+        return Image.fromarray(thumb)
+    return Image.fromarray(cv2.cvtColor(thumb, cv2.COLOR_BGR2RGB))
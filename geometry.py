@@ -0,0 +1,125 @@
+import math
+import cv2
+import numpy as np
+
+# Linear part of a source->output matrix that is an exact quarter turn:
+# (cv2.rotate code, translation that cv2.rotate itself applies for a w x h source)
+_QUARTER_TURNS = {
+    (1, 0, 0, 1): (None, lambda w, h: (0, 0)),
+    (0, 1, -1, 0): (cv2.ROTATE_90_COUNTERCLOCKWISE, lambda w, h: (0, w - 1)),
+    (0, -1, 1, 0): (cv2.ROTATE_90_CLOCKWISE, lambda w, h: (h - 1, 0)),
+    (-1, 0, 0, -1): (cv2.ROTATE_180, lambda w, h: (w - 1, h - 1)),
+}
+
+def _cos_sin(angle):
+    """cos/sin of angle in degrees, exact for multiples of 90"""
+    turns = angle / 90.0
+    if abs(turns - round(turns)) < 1e-9:
+        return [(1, 0), (0, 1), (-1, 0), (0, -1)][int(round(turns)) % 4]
+    rad = math.radians(angle)
+    return math.cos(rad), math.sin(rad)
+
+def translation(dx, dy):
+    return np.array([[1.0, 0.0, dx], [0.0, 1.0, dy], [0.0, 0.0, 1.0]])
+
+def render(src, matrix, size, interpolation=cv2.INTER_LINEAR):
+    """Resample src through the 3x3 source->output matrix into an image of size (w, h).
+
+    Quarter turns plus whole-pixel offsets are done losslessly with
+    cv2.rotate and slicing; anything else is a single warpAffine.
+    """
+    out_w, out_h = size
+    linear = matrix[:2, :2]
+    rounded = np.rint(linear)
+    if np.abs(linear - rounded).max() * max(out_w, out_h) < 0.5:
+        turn = _QUARTER_TURNS.get(tuple(int(v) for v in rounded.flatten()))
+        if turn is not None:
+            code, offset = turn
+            h, w = src.shape[:2]
+            rotated = src if code is None else cv2.rotate(src, code)
+            tx, ty = offset(w, h)
+            x0 = int(round(tx - matrix[0, 2]))
+            y0 = int(round(ty - matrix[1, 2]))
+            if x0 >= 0 and y0 >= 0 and x0 + out_w <= rotated.shape[1] and y0 + out_h <= rotated.shape[0]:
+                return rotated[y0:y0 + out_h, x0:x0 + out_w]
+    return cv2.warpAffine(src, matrix[:2], (out_w, out_h), flags=interpolation,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def _rotation(size, angle):
+    """Matrix turning a w x h frame by angle degrees about its centre, and the (w, h) that fits it"""
+    w, h = size
+    cos, sin = _cos_sin(angle)
+    new_w = max(1, int(h * abs(sin) + w * abs(cos)))
+    new_h = max(1, int(h * abs(cos) + w * abs(sin)))
+    cx, cy = (w - 1) / 2, (h - 1) / 2
+    rot = np.array([[cos, sin, 0.0], [-sin, cos, 0.0], [0.0, 0.0, 1.0]])
+    rot[0, 2] = (new_w - 1) / 2 - (cos * cx + sin * cy)
+    rot[1, 2] = (new_h - 1) / 2 - (-sin * cx + cos * cy)
+    return rot, (new_w, new_h)
+
+class Geometry:
+    """Rotation and crop of a source image, composed into one rigid source->output transform.
+
+    Instances are immutable; rotated() and cropped() return new ones, so any
+    number of edits costs a single resample when the pixels are rendered.
+    The rotations since the last crop are kept as one total turn of the
+    cropped frame (or the source), so the canvas is sized from that frame
+    alone and rotations adding up to a quarter turn render losslessly.
+    """
+
+    def __init__(self, matrix, size, angle=0.0, turn=0.0):
+        self.base_matrix = matrix
+        self.base_size = size
+        self.angle = angle
+        self.turn = turn
+        if turn:
+            rot, self.size = _rotation(size, turn)
+            self.matrix = rot @ matrix
+        else:
+            self.matrix, self.size = matrix, size
+
+    @classmethod
+    def identity(cls, img):
+        h, w = img.shape[:2]
+        return cls(np.eye(3), (w, h))
+
+    def rotated(self, delta):
+        """Rotate by delta degrees more: the cropped frame turned about its centre by the total, grown to fit"""
+        return Geometry(self.base_matrix, self.base_size, self.angle + delta, self.turn + delta)
+
+    def cropped(self, rect):
+        """Crop the current output to rect, clamped; returns (geometry, clamped rect)"""
+        w, h = self.size
+        x0, y0, x1, y1 = map(int, rect)
+        x0, x1 = max(0, min(x0, x1)), min(w, max(x0, x1))
+        y0, y1 = max(0, min(y0, y1)), min(h, max(y0, y1))
+        geometry = Geometry(translation(-x0, -y0) @ self.matrix, (max(0, x1 - x0), max(0, y1 - y0)), self.angle)
+        return geometry, (x0, y0, x1, y1)
+
+    def apply(self, op):
+        kind, value = op
+        if kind == "rotate":
+            return self.rotated(value)
+        if kind == "crop":
+            return self.cropped(value)[0]
+        return self
+
+    def to_source(self, x, y):
+        """Map an output pixel to the nearest source pixel"""
+        sx, sy, _ = np.linalg.solve(self.matrix, [x, y, 1.0])
+        return int(round(sx)), int(round(sy))
+
+    def to_output(self, x, y):
+        """Map a source pixel to the nearest output pixel"""
+        ox, oy, _ = self.matrix @ [x, y, 1.0]
+        return int(round(ox)), int(round(oy))
+
+    def display_matrix(self, scale, src_scale=(1.0, 1.0)):
+        """Matrix from a (src_scale-downsampled) source straight to the output shown at scale"""
+        out_scale = np.diag([scale, scale, 1.0])
+        src_unscale = np.diag([1.0 / src_scale[0], 1.0 / src_scale[1], 1.0])
+        return out_scale @ self.matrix @ src_unscale
+
+    def render(self, src):
+        """Full-resolution output pixels; a view of src when no resampling is needed"""
+        return render(src, self.matrix, self.size)
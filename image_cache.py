@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from PIL import Image
+from profiler import PROFILER
+
+# Keep the file's channel count (grayscale stays single-channel) and bit depth (16-bit and
+# float TIFF/PNG). Unlike IMREAD_UNCHANGED this still applies EXIF orientation and drops alpha.
+IMREAD_NATIVE = cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR
+
+# Power-of-two reduced decodes (JPEG DCT scaling; other formats are decoded then shrunk)
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2 | IMREAD_NATIVE, 4: cv2.IMREAD_REDUCED_COLOR_4 | IMREAD_NATIVE,
+                  8: cv2.IMREAD_REDUCED_COLOR_8 | IMREAD_NATIVE}
+
+def read_full(path):
+    """Full-resolution native decode as (image, (w, h)), the same shape read_preview returns"""
+    with PROFILER.timer("imread.full"):
+        img = cv2.imread(path, IMREAD_NATIVE)
+    return img, (img.shape[1], img.shape[0]) if img is not None else None
+
+_EXIF_HEADER_FORMATS = ("JPEG", "MPO", "TIFF")
+
+def image_size(path):
+    """(w, h) of the full-resolution decode, read from the file header only.
+
+    Accounts for the EXIF rotation cv2.imread applies; None if the header
+    cannot be read. Only JPEG and TIFF carry it in the header: Pillow would
+    decode a whole PNG to look for an eXIf chunk.
+    """
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+            if im.format in _EXIF_HEADER_FORMATS and im.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                w, h = h, w
+            return w, h
+    except (OSError, ValueError):
+        return None
+
+def preview_factor(size, max_size):
+    """Largest reduction (1, 2, 4 or 8) that keeps the image at least as big as its fit-to-window size"""
+    w, h = size
+    max_w, max_h = max_size
+    limit = max(w / max_w, h / max_h)
+    factor = 1
+    while factor * 2 in _REDUCED_FLAGS and factor * 2 <= limit:
+        factor *= 2
+    return factor
+
+def read_preview(path, max_size):
+    """Reduced-resolution decode for display; returns (image, full-resolution (w, h)).
+
+    Falls back to a full decode when the header is unreadable or the reduced
+    decode does not match it.
+    """
+    size = image_size(path)
+    factor = preview_factor(size, max_size) if size else 1
+    if factor > 1:
+        with PROFILER.timer("imread.preview"):
+            img = cv2.imread(path, _REDUCED_FLAGS[factor])
+        if img is not None and abs(img.shape[1] * factor - size[0]) < factor \
+                and abs(img.shape[0] * factor - size[1]) < factor:
+            return img, size
+    return read_full(path)
+
+class ImageCache:
+    """Read-ahead decoder keeping recently decoded images in an LRU bounded by total bytes.
+
+    The loader returns (image, full-resolution (w, h)); the image may be a
+    reduced preview. Cached arrays are shared and marked read-only; callers
+    copy before editing.
+    """
+
+    def __init__(self, max_bytes, ahead=3, workers=2, loader=read_full):
+        self.max_bytes = max_bytes
+        self.ahead = ahead
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    @PROFILER.timed("cache.get")
+    def get(self, path, count=True):
+        """Return (image, full size), waiting on an in-flight prefetch or decoding synchronously on a miss.
+
+        Background consumers pass count=False to keep the hit/miss figures about navigation.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                self.hits += count
+                return entry
+            future = self._pending.get(path)
+        if future is not None:
+            entry = future.result()
+            if entry[0] is not None:
+                with self._lock:
+                    self.hits += count
+                return entry
+        with self._lock:
+            self.misses += count
+        entry = self.loader(path)
+        self._store(path, entry)
+        return entry
+
+    def prefetch(self, paths):
+        """Queue background decodes for paths that are neither cached nor already in flight"""
+        with self._lock:
+            for path in paths:
+                if path in self._entries or path in self._pending:
+                    continue
+                self._pending[path] = self._pool.submit(self._decode, path)
+
+    def _decode(self, path):
+        try:
+            entry = self.loader(path)
+        except Exception as e:
+            print(f"Prefetch failed for {path}: {e}")
+            entry = (None, None)
+        self._store(path, entry)
+        with self._lock:
+            self._pending.pop(path, None)
+        return entry
+
+    def _store(self, path, entry):
+        img = entry[0]
+        if img is None or img.nbytes > self.max_bytes:
+            return
+        img.flags.writeable = False
+        with self._lock:
+            if path in self._entries:
+                self._bytes -= self._entries.pop(path)[0].nbytes
+            self._entries[path] = entry
+            self._bytes += img.nbytes
+            while self._bytes > self.max_bytes:
+                _, (old, _) = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "bytes": self._bytes, "pending": len(self._pending)}
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff")
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hemodynamics_cleaner")
+
+def cache_path(*parts):
+    """Path under the per-user cache directory, creating the parent folder"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+class DirectoryIndex:
+    """os.scandir-based image listing with a persisted (path, size, mtime) manifest per root.
+
+    Directories whose mtime is unchanged since the last scan reuse their
+    manifest entry instead of being listed again. Overwriting a file in
+    place leaves its directory's mtime alone, so refresh_stats() re-stats
+    the files of those directories in a separate, slower pass.
+    """
+
+    def __init__(self, root, exts=IMAGE_EXTS):
+        self.root = os.path.abspath(root)
+        self.exts = tuple(ext.lower() for ext in exts)
+        key = hashlib.sha1(f"{self.root}|{','.join(sorted(self.exts))}".encode()).hexdigest()[:16]
+        self.manifest_file = cache_path("index", f"{key}.json")
+        self.dirs = self._load()
+        self.reused = []
+
+    def _load(self):
+        try:
+            with open(self.manifest_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("dirs", {}) if data.get("root") == self.root else {}
+
+    def save(self):
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"root": self.root, "dirs": self.dirs}, f)
+        os.replace(tmp, self.manifest_file)
+
+    def cached_files(self):
+        """Sorted image paths from the saved manifest, without touching the image tree"""
+        return sorted(os.path.join(d, name) for d, entry in self.dirs.items() for name, _, _ in entry["files"])
+
+    def file_stats(self):
+        """{path: (size, mtime)} for every indexed image"""
+        return {os.path.join(d, name): (size, mtime)
+                for d, entry in self.dirs.items() for name, size, mtime in entry["files"]}
+
+    def scan(self):
+        """Walk the tree, re-listing only changed directories.
+
+        Yields (added, removed) path lists as each changed directory is read,
+        then saves the manifest.
+        """
+        seen, reused = {}, []
+        stack = [self.root]
+        while stack:
+            d = stack.pop()
+            try:
+                mtime = os.stat(d).st_mtime
+            except OSError:
+                continue
+            old = self.dirs.get(d)
+            if old is not None and old["mtime"] == mtime:
+                seen[d] = old
+                reused.append(d)
+                stack.extend(os.path.join(d, name) for name in old["subdirs"])
+                continue
+
+            files, subdirs = [], []
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.name.lower().endswith(self.exts):
+                                st = entry.stat()
+                                files.append([entry.name, st.st_size, st.st_mtime])
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            seen[d] = {"mtime": mtime, "files": files, "subdirs": subdirs}
+            stack.extend(os.path.join(d, name) for name in subdirs)
+
+            old_names = {name for name, _, _ in old["files"]} if old else set()
+            new_names = {name for name, _, _ in files}
+            added = [os.path.join(d, name) for name in new_names - old_names]
+            removed = [os.path.join(d, name) for name in old_names - new_names]
+            if added or removed:
+                yield added, removed
+
+        for d in set(self.dirs) - set(seen):
+            removed = [os.path.join(d, name) for name, _, _ in self.dirs[d]["files"]]
+            if removed:
+                yield [], removed
+        self.dirs, self.reused = seen, reused
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Could not save image index {self.manifest_file}: {e}")
+
+    def refresh_stats(self):
+        """Re-stat the files of the directories the last scan reused; returns the paths whose (size, mtime) changed.
+
+        One stat per file, so meant for a background thread once the listing is in.
+        """
+        changed = []
+        for d in self.reused:
+            entry = self.dirs.get(d)
+            if entry is None:
+                continue
+            files = []
+            for name, size, mtime in entry["files"]:
+                try:
+                    st = os.stat(os.path.join(d, name))
+                except OSError:
+                    files.append([name, size, mtime])
+                    continue
+                if (st.st_size, st.st_mtime) != (size, mtime):
+                    changed.append(os.path.join(d, name))
+                files.append([name, st.st_size, st.st_mtime])
+            entry["files"] = files
+        if changed:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Could not save image index {self.manifest_file}: {e}")
+        return changed
+
+    def all_files(self):
+        """Bring the manifest up to date and return every image path, sorted"""
+        for _ in self.scan():
+            pass
+        return self.cached_files()
@@ -1,41 +1,396 @@
 import os
-import cv2
+import json
+import time
+import queue
+import bisect
+import sqlite3
+import heapq
+import threading
+from functools import partial
+import tkinter as tk
+from tkinter import filedialog
 import numpy as np
-import pandas as pd
-from PIL import Image, ImageTk
-from file_utils import find_all_images, log_to_console, update_progress
+from file_utils import load_config, log_to_console, update_progress
+from image_index import DirectoryIndex
+from image_cache import ImageCache, read_full, read_preview
+from results_store import ResultsStore, default_db_path, folder_db_paths, merged_rows, write_table
+from session_store import SessionStore, default_session_path
+from writer_queue import SaveQueue
+from console_log import ConsoleLog
+from profiler import PROFILER
+from events import FrameScheduler
+from session_trace import TraceRecorder, traced
+from roi_proposals import RoiProposer, rect_to_output
+from calibration import AXES, CalibrationTemplates, template_key
+from digitize import calibration_from_row
+from duplicates import DuplicateIndex
+from work_queue import WorkQueue, annotator_slug
+from roi_dataset import ShardWriter, default_dataset_path, image_record
+from thumbnails import ThumbnailCache
+from filmstrip import Filmstrip
 from annotations import draw_annotations
+from eraser import EraserStroke, paint_stroke
+from geometry import Geometry
+from tile_viewer import TileViewer
 from ui import setup_ui
+from image_ops import image_write_params, metadata_row, roi_crops, roi_format, write_roi
 
-try:
-    resample = Image.Resampling.LANCZOS
-except AttributeError:
-    resample = Image.LANCZOS
+class EditHistory:
+    """Undo/redo log of crop, rotate and erase steps applied to one image.
+
+    Crops and rotations are stored as parameters and only change the composed
+    Geometry; erase strokes are stored in source coordinates together with the
+    pixels they covered. Every `keyframe_every` steps the (source, geometry)
+    state is kept, so rebuilding an erase whose delta was dropped replays at
+    most that many steps. When keyframes and erase deltas exceed `max_bytes`,
+    the oldest history is folded into the base state; applied_ops() still
+    lists it, without the erased pixels.
+    """
+
+    def __init__(self, base_image, base_geometry, max_bytes, keyframe_every=8):
+        self.max_bytes = max_bytes
+        self.keyframe_every = max(1, keyframe_every)
+        self.ops = []
+        self.redo_ops = []
+        self.folded = []
+        self.keyframes = {0: (base_image, base_geometry)}
+
+    def _op_bytes(self, op):
+        before = op[1].get("before") if op[0] == "erase" else None
+        return before.nbytes if before is not None else 0
+
+    def memory_bytes(self):
+        base = id(self.keyframes[0][0])
+        frames = {id(img): img.nbytes for img, _ in self.keyframes.values() if id(img) != base}
+        return sum(frames.values()) + sum(self._op_bytes(op) for op in self.ops + self.redo_ops)
+
+    def record(self, op, source, geometry):
+        """Log an operation that has already been applied, producing (source, geometry)"""
+        n = len(self.ops)
+        for k in [k for k in self.keyframes if k > n]:
+            del self.keyframes[k]
+        self.redo_ops = []
+        self.ops.append(op)
+        if len(self.ops) % self.keyframe_every == 0:
+            last = max(self.keyframes)
+            erased = any(kind == "erase" for kind, _ in self.ops[last:])
+            snapshot = source.copy() if erased else self.keyframes[last][0]
+            self.keyframes[len(self.ops)] = (snapshot, geometry)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        while self.memory_bytes() > self.max_bytes:
+            later = sorted(k for k in self.keyframes if k)
+            if later:
+                k = later[0]
+                self.keyframes = {n - k: state for n, state in self.keyframes.items() if n >= k}
+                self.folded += [(kind, {key: v for key, v in value.items() if key != "before"})
+                                if kind == "erase" else (kind, value) for kind, value in self.ops[:k]]
+                self.ops = self.ops[k:]
+                continue
+            erase_ops = [op for op in self.ops + self.redo_ops if self._op_bytes(op)]
+            if not erase_ops:
+                break
+            erase_ops[0][1]["before"] = None
+
+    def applied_ops(self):
+        """Every applied operation since the image was loaded, including those folded into the base"""
+        return self.folded + self.ops
+
+    def replace_source(self, old, new):
+        """Point keyframes holding old (e.g. a display preview) at pixel-equivalent new"""
+        self.keyframes = {n: (new if img is old else img, g) for n, (img, g) in self.keyframes.items()}
+
+    def _nearest_keyframe(self, n):
+        return max(k for k in self.keyframes if k <= n)
+
+    def replay_geometry(self, n):
+        k = self._nearest_keyframe(n)
+        geometry = self.keyframes[k][1]
+        for op in self.ops[k:n]:
+            geometry = geometry.apply(op)
+        return geometry
+
+    def replay_source(self, n):
+        k = self._nearest_keyframe(n)
+        source = self.keyframes[k][0].copy()
+        for kind, value in self.ops[k:n]:
+            if kind == "erase":
+                paint_stroke(source, value["points"], value["radius"])
+        return source
+
+    def undo(self, source, geometry):
+        """Return (op, source, geometry, dirty_bbox); dirty_bbox is the source region an erase undo restored"""
+        if not self.ops:
+            return None, source, geometry, None
+        op = self.ops.pop()
+        self.redo_ops.append(op)
+        n = len(self.ops)
+        if op[0] != "erase":
+            return op, source, self.replay_geometry(n), None
+        if op[1]["before"] is not None:
+            x0, y0, x1, y1 = op[1]["bbox"]
+            source[y0:y1, x0:x1] = op[1]["before"]
+            return op, source, geometry, op[1]["bbox"]
+        return op, self.replay_source(n), geometry, None
+
+    def redo(self, source, geometry):
+        if not self.redo_ops:
+            return None, source, geometry, None
+        op = self.redo_ops.pop()
+        self.ops.append(op)
+        if op[0] != "erase":
+            return op, source, geometry.apply(op), None
+        paint_stroke(source, op[1]["points"], op[1]["radius"])
+        return op, source, geometry, op[1]["bbox"]
+
+def _row_ticks(row, axis):
+    ticks = []
+    for i in (1, 2):
+        x, y = row.get(f"{axis}_tick{i}_px", ""), row.get(f"{axis}_tick{i}_py", "")
+        if x not in ("", None) and y not in ("", None):
+            ticks.append((int(x), int(y)))
+    return ticks
+
+def template_from_row(row):
+    """Inverse of metadata_row: the template dict (see MedicalImageProcessor.template) a results row describes"""
+    template = {"operations": [tuple(op) for op in json.loads(row.get("operations") or "[]")],
+                "roi_rectangles": [tuple(r) for r in json.loads(row.get("roi_rectangles") or "[]")],
+                "tick_values": {}, "tick_units": {}}
+    for axis in ("horizontal", "vertical"):
+        template[f"{axis}_ticks"] = _row_ticks(row, axis)
+        values = [row.get(f"{axis}_tick1_value", ""), row.get(f"{axis}_tick2_value", "")]
+        template["tick_values"][axis] = values if any(v not in ("", None) for v in values) else []
+        template["tick_units"][axis] = row.get(f"{axis}_units") or ""
+    template["waveform_type"] = row.get("waveform_type") or ""
+    template["location"] = row.get("location_free_text") or ""
+    template["protocol"] = row.get("protocol_free_text") or ""
+    template["co_present"] = row.get("co_present") or ""
+    return template
 
 class MedicalImageProcessor:
-    def __init__(self, root, image_dir="."):
+    def __init__(self, root, image_dir=".", config=None, ui=setup_ui, photo_image=None):
+        """ui and photo_image replace the Tk widgets and ImageTk.PhotoImage when running headless"""
         self.root = root
         self.image_dir = image_dir
         self.initialize_variables()
-
+        self.config = config or load_config()
+        self.console = ConsoleLog(root, max_lines=self.config["LOG_MAX_LINES"], flush_ms=self.config["LOG_FLUSH_MS"],
+                                  level=self.config["LOG_LEVEL"], log_file=self.config["LOG_FILE"],
+                                  log_file_max_mb=self.config["LOG_FILE_MAX_MB"],
+                                  log_file_backups=self.config["LOG_FILE_BACKUPS"])
+        PROFILER.enabled = self.config["PROFILE_ENABLED"]
+        PROFILER.window = self.config["PROFILE_WINDOW"]
+        self.scheduler = FrameScheduler(root, self.config["FRAME_BUDGET_MS"])
         self.display_width = 1200
         self.display_height = 900
+        if self.config["PREVIEW_DECODE"]:
+            loader = partial(read_preview, max_size=(self.display_width, self.display_height))
+        else:
+            loader = read_full
+        self.image_cache = ImageCache(self.config["CACHE_MAX_MB"] * 1024 * 1024,
+                                      ahead=self.config["PREFETCH_AHEAD"],
+                                      workers=self.config["PREFETCH_WORKERS"], loader=loader)
+        # Annotators sharing a folder each keep their own results and session file
+        self.work = WorkQueue(self.image_dir, self.config["ANNOTATOR"] or None, self.config["LEASE_MINUTES"] * 60) \
+            if self.config["WORK_SHARING"] else None
+        annotator = annotator_slug(self.work.annotator) if self.work is not None else None
+        self.results_store = ResultsStore(default_db_path(self.image_dir, annotator))
+        self.session = SessionStore(default_session_path(self.image_dir, annotator)) \
+            if self.config["SESSION_CHECKPOINT"] else None
+        self.save_queue = SaveQueue(workers=self.config["SAVE_WORKERS"])
+        self.save_poll_scheduled = False
+        self.roi_dataset = ShardWriter(default_dataset_path(self.image_dir), self.config["ROI_SHARD_MB"]) \
+            if self.config["ROI_EXPORT"] in ("packed", "both") else None
+        # Also used without AUTO_ROI, so Accept Auto ROIs never runs a proposal on the Tk thread
+        self.roi_proposer = RoiProposer(lambda path: self.image_cache.get(path, count=False))
+        self.proposal_poll_scheduled = False
+        self.trace = TraceRecorder(self.config["TRACE_FILE"]) if self.config["TRACE_FILE"] else None
+        self.calibrations = CalibrationTemplates(self.config["CALIBRATION_MIN_SCORE"],
+                                                 self.config["CALIBRATION_SEARCH"]) \
+            if self.config["CALIBRATION_TEMPLATES"] else None
 
-        self.image_files = find_all_images(directory=self.image_dir)
+        self.index = DirectoryIndex(self.image_dir)
+        self.image_files = self.index.cached_files()
+        self.current_index = self.resume_index()
+        self.duplicates = DuplicateIndex(self.image_dir, self.config["DUPLICATE_DISTANCE"]) \
+            if self.config["DUPLICATE_ACTION"] != "off" else None
+        self.saved_paths = self.results_store.paths()
+        self.edited_paths = self.session.paths() if self.session is not None else set()
         log_to_console(self, f"Total images to process: {len(self.image_files)}")
 
-        setup_ui(self, self.display_width, self.display_height)
+        ui(self, self.display_width, self.display_height)
+        self.console.widget = self.log_text
+        self.viewer = TileViewer(self.canvas, tile_size=self.config["TILE_SIZE"],
+                                 max_tiles=self.config["TILE_CACHE"], max_scale=self.config["MAX_ZOOM"],
+                                 photo_image=photo_image)
+        if self.config["FILMSTRIP"] and getattr(self, "filmstrip_canvas", None) is not None:
+            self.thumbnails = ThumbnailCache(self.config["THUMBNAIL_SIZE"], self.config["THUMBNAIL_WORKERS"])
+            self.thumbnails.file_stats = self.index.file_stats()
+            self.filmstrip = Filmstrip(self.filmstrip_canvas, self.thumbnails, self.annotation_status,
+                                       photo_image=photo_image)
+            self.filmstrip.set_files(self.image_files)
+        if self.work is not None:
+            log_to_console(self, f"Sharing {self.image_dir} as {self.work.annotator}")
+            self.root.after(self.work_poll_ms(), self.poll_work)
 
         if self.image_files:
             self.load_current_image()
         else:
-            log_to_console(self, f"No images found in the directory: {self.image_dir}")
+            log_to_console(self, f"Scanning {self.image_dir} for images...")
+        self.start_index_scan()
+
+    def start_index_scan(self):
+        """List the directory in the background; new files are merged in on the Tk thread.
+
+        Once the listing is in, the files of unchanged directories are
+        re-stat'ed on the same thread to catch images overwritten in place.
+        """
+        self.index_queue = queue.Queue()
+        self.restat_queue = queue.Queue()
+
+        def scan():
+            start = time.perf_counter()
+            try:
+                for changes in self.index.scan():
+                    self.index_queue.put(changes)
+            finally:
+                self.index_queue.put(time.perf_counter() - start)
+            self.restat_queue.put(self.index.refresh_stats())
+
+        threading.Thread(target=scan, name="index-scan", daemon=True).start()
+        self.root.after(100, self.poll_index)
+
+    def poll_index(self):
+        added, removed, elapsed = [], [], None
+        while True:
+            try:
+                item = self.index_queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, float):
+                elapsed = item
+                break
+            added.extend(item[0])
+            removed.extend(item[1])
+        if added or removed:
+            self.merge_image_files(added, removed)
+
+        if elapsed is None:
+            self.root.after(100, self.poll_index)
+        elif self.image_files:
+            log_to_console(self, f"Indexed {len(self.image_files)} images in {elapsed:.1f} s")
+            self.start_duplicate_scan()
+            if self.thumbnails is not None:
+                files = self.image_files
+                self.thumbnails.prefill(files[self.current_index:] + files[:self.current_index],
+                                        self.index.file_stats())
+                self.poll_thumbnails()
+            self.root.after(500, self.poll_restat)
+        else:
+            log_to_console(self, f"No images found in the directory: {self.image_dir}", "ERROR")
+
+    def poll_restat(self):
+        """Re-hash and re-thumbnail images the background stat pass found overwritten in place"""
+        try:
+            changed = self.restat_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(500, self.poll_restat)
+            return
+        if not changed:
+            return
+        log_to_console(self, f"{len(changed)} images changed on disk since the last scan")
+        file_stats = self.index.file_stats()
+        if self.thumbnails is not None:
+            self.thumbnails.invalidate({path: file_stats[path] for path in changed if path in file_stats})
+            if self.filmstrip is not None:
+                self.filmstrip.update_visible()
+                self.poll_thumbnails()
+        if self.duplicates is not None:
+            if self.duplicate_thread is not None and self.duplicate_thread.is_alive():
+                self.duplicate_rescan = True
+            else:
+                self.start_duplicate_scan()
+
+    def start_duplicate_scan(self):
+        """Hash new and changed images in worker processes, then regroup near-duplicates"""
+        if self.duplicates is None:
+            return
+        self.duplicate_queue = queue.Queue()
+        file_stats = self.index.file_stats()
+
+        def scan():
+            start = time.perf_counter()
+            try:
+                n = self.duplicates.update(file_stats, workers=self.config["DUPLICATE_WORKERS"])
+            except Exception as e:
+                self.duplicate_queue.put(e)
+                return
+            self.duplicate_queue.put((n, time.perf_counter() - start))
+
+        self.duplicate_thread = threading.Thread(target=scan, name="duplicate-scan", daemon=True)
+        self.duplicate_thread.start()
+        self.root.after(200, self.poll_duplicates)
+
+    def poll_duplicates(self):
+        try:
+            result = self.duplicate_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(200, self.poll_duplicates)
+            return
+        if isinstance(result, Exception):
+            log_to_console(self, f"Duplicate scan failed: {result}", "ERROR")
+            return
+        if self.duplicate_rescan:
+            # Images changed while this scan ran; hash them too
+            self.duplicate_rescan = False
+            self.start_duplicate_scan()
+        n, elapsed = result
+        for path, error in self.duplicates.failed:
+            log_to_console(self, f"Could not hash {path}: {error}", "WARNING")
+        groups = self.duplicates.groups()
+        log_to_console(self, f"Hashed {n} images in {elapsed:.1f} s: {self.duplicates.duplicate_count()} "
+                             f"near-duplicates in {len(groups)} groups")
+        if self.source_image is not None and not self.history.applied_ops() and self.inherit_annotations():
+            self.update_display()
+        if self.filmstrip is not None:
+            self.filmstrip.update_visible()
+        update_progress(self)
+
+    def merge_image_files(self, added, removed):
+        """Merge scan results into the sorted image list, keeping the current image selected"""
+        current = self.image_files[self.current_index] if self.image_files else None
+        files = self.image_files
+        if removed:
+            gone = set(removed)
+            files = [p for p in files if p not in gone]
+        if added:
+            files = list(heapq.merge(files, sorted(added)))
+        self.image_files = files
+        if current is not None and files:
+            self.current_index = min(bisect.bisect_left(files, current), len(files) - 1)
+        if self.filmstrip is not None:
+            self.filmstrip.set_files(files)
+
+        if self.source_image is None and files:
+            self.current_index = self.resume_index()
+            self.load_current_image()
+        else:
+            update_progress(self)
 
     def initialize_variables(self):
         self.current_index = 0
         self.rotation_angle = 0.0
-        self.cv_image = None
-        self.tk_image = None
+        self.source_image = None
+        self.source_size = None
+        self.geometry = None
+        self.full_image = None
+        self.viewer = None
+        self.annotation_items = {}
+        self.display_scale = None
+        self.erase_stroke = None
+        self.dirty_bbox = None
+        self.root_size = None
         self.original_image = None
         self.crop_rect = None
         self.crop_mode = False
@@ -46,6 +401,27 @@ class MedicalImageProcessor:
         self.crop_start = None
         self.roi_mode = None
         self.roi_rectangles = []
+        self.proposed_rois = []
+        self.roi_proposer = None
+        self.accept_pending = None
+        self.duplicates = None
+        self.duplicate_thread = None
+        self.duplicate_rescan = False
+        self.session = None
+        self.checkpointed = None
+        self.calibrations = None
+        self.calibration_score = None
+        self.thumbnails = None
+        self.filmstrip = None
+        self.thumbnail_poll_scheduled = False
+        self.work = None
+        self.work_stats = {}
+        self.current_file = None
+        self.saved_paths = set()
+        self.saving_paths = set()
+        self.committed_rows = queue.Queue()
+        self.edited_paths = set()
+        self.history = None
         self.undo_stack = []
         self.redo_stack = []
         self.horizontal_ticks = []
@@ -53,6 +429,7 @@ class MedicalImageProcessor:
         self.tick_values = {"horizontal": [], "vertical": []}
         self.tick_units = {"horizontal": "", "vertical": ""}
 
+    @traced
     def set_tick_mode(self, mode):
         if mode == "horizontal":
             self.drawing_mode = "tick_horizontal"
@@ -61,16 +438,56 @@ class MedicalImageProcessor:
             self.drawing_mode = "tick_vertical"
             log_to_console(self, "Click two points to define vertical ticks.")
 
+    def resume_index(self):
+        """Index of the image open when the folder was last left, or of the first unfinished image after it.
+
+        When sharing the folder: the image this annotator still holds a lease on, else the first unclaimed one.
+        """
+        if self.work is not None and self.image_files:
+            i = self.work.held_index(self.image_files)
+            if i is None:
+                i = self.work.next_index(self.image_files, 0)
+            if i is None:
+                log_to_console(self, "Every image is done or claimed by another annotator.", "WARNING")
+            return i or 0
+        current = self.session.current() if self.session is not None else None
+        if current is None or not self.image_files:
+            return 0
+        files = self.image_files
+        i = min(bisect.bisect_left(files, current), len(files) - 1)
+        done = self.results_store.paths()
+        j = i
+        while j < len(files) and files[j] in done:
+            j += 1
+        i = j if j < len(files) else i
+        if i:
+            log_to_console(self, f"Resuming at image {i + 1} of {len(files)}: {os.path.basename(files[i])}")
+        return i
+
+    @PROFILER.timed("load.image")
     def load_current_image(self):
         if not self.image_files:
             log_to_console(self, "No images to load.")
             return
-        self.current_file = self.image_files[self.current_index]
-        self.cv_image = cv2.imread(self.current_file)
-        self.original_image = self.cv_image.copy()
+        self.checkpoint()
+        previous, self.current_file = self.current_file, self.image_files[self.current_index]
+        if self.work is not None:
+            self.claim_current(previous)
+        img, size = self.image_cache.get(self.current_file)
+        if img is None:
+            log_to_console(self, f"Could not read image: {self.current_file}", "ERROR")
+            return
+        self.original_image = img
+        self.source_image = img
+        self.source_size = size
+        self.geometry = Geometry(np.eye(3), size)
+        self.full_image = None
         self.crop_rect = None
         self.crop_mode = False
         self.roi_rectangles = []
+        self.proposed_rois = []
+        self.history = EditHistory(img, self.geometry, self.config["HISTORY_MAX_MB"] * 1024 * 1024,
+                                   keyframe_every=self.config["HISTORY_KEYFRAME_EVERY"])
         self.undo_stack = []
         self.redo_stack = []
         self.rotation_angle = 0.0
@@ -78,12 +495,356 @@ class MedicalImageProcessor:
         self.vertical_ticks = []
         self.tick_values = {"horizontal": [], "vertical": []}
         self.tick_units = {"horizontal": "", "vertical": ""}
+        self.calibration_score = None
+        state = self.session.get(self.current_file) if self.session is not None else None
+        if state is not None:
+            self.apply_template(state)
+            log_to_console(self, "Restored this image's annotations from the session.")
+        else:
+            self.inherit_annotations()
+        if not self.horizontal_ticks and not self.vertical_ticks:
+            self._match_calibration(auto=True)
+        if self.session is not None:
+            self.checkpointed = json.dumps(self.session_state())
+            self.session.set_current(self.current_file)
 
-        log_to_console(self, f"Image {self.current_index + 1} of {len(self.image_files)}")
-        log_to_console(self, f"Images left to process: {len(self.image_files) - self.current_index - 1}")
+        log_to_console(self, f"Image {self.current_index + 1} of {len(self.image_files)}", "DEBUG")
+        log_to_console(self, f"Images left to process: {len(self.image_files) - self.current_index - 1}", "DEBUG")
 
+        self.viewer.set_zoom(0)
+        self.viewer.set_window(None)
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
         self.update_display()
+        self._show_window_level()
+        if self.filmstrip is not None:
+            self.filmstrip.show_current(self.current_index)
+            self.poll_thumbnails()
         log_to_console(self, f"Loaded image: {self.current_file}")
+        if img.ndim == 2 or img.dtype != np.uint8:
+            log_to_console(self, f"{'Grayscale' if img.ndim == 2 else 'Colour'} {img.dtype} image, "
+                                 f"display window {self.viewer.window[0]:g}-{self.viewer.window[1]:g}", "DEBUG")
+        if img.shape[1] != size[0]:
+            log_to_console(self, f"Showing a {img.shape[1]}x{img.shape[0]} preview of {size[0]}x{size[1]}")
+        self.prefetch_neighbours()
+        self.poll_proposals()
+
+    def inherit_annotations(self):
+        """Copy the saved annotations of the image the current one near-duplicates, if it has none of its own"""
+        if self.duplicates is None or self.config["DUPLICATE_ACTION"] != "inherit" or self.roi_rectangles:
+            return False
+        original = self.duplicates.duplicate_of(self.current_file)
+        if original is None or self.results_store.has(self.current_file):
+            return False
+        row = self.results_store.get(original)
+        if row is None:
+            return False
+        self.apply_template(template_from_row(row))
+        log_to_console(self, f"Near-duplicate of {os.path.basename(original)}: copied its annotations for review")
+        return True
+
+    def apply_template(self, template):
+        """Replay a template's edits and restore its ROIs, ticks and metadata; the caller redraws.
+
+        Erase strokes (session states only) are painted into the full-resolution source.
+        """
+        for kind, value in template["operations"]:
+            if kind == "erase":
+                source = self._writable_source(refresh=False)
+                if source is None:
+                    continue
+                paint_stroke(source, value["points"], value["radius"])
+                value = {"points": value["points"], "radius": value["radius"], "bbox": None, "before": None}
+            else:
+                self.geometry = self.geometry.apply((kind, value))
+            self.history.record((kind, value), self.source_image, self.geometry)
+        self.rotation_angle = self.geometry.angle
+        self.full_image = None
+        self.roi_rectangles = [tuple(r) for r in template["roi_rectangles"]]
+        self.proposed_rois = []
+        self.horizontal_ticks = [tuple(t) for t in template["horizontal_ticks"]]
+        self.vertical_ticks = [tuple(t) for t in template["vertical_ticks"]]
+        self.tick_values = {axis: list(v) for axis, v in template["tick_values"].items()}
+        self.tick_units = dict(template["tick_units"])
+        self._show_ticks()
+        for entry, value in ((self.location_entry, template["location"]), (self.protocol_entry, template["protocol"])):
+            entry.delete(0, "end")
+            entry.insert(0, str(value))
+
+    def _show_ticks(self):
+        """Fill the tick value and unit entries from tick_values/tick_units and enable the tick buttons"""
+        for axis, first, second, units in (("horizontal", "horz_tick1_entry", "horz_tick2_entry", "horizontal_units_entry"),
+                                           ("vertical", "vert_tick1_entry", "vert_tick2_entry", "vertical_units_entry")):
+            values = self.tick_values.get(axis) or ["", ""]
+            for entry, value in ((getattr(self, first), values[0]), (getattr(self, second), values[1]),
+                                 (getattr(self, units), self.tick_units.get(axis, ""))):
+                entry.config(state="normal")
+                entry.delete(0, "end")
+                entry.insert(0, str(value))
+            if getattr(self, f"{axis}_ticks"):
+                getattr(self, f"save_{axis}_ticks_btn").config(state="normal")
+                getattr(self, f"clear_{axis}_ticks_btn").config(state="normal")
+
+    def calibration_key(self):
+        return template_key(self.get_protocol(), self.get_location())
+
+    def remember_calibration(self):
+        """Keep the ticks as this Protocol/Location's calibration template once both axes have values"""
+        key = self.calibration_key()
+        if self.calibrations is None or key is None or self.source_image is None:
+            return
+        ticks = {axis: getattr(self, f"{axis}_ticks") for axis in AXES}
+        if any(len(ticks[axis]) < 2 or len(self.tick_values[axis]) < 2 or "" in self.tick_values[axis]
+               for axis in AXES):
+            return
+        source_ticks = {axis: [self.geometry.to_source(x, y) for x, y in ticks[axis][:2]] for axis in AXES}
+        scale = self.source_image.shape[1] / self.source_size[0]
+        try:
+            self.calibrations.put(key, self.source_image, scale, source_ticks, self.tick_values, self.tick_units)
+        except OSError as e:
+            log_to_console(self, f"Could not save calibration template: {e}", "ERROR")
+            return
+        log_to_console(self, f"Saved calibration template for {key}")
+
+    @traced
+    def match_calibration(self):
+        """Match Calibration button: apply this Protocol/Location's template whatever its confidence"""
+        self._match_calibration(auto=False)
+
+    def _match_calibration(self, auto):
+        """Place ticks, values and units from this Protocol/Location's template, found by template matching.
+
+        On load (auto) the match is only applied at CALIBRATION_MIN_SCORE or above.
+        """
+        key = self.calibration_key()
+        if self.calibrations is None or key is None or self.source_image is None:
+            if not auto:
+                log_to_console(self, "Enter Protocol and/or Location to look up a calibration template.", "WARNING")
+            return False
+        scale = self.source_image.shape[1] / self.source_size[0]
+        with PROFILER.timer("calibration.match"):
+            found = self.calibrations.match(key, self.source_image, scale)
+        if found is None:
+            if not auto:
+                log_to_console(self, f"No calibration template for {key}.", "WARNING")
+            return False
+        ticks, template, score = found
+        self.calibration_score = score
+        if auto and score < self.calibrations.min_score:
+            log_to_console(self, f"Calibration template for {key} matched with confidence {score:.2f}, below "
+                                 f"{self.calibrations.min_score:.2f}; place the ticks by hand or press Match Calibration")
+            return False
+        for axis in AXES:
+            setattr(self, f"{axis}_ticks", [self.geometry.to_output(x, y) for x, y in ticks[axis]])
+        self.tick_values = {axis: list(template["tick_values"].get(axis) or []) for axis in AXES}
+        self.tick_units = {axis: template["tick_units"].get(axis, "") for axis in AXES}
+        self._show_ticks()
+        log_to_console(self, f"Calibration pre-filled from the template for {key} (confidence {score:.2f})",
+                       "INFO" if score >= self.calibrations.min_score else "WARNING")
+        if not auto:
+            self.update_overlays()
+        return True
+
+    def session_state(self):
+        """The current image's edits, ROIs, ticks and metadata as JSON-ready data (a template plus erase strokes)"""
+        state = self.template()
+        state["operations"] = [[kind, {"points": value["points"], "radius": value["radius"]}
+                                if kind == "erase" else value] for kind, value in self.history.applied_ops()]
+        return state
+
+    def checkpoint(self):
+        """Queue the current image's state for the session file if it changed since the last checkpoint"""
+        if self.session is None or self.history is None:
+            return
+        state = self.session_state()
+        encoded = json.dumps(state)
+        if encoded != self.checkpointed:
+            self.checkpointed = encoded
+            self.session.put(self.current_file, state)
+            self.edited_paths.add(self.current_file)
+
+    def _step_index(self, step):
+        """Index of the next image in direction step, passing over near-duplicates when DUPLICATE_ACTION is "skip" """
+        i = self.current_index + step
+        if self.duplicates is not None and self.config["DUPLICATE_ACTION"] == "skip":
+            while 0 <= i < len(self.image_files) and self.duplicates.duplicate_of(self.image_files[i]):
+                i += step
+        return i if 0 <= i < len(self.image_files) else None
+
+    def annotation_status(self, path):
+        """Filmstrip status of path: "saved" (by anyone), "edited", "claimed" (by another annotator), "duplicate" or None"""
+        if path in self.saved_paths:
+            return "saved"
+        shared = self.work.status(path) if self.work is not None else None
+        if shared == "done":
+            return "saved"
+        if path in self.edited_paths:
+            return "edited"
+        if shared == "claimed":
+            return "claimed"
+        if self.duplicates is not None and self.duplicates.duplicate_of(path):
+            return "duplicate"
+        return None
+
+    def claim_current(self, previous):
+        """Move this annotator's lease from previous to the current image, warning when someone else has it"""
+        # An image whose row is still being written keeps its lease until poll_saves completes it
+        if previous is not None and previous != self.current_file and previous not in self.saving_paths \
+                and self.work.status(previous) == "mine":
+            self.work.release(previous)
+        if self.work.claim(self.current_file):
+            return
+        if self.work.status(self.current_file) == "done":
+            log_to_console(self, "This image was already saved by another annotator.", "WARNING")
+        else:
+            log_to_console(self, f"This image is claimed by {self.work.owner(self.current_file)}; "
+                                 f"your changes may collide with theirs.", "WARNING")
+
+    def work_poll_ms(self):
+        # Renew well before the lease runs out, and refresh the others' claims at least every minute
+        return int(min(60, self.work.lease_seconds / 3) * 1000)
+
+    def poll_work(self):
+        """Renew the current image's lease and re-read the other annotators' claims and throughput"""
+        self.work.snapshot()
+        if self.current_file is not None and self.work.status(self.current_file) == "mine":
+            if not self.work.renew(self.current_file):
+                log_to_console(self, f"Lost the claim on this image to {self.work.owner(self.current_file)}.",
+                               "WARNING")
+        self.work_stats = self.work.throughput()
+        if self.filmstrip is not None:
+            self.filmstrip.update_visible()
+        update_progress(self)
+        self.root.after(self.work_poll_ms(), self.poll_work)
+
+    @traced
+    def go_to_image(self, index):
+        """Jump straight to image index, e.g. from a filmstrip click"""
+        if index is None or not 0 <= index < len(self.image_files) or index == self.current_index:
+            return
+        self.current_index = index
+        self.load_current_image()
+
+    @traced
+    def scroll_filmstrip(self, *args):
+        """Filmstrip scrollbar/wheel handler: move now, draw the cells that came into view with the next frame"""
+        self.filmstrip_canvas.xview(*args)
+        self.scheduler.request("filmstrip", self.update_filmstrip)
+
+    def update_filmstrip(self):
+        if self.filmstrip is not None:
+            self.filmstrip.update_visible()
+            self.poll_thumbnails()
+
+    def poll_thumbnails(self):
+        """Show thumbnails written in the background while the pool still has work"""
+        if self.thumbnails is None:
+            return
+        written = self.thumbnails.drain()
+        if written:
+            self.filmstrip.refresh(written)
+        if self.thumbnails.pending and not self.thumbnail_poll_scheduled:
+            self.thumbnail_poll_scheduled = True
+            self.root.after(100, self._poll_thumbnails_tick)
+
+    def _poll_thumbnails_tick(self):
+        self.thumbnail_poll_scheduled = False
+        self.poll_thumbnails()
+
+    def prefetch_neighbours(self):
+        start = max(0, self.current_index - 1)
+        ahead = self.image_files[self.current_index + 1:self.current_index + 1 + self.image_cache.ahead]
+        self.image_cache.prefetch(ahead + self.image_files[start:self.current_index])
+        if self.config["AUTO_ROI"]:
+            self.roi_proposer.submit([self.current_file] + ahead)
+
+    def poll_proposals(self):
+        """Show the current image's background ROI proposals once they are ready, or add them if accepted"""
+        accepting = self.accept_pending is not None and self.accept_pending == self.current_file
+        if self.roi_proposer is None or not accepting and (not self.config["AUTO_ROI"] or self.roi_rectangles):
+            return
+        proposals = self.roi_proposer.get(self.current_file)
+        if proposals is None:
+            if not self.proposal_poll_scheduled:
+                self.proposal_poll_scheduled = True
+                self.root.after(50, self._poll_proposals_tick)
+            return
+        self.proposed_rois = proposals
+        if accepting:
+            self.accept_pending = None
+            self._add_proposals()
+        else:
+            self.update_overlays()
+
+    def _poll_proposals_tick(self):
+        self.proposal_poll_scheduled = False
+        self.poll_proposals()
+
+    @traced
+    def accept_roi_proposals(self):
+        """Add every proposed ROI in one step, as soon as the background pass has found them"""
+        if self.source_image is None:
+            return
+        if not self.proposed_rois and self.roi_proposer.get(self.current_file) is None:
+            self.accept_pending = self.current_file
+            self.roi_proposer.submit([self.current_file])
+            log_to_console(self, "Finding ECG/waveform strips...")
+            self.poll_proposals()
+            return
+        self.proposed_rois = self.proposed_rois or self.roi_proposer.get(self.current_file)
+        self._add_proposals()
+
+    def _add_proposals(self):
+        added = [r for r in (rect_to_output(p, self.geometry) for p in self.proposed_rois) if r is not None]
+        if not added:
+            log_to_console(self, "No ECG or waveform strips found.", "WARNING")
+            return
+        self.roi_rectangles.extend(added)
+        self.undo_stack.extend(added)
+        self.proposed_rois = []
+        for x0, y0, x1, y1, mode in added:
+            log_to_console(self, f"Added ROI ({mode}): ({x0},{y0}) to ({x1},{y1})")
+        self.update_overlays()
+
+    def on_close(self):
+        stats = self.image_cache.stats()
+        log_to_console(self, f"Image cache: {stats['hits']} hits, {stats['misses']} misses")
+        frames = self.scheduler.stats()
+        log_to_console(self, f"Events: {frames['requests']} redraw requests in {frames['frames']} frames "
+                             f"({frames['merged']} merged, {frames['over_budget']} over budget), "
+                             f"{frames['dropped']} events dropped", "DEBUG")
+        self.image_cache.close()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+        if self.duplicate_thread is not None:
+            self.duplicates.cancel()
+            self.duplicate_thread.join()
+        if self.roi_proposer is not None:
+            self.roi_proposer.close()
+        if self.save_queue.pending:
+            log_to_console(self, f"Finishing {self.save_queue.pending} queued saves...")
+        self.save_queue.close()
+        self.mark_committed()
+        for description, error in self.save_queue.failed:
+            log_to_console(self, f"Save failed: {description}: {error}", "ERROR")
+        if self.roi_dataset is not None:
+            self.roi_dataset.close()
+        self.results_store.close()
+        if self.session is not None:
+            self.checkpoint()
+            self.session.close()
+        if self.work is not None and self.current_file is not None and self.work.status(self.current_file) == "mine":
+            self.work.release(self.current_file)
+        if self.trace is not None:
+            self.trace.close()
+        if self.config["PROFILE_FILE"]:
+            try:
+                PROFILER.dump(self.config["PROFILE_FILE"])
+                log_to_console(self, f"Wrote timing profile to: {self.config['PROFILE_FILE']}")
+            except OSError as e:
+                log_to_console(self, f"Could not write timing profile: {e}", "ERROR")
+        self.console.close()
+        self.root.destroy()
     
     def log_images_found(self):
         total = len(self.image_files)
@@ -92,33 +853,141 @@ class MedicalImageProcessor:
         log_to_console(self, f"Currently viewing image {self.current_index + 1}")
         log_to_console(self, f"Images left to process: {remaining}")
 
+    @PROFILER.timed("display.update")
     def update_display(self):
-        img = self.cv_image if self.cv_image is not None else self.original_image
-        if img is None:
+        """Re-tile the current image at the current zoom, then the overlay items"""
+        self.render_base()
+        self.update_overlays()
+
+    def render_base(self):
+        """Point the tile viewer at the current source and geometry; call only when pixels or geometry change"""
+        if self.source_image is None:
             return
-        self.rotated_image = img.copy()
-        pil_img = Image.fromarray(cv2.cvtColor(self.rotated_image, cv2.COLOR_BGR2RGB))
-        pil_img = draw_annotations(pil_img, self)
-        w, h = pil_img.size
-        self.displayed_image_width = w
-        self.displayed_image_height = h
+        w, h = self.geometry.size
         max_w, max_h = self.display_width, self.display_height
+        fit_scale = min(max_w / w, max_h / h, 1.0)
+        self.viewer.set_image(self.source_image, self.geometry, fit_scale, self.source_size)
+        self.canvas.config(width=min(max(1, int(w * fit_scale)), max_w), height=min(max(1, int(h * fit_scale)), max_h))
+        self._set_scrollregion()
+        self.viewer.update_visible()
 
-        scale = min(max_w / w, max_h / h, 1.0)
-        if scale < 1.0:
-            new_w, new_h = int(w * scale), int(h * scale)
-            pil_img = pil_img.resize((new_w, new_h), resample)
-            self.displayed_image_width = new_w
-            self.displayed_image_height = new_h
-        else:
-            new_w, new_h = w, h
+    def _set_scrollregion(self):
+        self.display_scale = self.viewer.scale
+        self.displayed_image_width, self.displayed_image_height = self.viewer.size
+        self.canvas.config(scrollregion=(0, 0, self.displayed_image_width, self.displayed_image_height))
+
+    @traced
+    def zoom_at(self, steps, canvas_x=None, canvas_y=None):
+        """Zoom by powers of two, keeping the image point under window point (canvas_x, canvas_y) in place"""
+        if self.source_image is None or self.display_scale is None:
+            return
+        if canvas_x is None:
+            canvas_x, canvas_y = self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2
+        img_x = self.canvas.canvasx(canvas_x) / self.display_scale
+        img_y = self.canvas.canvasy(canvas_y) / self.display_scale
+        if not self.viewer.set_zoom(self.viewer.zoom + steps):
+            return
+        self._set_scrollregion()
+        self.canvas.xview_moveto(max(0.0, img_x * self.display_scale - canvas_x) / self.displayed_image_width)
+        self.canvas.yview_moveto(max(0.0, img_y * self.display_scale - canvas_y) / self.displayed_image_height)
+        if self.display_scale > min(self.viewer.source_scale):
+            self.full_resolution_source()
+        self.viewer.update_visible()
+        self.update_overlays()
+        log_to_console(self, f"Zoom: {self.display_scale:.3g}x")
+
+    @traced
+    def zoom_to_fit(self):
+        self.zoom_at(-self.viewer.zoom)
+
+    @traced
+    def set_window_level(self, window, level):
+        """Show source values level +/- window/2 across the full display range"""
+        window = max(float(window), 1e-6)
+        if self.viewer.set_window((level - window / 2, level + window / 2)):
+            self.viewer.update_visible()
+
+    def apply_window_level(self):
+        try:
+            window, level = float(self.window_entry.get()), float(self.level_entry.get())
+        except ValueError:
+            log_to_console(self, "Window and level must be numbers.", "WARNING")
+            return
+        self.set_window_level(window, level)
+        log_to_console(self, f"Display window {self.viewer.window[0]:g}-{self.viewer.window[1]:g}")
+
+    @traced
+    def auto_window_level(self):
+        """Back to the automatic window: full range for 8-bit images, 0.5-99.5 percentiles otherwise"""
+        if self.viewer.set_window(None):
+            self.viewer.update_visible()
+        self._show_window_level()
+
+    def _show_window_level(self):
+        if self.viewer.window is None or not hasattr(self, "window_entry"):
+            return
+        lo, hi = self.viewer.window
+        for entry, value in ((self.window_entry, hi - lo), (self.level_entry, (lo + hi) / 2)):
+            entry.delete(0, "end")
+            entry.insert(0, f"{value:g}")
 
-        self.tk_image = ImageTk.PhotoImage(pil_img)
-        self.canvas.delete("all")
-        self.canvas.config(width=min(new_w, max_w), height=min(new_h, max_h))
-        self.canvas.create_image(0, 0, anchor="nw", image=self.tk_image)
-        self.canvas.config(scrollregion=(0, 0, new_w, new_h))
+    @traced
+    def scroll_view(self, axis, *args):
+        """Scrollbar/wheel handler: move the view now, render tiles that came into it with the next frame"""
+        (self.canvas.xview if axis == "x" else self.canvas.yview)(*args)
+        self.scheduler.request("tiles", self.viewer.update_visible)
+
+    def refresh_source_region(self, bbox):
+        """Re-sample only the (x0, y0, x1, y1) source region and redraw the tiles it maps to"""
+        if self.display_scale is None:
+            self.render_base()
+            return
+        self.viewer.invalidate_source_region(bbox)
+
+    def full_resolution_source(self, refresh=True):
+        """Replace a display preview with the full-resolution decode the first time real pixels are needed.
+
+        refresh=False leaves the viewer alone, for callers that re-render anyway.
+        """
+        if self.source_image.shape[1::-1] == tuple(self.source_size):
+            return self.source_image
+        start = time.perf_counter()
+        img, size = read_full(self.current_file)
+        if img is None or tuple(size) != tuple(self.source_size):
+            log_to_console(self, f"Could not read full resolution of: {self.current_file}", "ERROR")
+            return None
+        self.history.replace_source(self.source_image, img)
+        self.source_image = img
+        self.full_image = None
+        if refresh:
+            self.viewer.set_image(img, self.geometry, self.viewer.fit_scale)
+            self.viewer.update_visible()
+        log_to_console(self, f"Loaded full resolution in {time.perf_counter() - start:.2f} s")
+        return img
+
+    def get_full_image(self):
+        """Full-resolution output pixels, rendered from the source in one resample and cached until the next edit"""
+        if self.full_image is None and self.source_image is not None:
+            source = self.full_resolution_source()
+            if source is not None:
+                with PROFILER.timer("render.full"):
+                    self.full_image = self.geometry.render(source)
+        return self.full_image
+
+    def _writable_source(self, refresh=True):
+        """Copy the shared, read-only decoded image before the first erase touches it"""
+        if self.full_resolution_source(refresh) is None:
+            return None
+        if not self.source_image.flags.writeable:
+            self.source_image = self.source_image.copy()
+            self.viewer.set_source(self.source_image)
+        return self.source_image
+
+    def update_overlays(self):
+        """Move ticks, ROIs, the crop rectangle and metadata text without touching pixels"""
+        draw_annotations(self)
         update_progress(self)
+        self.checkpoint()
 
     def clear_horizontal_ticks(self):
         self.horizontal_ticks = []
@@ -126,7 +995,7 @@ class MedicalImageProcessor:
         self.horz_tick1_entry.delete(0, 'end')
         self.horz_tick2_entry.delete(0, 'end')
         self.horizontal_units_entry.delete(0, 'end')
-        self.update_display()
+        self.update_overlays()
         log_to_console(self, "Cleared horizontal ticks.")
 
     def clear_vertical_ticks(self):
@@ -135,7 +1004,7 @@ class MedicalImageProcessor:
         self.vert_tick1_entry.delete(0, 'end')
         self.vert_tick2_entry.delete(0, 'end')
         self.vertical_units_entry.delete(0, 'end')
-        self.update_display()
+        self.update_overlays()
         log_to_console(self, "Cleared vertical ticks.")
 
     def save_horizontal_ticks(self):
@@ -149,6 +1018,8 @@ class MedicalImageProcessor:
         except Exception:
             self.tick_values["horizontal"] = ["", ""]
         self.tick_units["horizontal"] = self.horizontal_units_entry.get().strip()
+        self.checkpoint()
+        self.remember_calibration()
         log_to_console(self, "Saved horizontal tick calibration.")
 
     def save_vertical_ticks(self):
@@ -162,145 +1033,288 @@ class MedicalImageProcessor:
         except Exception:
             self.tick_values["vertical"] = ["", ""]
         self.tick_units["vertical"] = self.vertical_units_entry.get().strip()
+        self.checkpoint()
+        self.remember_calibration()
         log_to_console(self, "Saved vertical tick calibration.")
 
+    @traced
     def start_crop(self):
         self.crop_mode = True
         log_to_console(self, "Draw a rectangle to crop the image.")
-        self.update_display()
+        self.update_overlays()
 
+    @traced
     def start_roi_mode(self, mode):
         self.roi_mode = mode
         self.crop_mode = True
         self.crop_start = None
         self.crop_rect = None
         log_to_console(self, f"ROI mode: {mode} - click and drag to select area")
-        self.update_display()
+        self.update_overlays()
 
     def crop_image(self):
         if not self.crop_rect:
             return
-        x0, y0, x1, y1 = map(int, self.crop_rect)
-        x0, x1 = max(0, min(x0, x1)), min(self.cv_image.shape[1], max(x0, x1))
-        y0, y1 = max(0, min(y0, y1)), min(self.cv_image.shape[0], max(y0, y1))
-        self.cv_image = self.cv_image[y0:y1, x0:x1]
-        self.original_image = self.cv_image.copy()
+        geometry, rect = self.geometry.cropped(self.crop_rect)
         self.crop_rect = None
         self.crop_mode = False
+        if geometry.size[0] == 0 or geometry.size[1] == 0:
+            log_to_console(self, "Crop region is empty; drag a rectangle inside the image.", "WARNING")
+            self.update_overlays()
+            return
+        self.geometry = geometry
+        self.full_image = None
+        self.history.record(("crop", rect), self.source_image, self.geometry)
+        x0, y0, x1, y1 = rect
         log_to_console(self, f"Cropped image to: ({x0}, {y0}), ({x1}, {y1})")
         self.update_display()
 
+    @traced
     def rotate_image(self, angle):
-        self.rotation_angle += angle
-        img = self.cv_image if self.cv_image is not None else self.original_image
-        if img is None:
+        if self.source_image is None:
             return
-
-        (h, w) = img.shape[:2]
-        center = (w / 2, h / 2)
-        M = cv2.getRotationMatrix2D(center, self.rotation_angle, 1.0)
-        abs_cos = abs(M[0, 0])
-        abs_sin = abs(M[0, 1])
-        new_w = int(h * abs_sin + w * abs_cos)
-        new_h = int(h * abs_cos + w * abs_sin)
-        M[0, 2] += (new_w / 2) - center[0]
-        M[1, 2] += (new_h / 2) - center[1]
-        rotated = cv2.warpAffine(img, M, (new_w, new_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-        self.cv_image = rotated
+        self.geometry = self.geometry.rotated(angle)
+        self.rotation_angle = self.geometry.angle
+        self.full_image = None
+        self.history.record(("rotate", angle), self.source_image, self.geometry)
         self.update_display()
         log_to_console(self, f"Rotated image by {angle} degrees (total: {self.rotation_angle}).")
 
+    def begin_erase_stroke(self, x, y):
+        source = self._writable_source()
+        if source is None:
+            return
+        self.erase_stroke = EraserStroke(source, self.get_eraser_radius())
+        self.continue_erase_stroke(x, y)
+
+    def continue_erase_stroke(self, x, y):
+        """Erase at output pixel (x, y); strokes are painted into the source through the inverse geometry"""
+        if self.erase_stroke is None:
+            return
+        bbox = self.erase_stroke.add_point(*self.geometry.to_source(x, y))
+        self.full_image = None
+        if self.dirty_bbox is not None:
+            bbox = (min(bbox[0], self.dirty_bbox[0]), min(bbox[1], self.dirty_bbox[1]),
+                    max(bbox[2], self.dirty_bbox[2]), max(bbox[3], self.dirty_bbox[3]))
+        self.dirty_bbox = bbox
+        self.scheduler.request("erase", self._refresh_dirty)
+
+    def _refresh_dirty(self):
+        bbox, self.dirty_bbox = self.dirty_bbox, None
+        if bbox is not None:
+            self.refresh_source_region(bbox)
+
+    def finish_erase_stroke(self):
+        stroke, self.erase_stroke = self.erase_stroke, None
+        if stroke is not None and stroke.bbox is not None:
+            self.history.record(stroke.as_operation(), self.source_image, self.geometry)
+            self.checkpoint()
+
+    @traced
+    def undo_edit(self):
+        op, source, self.geometry, bbox = self.history.undo(self.source_image, self.geometry)
+        if op is None:
+            log_to_console(self, "Nothing to undo.")
+            return
+        self._show_history_step(source, bbox)
+        log_to_console(self, f"Undid {op[0]}")
+
+    @traced
+    def redo_edit(self):
+        op, source, self.geometry, bbox = self.history.redo(self.source_image, self.geometry)
+        if op is None:
+            log_to_console(self, "Nothing to redo.")
+            return
+        self._show_history_step(source, bbox)
+        log_to_console(self, f"Redid {op[0]}")
+
+    def _show_history_step(self, source, bbox):
+        self.source_image = source
+        self.rotation_angle = self.geometry.angle
+        self.full_image = None
+        if bbox is not None:
+            self.refresh_source_region(bbox)
+        else:
+            self.update_display()
+
+    @traced
     def start_erase(self):
         self.drawing_mode = "erase"
-        log_to_console(self, "Eraser mode: drag mouse to erase parts of the image.")
+        log_to_console(self, f"Eraser mode (radius {self.get_eraser_radius()} px): drag mouse to erase parts of the image.")
 
+    def get_eraser_radius(self):
+        try:
+            return max(1, int(self.eraser_radius_var.get()))
+        except (AttributeError, ValueError, tk.TclError):
+            return self.config["ERASER_RADIUS"]
+
+    @traced
     def previous_image(self):
-        if self.current_index > 0:
-            self.current_index -= 1
+        i = self._step_index(-1)
+        if i is not None:
+            self.current_index = i
             self.load_current_image()
         else:
             log_to_console(self, "Already at the first image.")
 
+    @traced
     def next_image(self):
-        if self.current_index < len(self.image_files) - 1:
-            self.current_index += 1
+        if self.work is not None:
+            # Hand out the next image nobody has claimed or finished, wrapping around to the start
+            self.work.snapshot()
+            i = self.work.next_index(self.image_files, self.current_index + 1)
+            if i is None:
+                log_to_console(self, "No unclaimed images left.")
+                return
+        else:
+            i = self._step_index(1)
+        if i is not None:
+            self.current_index = i
             self.load_current_image()
         else:
             log_to_console(self, "Already at the last image.")
 
+    @traced
     def save_all_rois(self):
         if not self.roi_rectangles:
-            log_to_console(self, "No ROIs to save.")
+            log_to_console(self, "No ROIs to save.", "WARNING")
             return
 
-        base_filename = os.path.splitext(os.path.basename(self.current_file))[0]
-        parent_dir = os.path.dirname(self.current_file)
-        subfolder_path = os.path.join(parent_dir, base_filename)
-        os.makedirs(subfolder_path, exist_ok=True)
+        full = self.get_full_image()
+        if full is None:
+            return
+        ext = roi_format(self.config["ROI_FORMAT"], full.dtype)
+        if ext != self.config["ROI_FORMAT"]:
+            log_to_console(self, f"{self.config['ROI_FORMAT']} cannot hold {full.dtype} pixels; "
+                                 f"saving ROIs as {ext}", "WARNING")
+        params = image_write_params(ext, self.config["PNG_COMPRESSION"])
+        calibration = None
+        if self.config["DIGITIZE_ON_SAVE"]:
+            calibration = calibration_from_row(self.current_metadata_row())
+        crops = [(path, roi.copy(), rect) for path, roi, rect in
+                 roi_crops(full, self.roi_rectangles, self.current_file, ext)]
+        if self.config["ROI_EXPORT"] in ("files", "both"):
+            for path, roi, rect in crops:
+                self.save_queue.submit(self.current_file, f"ROI {path}", write_roi, path, roi, params,
+                                       rect, calibration)
+        if self.roi_dataset is not None and crops:
+            record = image_record(dict(self.current_metadata_row(), path=self.current_file), self.image_dir)
+            self.save_queue.submit(self.current_file, f"{len(crops)} packed ROI(s) of {self.current_file}",
+                                   self.roi_dataset.write_image, [(roi, rect) for _, roi, rect in crops],
+                                   dict(record, saved_at=time.time()))
+        log_to_console(self, f"Queued {len(crops)} ROI(s) for saving" + (" with traces." if calibration else "."))
+        self.poll_saves()
+
+    def poll_saves(self):
+        """Log finished background saves and keep the progress label's save counters current"""
+        pending = self.save_queue.pending
+        for description, error in self.save_queue.drain_events():
+            if error:
+                log_to_console(self, f"Save failed: {description}: {error}", "ERROR")
+            else:
+                log_to_console(self, f"Saved {description}")
+        if self.mark_committed() and self.filmstrip is not None:
+            self.filmstrip.update_visible()
+        update_progress(self)
+        if pending and not self.save_poll_scheduled:
+            self.save_poll_scheduled = True
+            self.root.after(200, self._poll_saves_tick)
 
-        for idx, (x0, y0, x1, y1, mode) in enumerate(self.roi_rectangles):
-            roi = self.cv_image[y0:y1, x0:x1]
-            suffix = f"_{mode.lower()}_{idx+1}"
-            roi_path = os.path.join(subfolder_path, f"{base_filename}{suffix}.png")
-            cv2.imwrite(roi_path, roi)
-            log_to_console(self, f"Saved ROI: {roi_path}")
+    def mark_committed(self):
+        """Mark the images whose rows were committed since the last call as saved; returns them"""
+        committed = []
+        while True:
+            try:
+                committed.append(self.committed_rows.get_nowait())
+            except queue.Empty:
+                break
+        for path in committed:
+            self.saved_paths.add(path)
+            self.saving_paths.discard(path)
+            if self.work is not None:
+                self.work.complete(path)
+        return committed
 
+    def _poll_saves_tick(self):
+        self.save_poll_scheduled = False
+        self.poll_saves()
+
+    @traced
     def undo_last_roi(self):
         if self.roi_rectangles:
             self.redo_stack.append(self.roi_rectangles.pop())
-            self.update_display()
+            self.update_overlays()
             log_to_console(self, "Undid last ROI")
 
+    @traced
     def redo_last_roi(self):
         if self.redo_stack:
             self.roi_rectangles.append(self.redo_stack.pop())
-            self.update_display()
+            self.update_overlays()
             log_to_console(self, "Redid last ROI")
 
-    def save_to_excel(self):
+    def current_metadata_row(self):
+        return metadata_row(self.horizontal_ticks, self.vertical_ticks, self.tick_values, self.tick_units,
+                            waveform_type=self.get_type(), location=self.get_location(),
+                            protocol=self.get_protocol(),
+                            co_present=self.co_present_var.get() if hasattr(self, "co_present_var") else "",
+                            roi_rectangles=self.roi_rectangles,
+                            operations=[op for op in self.history.applied_ops() if op[0] in ("crop", "rotate")])
+
+    @traced
+    def save_data(self):
         if not self.get_location() or not self.get_type():
-            log_to_console(self, "Location and Type fields cannot be empty.")
-            return
-
-        hticks = self.horizontal_ticks
-        vticks = self.vertical_ticks
-
-        horizontal_tick_values = self.tick_values.get("horizontal", ["", ""])
-        vertical_tick_values = self.tick_values.get("vertical", ["", ""])
-        horizontal_units = self.tick_units.get("horizontal", "")
-        vertical_units = self.tick_units.get("vertical", "")
-        waveform_type = self.get_type()
-        waveform_location = self.get_location()
-        protocol = self.get_protocol()
-
-        data = {
-            "horizontal_tick1_px": [hticks[0][0] if len(hticks) > 0 else ""],
-            "horizontal_tick1_py": [hticks[0][1] if len(hticks) > 0 else ""],
-            "horizontal_tick2_px": [hticks[1][0] if len(hticks) > 1 else ""],
-            "horizontal_tick2_py": [hticks[1][1] if len(hticks) > 1 else ""],
-            "horizontal_tick1_value": [horizontal_tick_values[0]],
-            "horizontal_tick2_value": [horizontal_tick_values[1]],
-            "horizontal_units": [horizontal_units],
-
-            "vertical_tick1_px": [vticks[0][0] if len(vticks) > 0 else ""],
-            "vertical_tick1_py": [vticks[0][1] if len(vticks) > 0 else ""],
-            "vertical_tick2_px": [vticks[1][0] if len(vticks) > 1 else ""],
-            "vertical_tick2_py": [vticks[1][1] if len(vticks) > 1 else ""],
-            "vertical_tick1_value": [vertical_tick_values[0]],
-            "vertical_tick2_value": [vertical_tick_values[1]],
-            "vertical_units": [vertical_units],
-
-            "waveform_type": [waveform_type],
-            "waveform_location": [waveform_location],
-            "co_present": [self.co_present_var.get() if hasattr(self, "co_present_var") else ""],
-
-            "location_free_text": [self.get_location()],
-            "protocol_free_text": [self.get_protocol()],
+            log_to_console(self, "Location and Type fields cannot be empty.", "WARNING")
+            return
+
+        row = self.current_metadata_row()
+        self.saving_paths.add(self.current_file)
+        self.save_queue.submit(self.current_file, f"metadata for {self.current_file}",
+                               self._commit_row, self.current_file, row)
+        self.poll_saves()
+
+    def _commit_row(self, path, row):
+        # Writer thread: the image only counts as saved once its row is committed
+        self.results_store.save(path, row)
+        self.committed_rows.put(path)
+
+    def export_results(self):
+        path = filedialog.asksaveasfilename(title="Export results", defaultextension=".xlsx",
+                                            filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+        try:
+            if self.work is not None:
+                # Every annotator's rows, not just this one's
+                self.results_store.flush()
+                n = write_table(*merged_rows(folder_db_paths(self.image_dir)), path)
+            else:
+                n = self.results_store.export(path)
+        except (ImportError, ValueError, sqlite3.Error) as e:
+            log_to_console(self, f"Export failed: {e}", "ERROR")
+            return
+        log_to_console(self, f"Exported {n} results to: {path}")
+
+    def template(self):
+        """Current operations, ROIs and calibration as a batch template dict"""
+        return {
+            "operations": [list(op) for op in self.history.applied_ops() if op[0] in ("crop", "rotate")],
+            "roi_rectangles": [list(r) for r in self.roi_rectangles],
+            "horizontal_ticks": [list(t) for t in self.horizontal_ticks],
+            "vertical_ticks": [list(t) for t in self.vertical_ticks],
+            "tick_values": self.tick_values,
+            "tick_units": self.tick_units,
+            "waveform_type": self.get_type(),
+            "location": self.get_location(),
+            "protocol": self.get_protocol(),
+            "co_present": self.co_present_var.get() if hasattr(self, "co_present_var") else "",
         }
 
-        df = pd.DataFrame(data)
-        base_filename = os.path.splitext(os.path.basename(self.current_file))[0]
-        output_dir = os.path.dirname(self.current_file)
-        excel_path = os.path.join(output_dir, f"{base_filename}.xlsx")
-        df.to_excel(excel_path, index=False)
-        log_to_console(self, f"Saved calibration and metadata to: {excel_path}")
+    def save_template(self):
+        path = filedialog.asksaveasfilename(title="Save batch template", defaultextension=".json",
+                                            filetypes=[("Template", "*.json")])
+        if not path:
+            return
+        with open(path, "w") as f:
+            json.dump(self.template(), f, indent=2)
+        log_to_console(self, f"Saved batch template to: {path}")
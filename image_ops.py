@@ -0,0 +1,117 @@
+import os
+import json
+import cv2
+import numpy as np
+from profiler import PROFILER
+from digitize import digitize_roi, save_series, series_path
+from eraser import paint_stroke
+from geometry import Geometry
+
+def crop_array(img, rect):
+    """Crop img to rect, clamped to the image; returns the view and the clamped rect"""
+    x0, y0, x1, y1 = map(int, rect)
+    x0, x1 = max(0, min(x0, x1)), min(img.shape[1], max(x0, x1))
+    y0, y1 = max(0, min(y0, y1)), min(img.shape[0], max(y0, y1))
+    return img[y0:y1, x0:x1], (x0, y0, x1, y1)
+
+def apply_operations(img, operations):
+    """Paint recorded erase strokes into img, then render all crop/rotate steps in one resample"""
+    geometry = Geometry.identity(img)
+    for op, value in operations:
+        if op == "erase":
+            img = paint_stroke(img, value["points"], value["radius"])
+        elif op in ("crop", "rotate"):
+            geometry = geometry.apply((op, value))
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+    return geometry.render(img)
+
+def roi_path(image_path, idx, mode, ext=".png"):
+    """<basename>/<basename>_<mode>_<idx+1><ext> beside image_path"""
+    base_filename = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(os.path.dirname(image_path), base_filename, f"{base_filename}_{mode.lower()}_{idx+1}{ext}")
+
+def roi_crops(img, roi_rectangles, image_path, ext=".png"):
+    """Yield (path, ROI view, clamped (x0, y0, x1, y1, mode)) for each non-empty ROI"""
+    for idx, (x0, y0, x1, y1, mode) in enumerate(roi_rectangles):
+        roi, rect = crop_array(img, (x0, y0, x1, y1))
+        if roi.size == 0:
+            continue
+        yield roi_path(image_path, idx, mode, ext), roi, rect + (mode,)
+
+# ROI formats OpenCV writes losslessly at more than 8 bits per channel
+_DEEP_FORMATS = {np.dtype(np.uint16): (".png", ".tif", ".tiff"), np.dtype(np.float32): (".tif", ".tiff")}
+
+def roi_format(ext, dtype):
+    """ext if it can hold dtype pixels, else the lossless format that can (PNG for 16-bit, TIFF otherwise)"""
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8 or ext.lower() in _DEEP_FORMATS.get(dtype, ()):
+        return ext
+    return ".png" if dtype == np.uint16 else ".tiff"
+
+def image_write_params(ext, png_compression=3):
+    """cv2.imwrite flags for a lossless ROI export in the given format"""
+    ext = ext.lower()
+    if ext == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    if ext == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, 101]
+    if ext in (".tif", ".tiff"):
+        return [cv2.IMWRITE_TIFF_COMPRESSION, 1]
+    return []
+
+@PROFILER.timed("save.roi")
+def write_image(path, img, params=()):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not cv2.imwrite(path, img, list(params)):
+        raise IOError(f"cv2.imwrite failed for {path}")
+
+def write_roi(path, roi, params=(), rect=None, calibration=None):
+    """Write one ROI image and, given a calibration, its digitized trace beside it"""
+    write_image(path, roi, params)
+    if calibration is not None:
+        save_series(series_path(path), digitize_roi(roi, rect, calibration))
+
+def export_rois(img, roi_rectangles, image_path, ext=".png", params=()):
+    """Write every ROI synchronously; returns the written paths"""
+    saved = []
+    for path, roi, _ in roi_crops(img, roi_rectangles, image_path, ext):
+        write_image(path, roi, params)
+        saved.append(path)
+    return saved
+
+def metadata_row(horizontal_ticks, vertical_ticks, tick_values, tick_units,
+                 waveform_type="", location="", protocol="", co_present="", roi_rectangles=(), operations=()):
+    """Flatten tick calibration and free-text metadata into one results row"""
+    hticks = horizontal_ticks
+    vticks = vertical_ticks
+    horizontal_tick_values = tick_values.get("horizontal") or ["", ""]
+    vertical_tick_values = tick_values.get("vertical") or ["", ""]
+
+    return {
+        "horizontal_tick1_px": hticks[0][0] if len(hticks) > 0 else "",
+        "horizontal_tick1_py": hticks[0][1] if len(hticks) > 0 else "",
+        "horizontal_tick2_px": hticks[1][0] if len(hticks) > 1 else "",
+        "horizontal_tick2_py": hticks[1][1] if len(hticks) > 1 else "",
+        "horizontal_tick1_value": horizontal_tick_values[0],
+        "horizontal_tick2_value": horizontal_tick_values[1],
+        "horizontal_units": tick_units.get("horizontal", ""),
+
+        "vertical_tick1_px": vticks[0][0] if len(vticks) > 0 else "",
+        "vertical_tick1_py": vticks[0][1] if len(vticks) > 0 else "",
+        "vertical_tick2_px": vticks[1][0] if len(vticks) > 1 else "",
+        "vertical_tick2_py": vticks[1][1] if len(vticks) > 1 else "",
+        "vertical_tick1_value": vertical_tick_values[0],
+        "vertical_tick2_value": vertical_tick_values[1],
+        "vertical_units": tick_units.get("vertical", ""),
+
+        "waveform_type": waveform_type,
+        "waveform_location": location,
+        "co_present": co_present,
+
+        "location_free_text": location,
+        "protocol_free_text": protocol,
+
+        "roi_rectangles": json.dumps([list(r) for r in roi_rectangles]),
+        "operations": json.dumps([list(op) for op in operations]),
+    }
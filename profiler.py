@@ -0,0 +1,88 @@
+import json
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+class Profiler:
+    """Named wall-clock timers with rolling p50/p95/max over the last `window` samples.
+
+    Used as `with PROFILER.timer("stage"): ...` around hot-path stages, from
+    any thread. When disabled, timers run the code but record nothing.
+    """
+
+    def __init__(self, window=500, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self._samples = {}
+        self._counts = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator form of timer()"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._totals[name] = self._totals.get(name, 0.0) + seconds
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+
+    def stats(self, name):
+        """p50/p95/max in ms over the rolling window, plus all-time count and total seconds"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+            count, total = self._counts.get(name, 0), self._totals.get(name, 0.0)
+        if not samples:
+            return None
+        pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+        return {"count": count, "total_s": round(total, 3), "p50_ms": round(pick(0.50), 3),
+                "p95_ms": round(pick(0.95), 3), "max_ms": round(samples[-1] * 1000, 3)}
+
+    def summary(self):
+        with self._lock:
+            names = sorted(self._samples)
+        return {name: self.stats(name) for name in names}
+
+    def hud_text(self, names):
+        """One-line 'stage p50/p95 ms' readout of the given stages that have samples"""
+        parts = []
+        for name in names:
+            s = self.stats(name)
+            if s:
+                parts.append(f"{name} {s['p50_ms']:.1f}/{s['p95_ms']:.1f}")
+        return "ms p50/p95: " + ", ".join(parts) if parts else ""
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"created": time.time(), "window": self.window, "timers": self.summary()}, f, indent=2)
+
+PROFILER = Profiler()
@@ -0,0 +1,176 @@
+"""One SQLite results table per image directory, one row per image keyed by path.
+
+    python results_store.py /path/to/images/results.sqlite results.xlsx
+    python results_store.py /path/to/images results.xlsx   # every annotator's store, merged
+"""
+import os
+import csv
+import sqlite3
+import threading
+import time
+import argparse
+from profiler import PROFILER
+
+RESULTS_DB_NAME = "results.sqlite"
+
+def default_db_path(image_dir, annotator=None):
+    """results.sqlite, or results-<annotator>.sqlite for one of several annotators sharing the folder"""
+    return os.path.join(image_dir, RESULTS_DB_NAME if annotator is None else f"results-{annotator}.sqlite")
+
+def folder_db_paths(image_dir):
+    """Every results store in image_dir: results.sqlite and the annotators' results-*.sqlite"""
+    names = [n for n in os.listdir(image_dir)
+             if n == RESULTS_DB_NAME or (n.startswith("results-") and n.endswith(".sqlite"))]
+    return [os.path.join(image_dir, n) for n in sorted(names)]
+
+def merged_rows(db_paths):
+    """(columns, rows) of several results stores, keeping the most recently saved row of each image"""
+    columns, latest = ["path"], {}
+    for db_path in db_paths:
+        conn = sqlite3.connect(db_path)
+        try:
+            cur = conn.execute("SELECT * FROM results")
+            names = [d[0] for d in cur.description]
+            columns += [n for n in names if n not in columns]
+            for values in cur:
+                row = dict(zip(names, values))
+                old = latest.get(row["path"])
+                if old is None or (row.get("saved_at") or 0) >= (old.get("saved_at") or 0):
+                    latest[row["path"]] = row
+        finally:
+            conn.close()
+    return columns, [tuple(latest[path].get(c, "") for c in columns) for path in sorted(latest)]
+
+def write_table(columns, rows, out_path):
+    """Write rows to one .csv, .xlsx or .parquet file"""
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == ".csv":
+        with open(out_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    elif ext in (".xlsx", ".parquet"):
+        import pandas as pd
+        df = pd.DataFrame(rows, columns=columns)
+        if ext == ".xlsx":
+            df.to_excel(out_path, index=False)
+        else:
+            df.to_parquet(out_path, index=False)
+    else:
+        raise ValueError(f"Unsupported export format: {ext}")
+    return len(rows)
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class ResultsStore:
+    """Buffers saved rows and writes them to SQLite in batched transactions"""
+
+    def __init__(self, db_path, batch_size=20, flush_seconds=5.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (path TEXT PRIMARY KEY, saved_at REAL)")
+        self._columns = self._table_columns()
+
+    def _table_columns(self):
+        return [r[1] for r in self._conn.execute("PRAGMA table_info(results)")]
+
+    @PROFILER.timed("save.metadata")
+    def put(self, image_path, row):
+        """Queue the row for image_path, replacing any earlier unsaved row for the same image"""
+        with self._lock:
+            self._pending[os.path.abspath(image_path)] = dict(row, saved_at=time.time())
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def save(self, image_path, row):
+        """Write the row for image_path (and any queued ones) now, for callers that report it as saved"""
+        self.put(image_path, row)
+        self.flush()
+
+    def flush(self):
+        """Write all queued rows in a single transaction"""
+        with self._lock:
+            rows, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+            with self._conn:
+                new_columns = dict.fromkeys(k for row in rows.values() for k in row if k not in self._columns)
+                for name in new_columns:
+                    self._conn.execute(f"ALTER TABLE results ADD COLUMN {_quote(name)}")
+                    self._columns.append(name)
+                names = [c for c in self._columns if c != "path"]
+                sql = (f"INSERT OR REPLACE INTO results (path, {', '.join(map(_quote, names))}) "
+                       f"VALUES (?, {', '.join('?' for _ in names)})")
+                self._conn.executemany(sql, [[path] + [row.get(n, "") for n in names]
+                                             for path, row in rows.items()])
+            return len(rows)
+
+    def has(self, image_path):
+        path = os.path.abspath(image_path)
+        with self._lock:
+            if path in self._pending:
+                return True
+            return self._conn.execute("SELECT 1 FROM results WHERE path = ?", (path,)).fetchone() is not None
+
+    def get(self, image_path):
+        """Row saved (or queued) for image_path as a dict, or None"""
+        path = os.path.abspath(image_path)
+        with self._lock:
+            if path in self._pending:
+                return dict(self._pending[path])
+            cur = self._conn.execute("SELECT * FROM results WHERE path = ?", (path,))
+            row = cur.fetchone()
+            return dict(zip([d[0] for d in cur.description], row)) if row is not None else None
+
+    def paths(self):
+        """Every image path with a saved (or queued) row"""
+        with self._lock:
+            return {r[0] for r in self._conn.execute("SELECT path FROM results")} | set(self._pending)
+
+    def count(self):
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def rows(self):
+        """All stored rows as (columns, list of tuples), ordered by path"""
+        self.flush()
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM results ORDER BY path")
+            return [d[0] for d in cur.description], cur.fetchall()
+
+    @PROFILER.timed("results.export")
+    def export(self, out_path):
+        """Write every stored row to one .csv, .xlsx or .parquet file"""
+        return write_table(*self.rows(), out_path)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a results store to CSV, Excel or Parquet.")
+    parser.add_argument("db", help="results.sqlite, or the image directory (merging every annotator's store)")
+    parser.add_argument("out", help="output file (.csv, .xlsx or .parquet)")
+    args = parser.parse_args(argv)
+    if os.path.isdir(args.db):
+        n = write_table(*merged_rows(folder_db_paths(args.db)), args.out)
+    else:
+        store = ResultsStore(args.db)
+        n = store.export(args.out)
+        store.close()
+    print(f"Exported {n} rows to: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Packed ROI dataset: every saved ROI's pixels in a few large shards, for training pipelines.
+
+    python roi_dataset.py /path/to/images out_dir [--workers N] [--shard-mb 1024] [--from-source]
+
+A dataset is a directory of shard pairs:
+
+    shard-00000.bin     the ROIs' raw pixels, uncompressed, C order, each starting on a 64-byte boundary
+    shard-00000.jsonl   one record per ROI: offset, shape, dtype, source, roi, mode, rect,
+                        operations, calibration, waveform_type, location, protocol, saved_at
+
+so RoiDataset can hand out every ROI as a view into a read-only memmap of
+its shard, without decoding or copying. A record's pixels are written
+before its line, so a reader never sees a line without its data. Each
+writer claims new shard numbers with O_EXCL, so the app and the bulk
+export, or several annotators, never append to the same shard. Saving an
+image again appends its ROIs anew; readers keep the latest save of every
+source image.
+
+The bulk export packs every image with ROIs in the folder's results stores,
+reading the saved ROI files (erasures included) and re-cutting an ROI from
+its source image only where no file exists (or always, with --from-source).
+"""
+import os
+import json
+import time
+import threading
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from digitize import calibration_from_row
+from results_store import folder_db_paths, merged_rows
+
+DATASET_DIR_NAME = "roi_dataset"
+ALIGN = 64
+SHARD_MB = 1024
+
+def default_dataset_path(image_dir):
+    return os.path.join(image_dir, DATASET_DIR_NAME)
+
+def _shard_name(number):
+    return f"shard-{number:05d}"
+
+def image_record(row, image_dir):
+    """Fields shared by every ROI of one results row"""
+    return {"source": os.path.relpath(row["path"], image_dir).replace(os.sep, "/"),
+            "operations": json.loads(row.get("operations") or "[]"),
+            "calibration": calibration_from_row(row),
+            "waveform_type": row.get("waveform_type", ""),
+            "location": row.get("location_free_text", ""),
+            "protocol": row.get("protocol_free_text", "")}
+
+class ShardWriter:
+    """Appends ROIs to the shards of one dataset directory; safe to share between threads"""
+
+    def __init__(self, path, shard_mb=SHARD_MB):
+        self.path = path
+        self.shard_bytes = int(shard_mb * 1024 * 1024)
+        self.written = 0
+        self._lock = threading.Lock()
+        self._data = None
+        self._index = None
+        self._number = -1
+
+    def _open_shard(self):
+        self._close_shard()
+        os.makedirs(self.path, exist_ok=True)
+        number = self._number
+        while True:
+            number += 1
+            name = os.path.join(self.path, _shard_name(number))
+            try:
+                fd = os.open(name + ".bin", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            self._data = os.fdopen(fd, "wb")
+            self._index = open(name + ".jsonl", "a")
+            self._number = number
+            return
+
+    def _close_shard(self):
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def write_image(self, rois, record):
+        """Append [(roi array, (x0, y0, x1, y1, mode))] of one image, all sharing record's fields"""
+        record = dict(record, saved_at=record.get("saved_at") or time.time())
+        with self._lock:
+            for i, (roi, rect) in enumerate(rois):
+                roi = np.ascontiguousarray(roi)
+                if self._data is None or (self._data.tell() and self._data.tell() + roi.nbytes > self.shard_bytes):
+                    self._open_shard()
+                offset = -(-self._data.tell() // ALIGN) * ALIGN
+                self._data.write(b"\0" * (offset - self._data.tell()))
+                self._data.write(roi.data)
+                self._data.flush()
+                line = dict(record, shard=_shard_name(self._number), offset=offset, shape=list(roi.shape),
+                            dtype=roi.dtype.str, roi=i, mode=rect[4], rect=[int(v) for v in rect[:4]])
+                self._index.write(json.dumps(line) + "\n")
+                self._index.flush()
+                self.written += 1
+
+    def close(self):
+        with self._lock:
+            self._close_shard()
+
+class RoiDataset:
+    """Read side of a packed dataset: dataset[i] is (read-only ROI array backed by the shard, record).
+
+    Only the latest save of each source image is listed; mode filters by ROI
+    mode (e.g. "ECG"). Shards are mapped on first access.
+    """
+
+    def __init__(self, path, mode=None):
+        self.path = path
+        latest = {}
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(path, name)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut off by a crash
+                    saved = latest.setdefault(record["source"], [record["saved_at"], []])
+                    if record["saved_at"] > saved[0]:
+                        saved[:] = [record["saved_at"], []]
+                    if record["saved_at"] == saved[0]:
+                        saved[1].append(record)
+        self.records = [r for source in sorted(latest) for r in latest[source][1]
+                        if mode is None or r["mode"].lower() == mode.lower()]
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def _map(self, shard):
+        mm = self._maps.get(shard)
+        if mm is None:
+            mm = self._maps[shard] = np.memmap(os.path.join(self.path, shard + ".bin"), dtype=np.uint8, mode="r")
+        return mm
+
+    def array(self, record):
+        dtype = np.dtype(record["dtype"])
+        nbytes = int(np.prod(record["shape"])) * dtype.itemsize
+        offset = record["offset"]
+        return self._map(record["shard"])[offset:offset + nbytes].view(dtype).reshape(record["shape"])
+
+    def __getitem__(self, i):
+        record = self.records[i]
+        return self.array(record), record
+
+    def __iter__(self):
+        for record in self.records:
+            yield self.array(record), record
+
+def load_image_rois(item, from_source=False):
+    """ROIs of one results row as (path, [(roi, rect)], error): the saved ROI files, else cut from the source"""
+    from image_cache import read_full
+    from image_ops import apply_operations, roi_crops, roi_path
+    path, row = item
+    rois = []
+    try:
+        rects = [tuple(r) for r in json.loads(row.get("roi_rectangles") or "[]")]
+        output = None
+        for idx, rect in enumerate(rects):
+            x0, y0, x1, y1, mode = rect
+            roi = None
+            if not from_source:
+                # Deeper ROIs are saved as PNG or TIFF whatever ROI_FORMAT said at the time
+                for ext in (".png", ".webp", ".tiff", ".tif", ".bmp"):
+                    roi_file = roi_path(path, idx, mode, ext)
+                    if os.path.exists(roi_file):
+                        roi = cv2.imread(roi_file, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+                        break
+            if roi is not None:
+                rect = (max(0, min(x0, x1)), max(0, min(y0, y1)), max(x0, x1), max(y0, y1), mode)
+            else:
+                if output is None:
+                    img = read_full(path)[0]
+                    if img is None:
+                        raise IOError("could not read image")
+                    output = apply_operations(img, [tuple(op) for op in json.loads(row.get("operations") or "[]")])
+                crops = list(roi_crops(output, [rect], path))
+                if not crops:
+                    continue
+                _, roi, rect = crops[0]
+            rois.append((roi, rect))
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return path, rois, error
+
+def _init_worker():
+    cv2.setNumThreads(1)
+
+def export_dataset(image_dir, out_dir, workers=None, shard_mb=SHARD_MB, from_source=False):
+    """Pack the ROIs of every annotated image in image_dir into a new dataset at out_dir"""
+    if os.path.isdir(out_dir) and any(n.endswith(".bin") for n in os.listdir(out_dir)):
+        raise ValueError(f"{out_dir} already holds a dataset")
+    columns, rows = merged_rows(folder_db_paths(image_dir))
+    items = [(r[0], dict(zip(columns, r))) for r in rows]
+    items = [(path, row) for path, row in items if json.loads(row.get("roi_rectangles") or "[]")]
+    workers = workers or os.cpu_count() or 1
+    print(f"Packing ROIs of {len(items)} images with {workers} workers")
+
+    start = time.perf_counter()
+    by_path = dict(items)
+    writer = ShardWriter(out_dir, shard_mb)
+    failed = []
+    n_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        chunksize = max(1, min(32, len(items) // (workers * 4) or 1))
+        for path, rois, error in pool.map(partial(load_image_rois, from_source=from_source), items,
+                                          chunksize=chunksize):
+            if error:
+                failed.append((path, error))
+                print(f"[FAILED] {path} - {error}")
+                continue
+            row = by_path[path]
+            writer.write_image(rois, dict(image_record(row, image_dir), saved_at=row.get("saved_at")))
+            n_bytes += sum(roi.nbytes for roi, _ in rois)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"Packed {writer.written} ROIs ({n_bytes / 2**20:.0f} MB) in {elapsed:.1f} s, {len(failed)} images failed")
+    return writer.written, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack every saved ROI of a folder into a memory-mappable dataset.")
+    parser.add_argument("image_dir", help="annotated image directory")
+    parser.add_argument("out_dir", help="new dataset directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_MB, help="shard size in MB")
+    parser.add_argument("--from-source", action="store_true",
+                        help="cut every ROI from its source image instead of reading the saved ROI files")
+    args = parser.parse_args(argv)
+    _, failed = export_dataset(args.image_dir, args.out_dir, workers=args.workers, shard_mb=args.shard_mb,
+                               from_source=args.from_source)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
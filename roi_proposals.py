@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from profiler import PROFILER
+
+def as_uint8(img):
+    """img stretched over 0-255 if it is deeper than 8 bits, so fixed thresholds apply"""
+    if img.dtype == np.uint8:
+        return img
+    return cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+def _pool(img, k, op):
+    """Maximum (cv2.dilate) or minimum (cv2.erode) of every whole k x k block of img"""
+    h, w = img.shape[:2]
+    return op(img, np.ones((k, k), np.uint8), anchor=(0, 0))[:max(1, h // k) * k:k, :max(1, w // k) * k:k]
+
+def trace_mask(img, drop_rows=True, reduce=1):
+    """Pixels that stand out from the screen background: far from the median grey level, or saturated.
+
+    Grid lines and panel borders fill (almost) whole rows or columns and are
+    dropped; pass drop_rows=False where a flat trace may span a whole row.
+    With reduce > 1 the mask covers reduce x reduce blocks, judged by their
+    brightest and darkest pixels so one-pixel traces survive; colour and the
+    background level are only looked at on the reduced image.
+    """
+    img = as_uint8(img)
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if reduce > 1:
+        img = _pool(img, reduce, cv2.dilate)
+        dark = _pool(gray, reduce, cv2.erode)
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    else:
+        dark = gray
+    step = max(1, int((gray.size / 1e6) ** 0.5))  # the background level needs no more than ~1M samples
+    mask = gray.astype(np.int16) - int(np.median(gray[::step, ::step])) > 40
+    mask |= int(np.median(dark[::step, ::step])) - dark.astype(np.int16) > 40
+    if img.ndim == 3:
+        mask |= cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 1] > 100
+    if drop_rows:
+        mask[mask.mean(axis=1) > 0.8, :] = False
+    mask[:, mask.mean(axis=0) > 0.8] = False
+    return mask
+
+def propose_rois(img, full_size=None, max_side=512, min_width=0.4, pad=0.01):
+    """Candidate (x0, y0, x1, y1, mode) strip rectangles in full-resolution source pixels.
+
+    Trace pixels are found on blocks of the input reduced to at most
+    max_side by their extremes, so one-pixel traces survive the reduction. They are smeared along
+    rows into connected components, components sharing rows are merged into
+    bands, and bands at least min_width of the image wide are kept, trimmed
+    to the rows and columns their projections say are active. Strips are
+    returned top to bottom; the topmost is labelled "ECG" (monitors show the
+    ECG lead first), the rest "Waveform". img may be a reduced decode of an
+    image whose full (w, h) is full_size.
+    """
+    h, w = img.shape[:2]
+    full_w, full_h = full_size or (w, h)
+    k = max(1, -(-max(h, w) // max_side))
+    mask = trace_mask(img, reduce=k)
+    sh, sw = mask.shape
+
+    smear = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, sw // 20), 3))
+    blobs = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_CLOSE, smear)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(blobs, connectivity=8)
+
+    # Steep or faint stretches of a trace break it into several components; merge those sharing rows
+    bands = []
+    for i in np.argsort(stats[1:, cv2.CC_STAT_TOP]) + 1:
+        x, y, bw, bh, _ = stats[i]
+        if bh < 3:
+            continue
+        for band in bands:
+            bx0, by0, bx1, by1, members = band
+            if min(by1, y + bh) - max(by0, y) > 0.5 * min(bh, by1 - by0):
+                band[:4] = min(bx0, x), min(by0, y), max(bx1, x + bw), max(by1, y + bh)
+                members.append(i)
+                break
+        else:
+            bands.append([x, y, x + bw, y + bh, [i]])
+
+    strips = []
+    for x0, y0, x1, y1, members in bands:
+        if x1 - x0 < min_width * sw or x1 - x0 < 3 * (y1 - y0):
+            continue
+        inside = mask[y0:y1, x0:x1] & np.isin(labels[y0:y1, x0:x1], members)
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        strips.append((x0 + cols[0], y0 + rows[0], x0 + cols[-1] + 1, y0 + rows[-1] + 1))
+
+    sx, sy = full_w / sw, full_h / sh
+    px, py = pad * full_w, pad * full_h
+    proposals = []
+    for k, (x0, y0, x1, y1) in enumerate(strips):
+        proposals.append((max(0, int(x0 * sx - px)), max(0, int(y0 * sy - py)),
+                          min(full_w, int(np.ceil(x1 * sx + px))), min(full_h, int(np.ceil(y1 * sy + py))),
+                          "ECG" if k == 0 else "Waveform"))
+    return proposals
+
+def rect_to_output(rect, geometry):
+    """Bounding box in output pixels of a source-pixel (x0, y0, x1, y1, mode) rect, or None if cropped away"""
+    x0, y0, x1, y1, mode = rect
+    corners = np.array([[x0, x1, x0, x1], [y0, y0, y1, y1], [1, 1, 1, 1]], dtype=float)
+    xs, ys, _ = geometry.matrix @ corners
+    w, h = geometry.size
+    ox0, oy0 = max(0, int(np.floor(xs.min()))), max(0, int(np.floor(ys.min())))
+    ox1, oy1 = min(w, int(np.ceil(xs.max()))), min(h, int(np.ceil(ys.max())))
+    if ox1 <= ox0 or oy1 <= oy0:
+        return None
+    return ox0, oy0, ox1, oy1, mode
+
+class RoiProposer:
+    """Background ROI proposals for upcoming images, kept for the most recent `keep` paths.
+
+    load(path) must return (image, full size), e.g. an ImageCache lookup,
+    so proposals reuse the prefetched decode.
+    """
+
+    def __init__(self, load, keep=32, workers=1):
+        self.load = load
+        self.keep = keep
+        self._results = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="roi-proposals")
+
+    def submit(self, paths):
+        with self._lock:
+            for path in paths:
+                if path not in self._results and path not in self._pending:
+                    self._pending[path] = self._pool.submit(self._propose, path)
+
+    def _propose(self, path):
+        try:
+            img, size = self.load(path)
+            with PROFILER.timer("roi.propose"):
+                proposals = propose_rois(img, size) if img is not None else []
+        except Exception as e:
+            print(f"ROI proposal failed for {path}: {e}")
+            proposals = []
+        with self._lock:
+            self._pending.pop(path, None)
+            self._results[path] = proposals
+            while len(self._results) > self.keep:
+                self._results.popitem(last=False)
+        return proposals
+
+    def get(self, path):
+        """Proposals for path if ready, else None (without waiting)"""
+        with self._lock:
+            return self._results.get(path)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,112 @@
+"""Per-image annotation state of one image folder, so a session can be resumed where it stopped.
+
+States are the JSON template dicts of MedicalImageProcessor.session_state,
+one row per image, plus the image that was open last.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SESSION_DB_NAME = "session.sqlite"
+
+def default_session_path(image_dir, annotator=None):
+    """session.sqlite, or session-<annotator>.sqlite for one of several annotators sharing the folder"""
+    return os.path.join(image_dir, SESSION_DB_NAME if annotator is None else f"session-{annotator}.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, state TEXT, updated_at REAL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+class SessionStore:
+    """SQLite session file written by its own thread.
+
+    put() and set_current() only queue the latest value; the writer commits
+    everything queued in one transaction, so the Tk thread never waits on the
+    disk and a burst of edits to one image costs a single row write. Reads go
+    through a separate connection and see queued and in-flight values first.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._pending = {}
+        self._writing = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, image_path, state):
+        with self._lock:
+            self._pending[("images", os.path.abspath(image_path))] = json.dumps(state)
+        self._wake.set()
+
+    def set_current(self, image_path):
+        with self._lock:
+            self._pending[("meta", "current")] = os.path.abspath(image_path)
+        self._wake.set()
+
+    def _read(self, key, sql):
+        with self._lock:
+            value = self._pending.get(key, self._writing.get(key))
+            if value is None:
+                row = self._conn.execute(sql, key[1:]).fetchone()
+                value = row[0] if row else None
+        return value
+
+    def get(self, image_path):
+        """Saved state for image_path as a dict, or None"""
+        state = self._read(("images", os.path.abspath(image_path)), "SELECT state FROM images WHERE path = ?")
+        return json.loads(state) if state is not None else None
+
+    def paths(self):
+        """Every image path with a saved (or queued) state"""
+        with self._lock:
+            saved = {r[0] for r in self._conn.execute("SELECT path FROM images")}
+            return saved | {key for table, key in list(self._pending) + list(self._writing) if table == "images"}
+
+    def current(self):
+        """Image that was open when the session was last left, or None"""
+        return self._read(("meta", "current"), "SELECT value FROM meta WHERE key = ?")
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._writing = pending
+                closed = self._closed
+            if pending:
+                try:
+                    self._write(conn, pending)
+                except sqlite3.Error as e:
+                    print(f"Could not write session {self.db_path}: {e}")
+            with self._lock:
+                self._writing = {}
+            if closed:
+                conn.close()
+                return
+
+    def _write(self, conn, pending):
+        now = time.time()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO images (path, state, updated_at) VALUES (?, ?, ?)",
+                             [(path, state, now) for (table, path), state in pending.items() if table == "images"])
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [(key, value) for (table, key), value in pending.items() if table == "meta"])
+
+    def close(self):
+        """Write everything still queued and stop the writer"""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self._conn.close()
@@ -0,0 +1,56 @@
+"""Record interactive sessions as JSON-lines traces that benchmark.py can replay.
+
+Each line is {"t": seconds since recording started, "op": name, "args": [...]}.
+"op" is either a canvas mouse event ("click", "drag", "release" with window
+x, y) or the name of a MedicalImageProcessor method called from the UI.
+"""
+import json
+import time
+import functools
+
+class TraceRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.depth = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, op, *args):
+        self._file.write(json.dumps({"t": round(time.perf_counter() - self.start, 4), "op": op,
+                                     "args": list(args)}) + "\n")
+
+    def close(self):
+        self._file.close()
+
+def _record_outermost(app, op, args, call):
+    """Record op unless it is being called from another recorded op, which replay will redo itself"""
+    trace = getattr(app, "trace", None)
+    if trace is None:
+        return call()
+    if trace.depth == 0:
+        trace.record(op, *args)
+    trace.depth += 1
+    try:
+        return call()
+    finally:
+        trace.depth -= 1
+
+def traced(method):
+    """Record calls of a MedicalImageProcessor UI action by method name"""
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        return _record_outermost(self, method.__name__, args, lambda: method(self, *args))
+    return wrapper
+
+def traced_event(op):
+    """Record an (app, event) canvas handler as op with the event's window coordinates"""
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(app, event):
+            return _record_outermost(app, op, (event.x, event.y), lambda: handler(app, event))
+        return wrapper
+    return decorate
+
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
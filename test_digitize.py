@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+from digitize import extract_trace
+
+def monitor_strip(grid, h=240, w=900):
+    """Dark monitor strip with a green trace and, optionally, a grid and a text label; returns it and the true rows"""
+    img = np.full((h, w, 3), 10, np.uint8)
+    if grid:
+        img[10::40, :] = 90
+        img[:, 15::40] = 90
+        cv2.putText(img, "II  25 mm/s  HR 72", (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    xs = np.arange(w)
+    ys = h / 2 + 60 * np.sin(xs / 60.0) + 25 * np.exp(-((xs % 200) - 100) ** 2 / 20.0)
+    cv2.polylines(img, [np.stack([xs, ys], axis=1).round().astype(np.int32)], False, (0, 255, 0), 2)
+    return img, ys
+
+def test_trace_without_grid():
+    img, ys = monitor_strip(grid=False)
+    trace = extract_trace(img)
+    assert not np.isnan(trace).any()
+    assert np.median(np.abs(trace - ys)) < 1
+
+def test_grid_and_text_are_ignored():
+    img, ys = monitor_strip(grid=True)
+    trace = extract_trace(img)
+    assert not np.isnan(trace).any()
+    error = np.abs(trace - ys)
+    assert np.median(error) < 1
+    assert error.max() < 3
+
+def test_gap_in_trace_stays_empty():
+    img = np.zeros((200, 600, 3), np.uint8)
+    img[80, :200] = (0, 255, 0)
+    img[120, 260:] = (0, 255, 0)
+    trace = extract_trace(img)
+    assert np.isnan(trace[200:260]).all()
+    assert (trace[:200] == 80).all() and (trace[260:] == 120).all()
@@ -0,0 +1,193 @@
+"""On-disk thumbnail cache for the filmstrip, filled by a process pool.
+
+    python thumbnails.py /path/to/images [--size 128] [--workers N]
+
+Thumbnails are JPEGs under the per-user cache, named by a hash of the
+image's path, size and mtime: a changed file gets a new name, so entries
+never need invalidating. Images in view are thumbnailed first; the rest of
+the folder is queued behind them a few at a time, so scrolling is never
+stuck behind the whole backlog.
+"""
+import os
+import time
+import queue
+import hashlib
+import argparse
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from image_cache import read_preview
+from image_index import DirectoryIndex, cache_path
+from roi_proposals import as_uint8
+
+THUMB_SIZE = 128
+
+def thumbnail_path(path, size, mtime):
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{size}|{mtime}".encode()).hexdigest()
+    return cache_path("thumbs", key[:2], f"{key}.jpg")
+
+def make_thumbnail(item):
+    """Write the thumbnail of (path, thumbnail path, longest side); returns (path, error)"""
+    path, out_path, max_side = item
+    try:
+        img, _ = read_preview(path, (max_side, max_side))
+        if img is None:
+            raise IOError("could not read image")
+        img = as_uint8(img)
+        h, w = img.shape[:2]
+        f = max_side / max(h, w)
+        if f < 1:
+            img = cv2.resize(img, (max(1, round(w * f)), max(1, round(h * f))), interpolation=cv2.INTER_AREA)
+        tmp = f"{out_path}.{os.getpid()}.jpg"
+        if not cv2.imwrite(tmp, img, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+            raise IOError(f"could not write {tmp}")
+        os.replace(tmp, out_path)
+        return path, None
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+
+def _init_worker():
+    cv2.setNumThreads(1)
+
+class ThumbnailCache:
+    """Thumbnails by image path: recently shown ones decoded in memory, the rest on disk or queued.
+
+    Used from the Tk thread only. get() never decodes the image itself: a
+    missing thumbnail returns None until request() has queued it and drain()
+    reports it done.
+    """
+
+    def __init__(self, max_side=THUMB_SIZE, workers=2, keep=256):
+        self.max_side = max_side
+        self.workers = max(1, workers)
+        self.keep = keep
+        self.file_stats = {}
+        self.failed = {}
+        self._decoded = OrderedDict()
+        self._futures = {}
+        self._done = queue.Queue()
+        self._backlog = []
+        self._pool = None
+
+    def _thumbnail_path(self, path):
+        stat = self.file_stats.get(path)
+        if stat is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            stat = self.file_stats[path] = (st.st_size, st.st_mtime)
+        return thumbnail_path(path, *stat)
+
+    def get(self, path):
+        """Thumbnail of path as a BGR or grayscale uint8 array if it is on disk, else None"""
+        thumb = self._decoded.get(path)
+        if thumb is not None:
+            self._decoded.move_to_end(path)
+            return thumb
+        if path in self._futures or path in self.failed:
+            return None
+        out = self._thumbnail_path(path)
+        thumb = cv2.imread(out, cv2.IMREAD_UNCHANGED) if out and os.path.exists(out) else None
+        if thumb is not None:
+            self._decoded[path] = thumb
+            while len(self._decoded) > self.keep:
+                self._decoded.popitem(last=False)
+        return thumb
+
+    def request(self, paths):
+        """Queue thumbnails of paths (the ones in view) ahead of the backlog, cancelling queued ones out of view"""
+        wanted = set(paths)
+        for path, future in list(self._futures.items()):
+            if path not in wanted and future.cancel():
+                del self._futures[path]
+                self._backlog.append(path)
+        for path in paths:
+            self._submit(path)
+
+    def prefill(self, paths, file_stats=None):
+        """Thumbnail every image of paths in the background, in order, a few at a time"""
+        if file_stats is not None:
+            self.file_stats = file_stats
+        self._backlog = list(reversed(paths))
+        self._top_up()
+
+    def invalidate(self, file_stats):
+        """Forget what is known of the images of {path: (size, mtime)}, e.g. after they were overwritten"""
+        self.file_stats.update(file_stats)
+        for path in file_stats:
+            self._decoded.pop(path, None)
+            self.failed.pop(path, None)
+
+    def _submit(self, path):
+        if path in self._decoded or path in self._futures or path in self.failed:
+            return False
+        out = self._thumbnail_path(path)
+        if out is None or os.path.exists(out):
+            return False
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        future = self._pool.submit(make_thumbnail, (path, out, self.max_side))
+        self._futures[path] = future
+        future.add_done_callback(partial(self._finished, path))
+        return True
+
+    def _finished(self, path, future):
+        # Runs on the pool's thread; drain() picks the result up on the Tk thread
+        if not future.cancelled():
+            self._done.put(future.result())
+
+    def _top_up(self):
+        while self._backlog and len(self._futures) < 2 * self.workers:
+            self._submit(self._backlog.pop())
+
+    @property
+    def pending(self):
+        return len(self._futures) + len(self._backlog)
+
+    def drain(self):
+        """Paths whose thumbnails were written since the last call; queues more of the backlog"""
+        written = []
+        while True:
+            try:
+                path, error = self._done.get_nowait()
+            except queue.Empty:
+                break
+            self._futures.pop(path, None)
+            if error:
+                self.failed[path] = error
+            else:
+                written.append(path)
+        self._top_up()
+        return written
+
+    def close(self):
+        self._backlog = []
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the thumbnail cache of an image folder.")
+    parser.add_argument("image_dir", help="image directory")
+    parser.add_argument("--size", type=int, default=THUMB_SIZE, help="longest thumbnail side in pixels")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    listing = DirectoryIndex(args.image_dir)
+    files = listing.all_files()
+    listing.refresh_stats()
+    thumbnails = ThumbnailCache(args.size, args.workers or os.cpu_count() or 1)
+    thumbnails.prefill(files, listing.file_stats())
+    written = 0
+    while thumbnails.pending:
+        written += len(thumbnails.drain())
+        time.sleep(0.05)
+    thumbnails.close()
+    for path, error in thumbnails.failed.items():
+        print(f"[FAILED] {path} - {error}")
+    print(f"Wrote {written} thumbnails for {len(files)} images in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
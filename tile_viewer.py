@@ -0,0 +1,227 @@
+import math
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+from geometry import render, translation
+from profiler import PROFILER
+
+def auto_window(img):
+    """(lo, hi) display window: the full range for 8-bit images, else the 0.5-99.5 percentiles of a sample"""
+    if img.dtype == np.uint8:
+        return 0.0, 255.0
+    step_y, step_x = max(1, img.shape[0] // 512), max(1, img.shape[1] // 512)
+    lo, hi = np.percentile(img[::step_y, ::step_x], (0.5, 99.5))
+    return float(lo), float(hi if hi > lo else lo + 1)
+
+def display_lut(dtype, window):
+    """uint8 table taking every value of a uint8/uint16 dtype through window (lo, hi) to 0-255"""
+    lo, hi = window
+    values = np.arange(np.iinfo(dtype).max + 1, dtype=np.float32)
+    return np.clip((values - lo) * (255.0 / (hi - lo)) + 0.5, 0, 255).astype(np.uint8)
+
+class TileViewer:
+    """Zoomable image pyramid drawn on a Tk canvas as fixed-size tiles.
+
+    Zoom steps are powers of two above the fit-to-window scale. Pyramid
+    levels are area-downsampled copies of the (unrotated) source at exactly
+    those scales, built on first use, so a tile is one lossless slice or a
+    single warp of its level. Only tiles intersecting the viewport are
+    rendered; rendered tiles are kept in an LRU and hidden rather than
+    re-rendered when the view moves away.
+
+    Levels keep the source's channel count and bit depth. Each tile is
+    mapped to 8 bits for the screen through a window/level lookup table,
+    built once per window, after resampling.
+    """
+
+    def __init__(self, canvas, tile_size=256, max_tiles=256, max_scale=8.0, photo_image=None):
+        self.canvas = canvas
+        self.photo_image = photo_image or ImageTk.PhotoImage
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.max_scale = max_scale
+        self.source = None
+        self.source_scale = (1.0, 1.0)
+        self.geometry = None
+        self.fit_scale = 1.0
+        self.zoom = 0
+        self.levels = {}
+        self.tiles = OrderedDict()
+        self.tiles_rendered = 0
+        self.window = None
+        self._lut = None
+
+    @property
+    def scale(self):
+        return self.fit_scale * (2 ** self.zoom)
+
+    @property
+    def size(self):
+        w, h = self.geometry.size
+        return max(1, int(w * self.scale)), max(1, int(h * self.scale))
+
+    def set_image(self, source, geometry, fit_scale, source_size=None):
+        """Show source through geometry; the pyramid is rebuilt only if the source or fit scale changed.
+
+        source may be a reduced decode of an image whose full-resolution
+        (w, h) is source_size; geometry is always in full-resolution pixels.
+        """
+        if source is not self.source:
+            self.levels = {}
+        if fit_scale != self.fit_scale:
+            self.levels = {}
+            self.zoom = 0
+        h, w = source.shape[:2]
+        full_w, full_h = source_size or (w, h)
+        self.source = source
+        self.source_scale = (w / full_w, h / full_h)
+        self.geometry = geometry
+        self.fit_scale = fit_scale
+        self.zoom = min(self.zoom, self.max_zoom())
+        self.clear_tiles()
+
+    def set_source(self, source):
+        """Swap in a pixel-identical copy of the source (e.g. after copy-on-write) without rebuilding"""
+        self.levels = {k: (source if arr is self.source else arr, f) for k, (arr, f) in self.levels.items()}
+        self.source = source
+
+    def set_window(self, window):
+        """Display window (lo, hi) in source values, or None for auto_window of the next source drawn"""
+        if window is not None:
+            window = (float(window[0]), float(window[1]))
+        if window == self.window:
+            return False
+        self.window = window
+        self._lut = None
+        self.clear_tiles()
+        return True
+
+    def _to_display(self, tile):
+        """8-bit L (one channel) or RGB PIL image of a resampled tile, through the window/level table"""
+        if self.window is None:
+            self.window = auto_window(self.source)
+        if tile.dtype == np.uint16 or (tile.dtype == np.uint8 and self.window != (0.0, 255.0)):
+            if self._lut is None or len(self._lut) != np.iinfo(tile.dtype).max + 1:
+                self._lut = display_lut(tile.dtype, self.window)
+            tile = cv2.LUT(tile, self._lut) if tile.dtype == np.uint8 else self._lut[tile]
+        elif tile.dtype != np.uint8:
+            lo, hi = self.window
+            tile = np.clip((tile.astype(np.float32) - lo) * (255.0 / (hi - lo)) + 0.5, 0, 255).astype(np.uint8)
+        if tile.ndim == 2:
+            return Image.fromarray(tile)
+        return Image.fromarray(cv2.cvtColor(tile, cv2.COLOR_BGR2RGB))
+
+    def max_zoom(self):
+        return max(0, int(math.floor(math.log2(max(self.max_scale / self.fit_scale, 1.0)))))
+
+    def set_zoom(self, zoom):
+        zoom = max(0, min(int(zoom), self.max_zoom()))
+        if zoom == self.zoom:
+            return False
+        self.zoom = zoom
+        for item, _ in self.tiles.values():
+            self.canvas.itemconfig(item, state="hidden")
+        return True
+
+    def _level(self, scale):
+        """(array, (fx, fy)) of the pyramid level used for scale, building it on first use"""
+        level_scale = min(scale, 1.0)
+        if level_scale >= min(self.source_scale):
+            return self.source, self.source_scale
+        if level_scale not in self.levels:
+            h, w = self.source.shape[:2]
+            sx, sy = self.source_scale
+            dw, dh = max(1, round(w / sx * level_scale)), max(1, round(h / sy * level_scale))
+            finer = [s for s in self.levels if s > level_scale]
+            base = self.levels[min(finer)][0] if finer else self.source
+            with PROFILER.timer("pyramid.level"):
+                arr = cv2.resize(base, (dw, dh), interpolation=cv2.INTER_AREA)
+            self.levels[level_scale] = (arr, (dw * sx / w, dh * sy / h))
+        return self.levels[level_scale]
+
+    def visible_tiles(self):
+        T = self.tile_size
+        w, h = self.size
+        x0 = max(0, self.canvas.canvasx(0))
+        y0 = max(0, self.canvas.canvasy(0))
+        x1 = min(w, self.canvas.canvasx(self.canvas.winfo_width()))
+        y1 = min(h, self.canvas.canvasy(self.canvas.winfo_height()))
+        if x1 <= x0 or y1 <= y0:
+            x1, y1 = min(w, x0 + T), min(h, y0 + T)
+        return [(tx, ty) for ty in range(int(y0 // T), int(math.ceil(y1 / T)))
+                for tx in range(int(x0 // T), int(math.ceil(x1 / T)))]
+
+    def _render_tile(self, tx, ty):
+        T = self.tile_size
+        w, h = self.size
+        x0, y0 = tx * T, ty * T
+        tw, th = min(T, w - x0), min(T, h - y0)
+        scale = self.scale
+        level, factors = self._level(scale)
+        matrix = translation(-x0, -y0) @ self.geometry.display_matrix(scale, factors)
+        interpolation = cv2.INTER_NEAREST if scale > max(factors) else cv2.INTER_LINEAR
+        with PROFILER.timer("tile.resample"):
+            tile = render(level, matrix, (tw, th), interpolation)
+        self.tiles_rendered += 1
+        with PROFILER.timer("tile.display"):
+            return self._to_display(tile)
+
+    @PROFILER.timed("viewer.update_visible")
+    def update_visible(self):
+        """Render missing tiles in the viewport and show cached ones"""
+        if self.source is None:
+            return
+        scale = self.scale
+        for tx, ty in self.visible_tiles():
+            key = (scale, tx, ty)
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                self.canvas.itemconfig(self.tiles[key][0], state="normal")
+                continue
+            tile = self._render_tile(tx, ty)
+            with PROFILER.timer("tile.PhotoImage"):
+                photo = self.photo_image(tile)
+            item = self.canvas.create_image(tx * self.tile_size, ty * self.tile_size, anchor="nw",
+                                            image=photo, tags=("tile",))
+            self.tiles[key] = (item, photo)
+        self.canvas.tag_lower("tile")
+        while len(self.tiles) > self.max_tiles:
+            _, (item, _) = self.tiles.popitem(last=False)
+            self.canvas.delete(item)
+
+    def clear_tiles(self):
+        self.canvas.delete("tile")
+        self.tiles.clear()
+
+    @PROFILER.timed("viewer.invalidate")
+    def invalidate_source_region(self, bbox):
+        """Re-sample the (x0, y0, x1, y1) source region into built levels and redraw the tiles it touches"""
+        x0, y0, x1, y1 = bbox
+        h, w = self.source.shape[:2]
+        sx, sy = self.source_scale
+        for level_scale, (arr, (fx, fy)) in sorted(self.levels.items(), reverse=True):
+            # one level pixel of margin keeps resampling seams off the changed pixels
+            lx0, ly0 = max(0, int(x0 * fx) - 1), max(0, int(y0 * fy) - 1)
+            lx1, ly1 = min(arr.shape[1], math.ceil(x1 * fx) + 1), min(arr.shape[0], math.ceil(y1 * fy) + 1)
+            if lx1 <= lx0 or ly1 <= ly0:
+                continue
+            px0, py0 = int(lx0 * sx / fx), int(ly0 * sy / fy)
+            px1, py1 = min(w, math.ceil(lx1 * sx / fx)), min(h, math.ceil(ly1 * sy / fy))
+            arr[ly0:ly1, lx0:lx1] = cv2.resize(self.source[py0:py1, px0:px1], (lx1 - lx0, ly1 - ly0),
+                                               interpolation=cv2.INTER_AREA)
+
+        corners = np.array([[x0, x1, x0, x1], [y0, y0, y1, y1], [1, 1, 1, 1]], dtype=float)
+        T = self.tile_size
+        for key in list(self.tiles):
+            scale, tx, ty = key
+            xs, ys, _ = self.geometry.display_matrix(scale) @ corners
+            if (xs.max() + 2 < tx * T or xs.min() - 2 > (tx + 1) * T
+                    or ys.max() + 2 < ty * T or ys.min() - 2 > (ty + 1) * T):
+                continue
+            item, photo = self.tiles[key]
+            if scale == self.scale:
+                photo.paste(self._render_tile(tx, ty))
+            else:
+                self.canvas.delete(item)
+                del self.tiles[key]
@@ -16,15 +16,28 @@ def setup_ui(app, img_width=1200, img_height=900):
 
     app.canvas = Canvas(app.image_panel, width=img_width, height=img_height, bg="gray")
     app.canvas.grid(row=0, column=0, sticky="nsew")
-    app.h_scroll = Scrollbar(app.image_panel, orient=HORIZONTAL, command=app.canvas.xview)
+    app.h_scroll = Scrollbar(app.image_panel, orient=HORIZONTAL, command=lambda *args: app.scroll_view("x", *args))
     app.h_scroll.grid(row=1, column=0, sticky="ew")
-    app.v_scroll = Scrollbar(app.image_panel, orient=VERTICAL, command=app.canvas.yview)
+    app.v_scroll = Scrollbar(app.image_panel, orient=VERTICAL, command=lambda *args: app.scroll_view("y", *args))
     app.v_scroll.grid(row=0, column=1, sticky="ns")
     app.canvas.configure(xscrollcommand=app.h_scroll.set, yscrollcommand=app.v_scroll.set)
 
     app.image_panel.grid_rowconfigure(0, weight=1)
     app.image_panel.grid_columnconfigure(0, weight=1)
 
+    if app.config["FILMSTRIP"]:
+        from filmstrip import CELL_PAD, LABEL_HEIGHT
+        app.filmstrip_panel = Frame(app.main_paned)
+        app.main_paned.add(app.filmstrip_panel, weight=0)
+        app.filmstrip_canvas = Canvas(app.filmstrip_panel, height=app.config["THUMBNAIL_SIZE"] + 2 * CELL_PAD + LABEL_HEIGHT,
+                                      bg="gray20", highlightthickness=0,
+                                      xscrollincrement=app.config["THUMBNAIL_SIZE"] + 2 * CELL_PAD)
+        app.filmstrip_canvas.pack(fill=X, side=TOP)
+        app.filmstrip_scroll = Scrollbar(app.filmstrip_panel, orient=HORIZONTAL,
+                                         command=lambda *args: app.scroll_filmstrip(*args))
+        app.filmstrip_scroll.pack(fill=X, side=TOP)
+        app.filmstrip_canvas.configure(xscrollcommand=app.filmstrip_scroll.set)
+
     app.control_panel = ttk.Frame(app.main_paned)
     app.main_paned.add(app.control_panel, weight=1)
 
@@ -45,6 +58,8 @@ def setup_ui(app, img_width=1200, img_height=900):
     ttk.Button(button_frame, text="Save All ROIs", command=app.save_all_rois).pack(side=LEFT, padx=2)
     ttk.Button(button_frame, text="Undo ROI", command=app.undo_last_roi).pack(side=LEFT, padx=2)
     ttk.Button(button_frame, text="Redo ROI", command=app.redo_last_roi).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Accept Auto ROIs", command=app.accept_roi_proposals).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Match Calibration", command=app.match_calibration).pack(side=LEFT, padx=2)
 
     app.save_horizontal_ticks_btn = ttk.Button(button_frame, text="Save Horizontal Ticks", command=app.save_horizontal_ticks, state='disabled')
     app.save_horizontal_ticks_btn.pack(side=LEFT, padx=2)
@@ -80,12 +95,30 @@ def setup_ui(app, img_width=1200, img_height=900):
     ttk.Button(button_frame, text="Rotate +0.5°", command=lambda: app.rotate_image(0.5)).pack(side=LEFT, padx=2)
     ttk.Button(button_frame, text="Rotate -0.5°", command=lambda: app.rotate_image(-0.5)).pack(side=LEFT, padx=2)
     ttk.Button(button_frame, text="Eraser", command=app.start_erase).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Undo Edit", command=app.undo_edit).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Redo Edit", command=app.redo_edit).pack(side=LEFT, padx=2)
+    ttk.Label(button_frame, text="Radius:").pack(side=LEFT, padx=2)
+    app.eraser_radius_var = tk.IntVar(value=app.config["ERASER_RADIUS"])
+    ttk.Spinbox(button_frame, from_=1, to=200, width=4, textvariable=app.eraser_radius_var).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Zoom In", command=lambda: app.zoom_at(1)).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Zoom Out", command=lambda: app.zoom_at(-1)).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Fit", command=app.zoom_to_fit).pack(side=LEFT, padx=2)
+    ttk.Label(button_frame, text="Window:").pack(side=LEFT, padx=2)
+    app.window_entry = ttk.Entry(button_frame, width=7)
+    app.window_entry.pack(side=LEFT, padx=2)
+    ttk.Label(button_frame, text="Level:").pack(side=LEFT, padx=2)
+    app.level_entry = ttk.Entry(button_frame, width=7)
+    app.level_entry.pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Apply W/L", command=app.apply_window_level).pack(side=LEFT, padx=2)
+    ttk.Button(button_frame, text="Auto W/L", command=app.auto_window_level).pack(side=LEFT, padx=2)
 
     nav_frame = ttk.Frame(app.control_panel)
     nav_frame.pack(fill=X, pady=5)
     ttk.Button(nav_frame, text="Previous", command=app.previous_image).pack(side=LEFT, padx=2)
     ttk.Button(nav_frame, text="Next", command=app.next_image).pack(side=LEFT, padx=2)
-    ttk.Button(nav_frame, text="Save Data", command=app.save_to_excel).pack(side=LEFT, padx=2)
+    ttk.Button(nav_frame, text="Save Data", command=app.save_data).pack(side=LEFT, padx=2)
+    ttk.Button(nav_frame, text="Export Results", command=app.export_results).pack(side=LEFT, padx=2)
+    ttk.Button(nav_frame, text="Save Template", command=app.save_template).pack(side=LEFT, padx=2)
 
     app.progress_label = ttk.Label(app.control_panel, text="Ready to start")
     app.progress_label.pack(fill=X, padx=5, pady=2)
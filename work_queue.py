@@ -0,0 +1,369 @@
+"""Hand out the images of a shared folder to several annotators without collisions.
+
+    python work_queue.py /path/to/images [--window 60]
+
+Every instance of the app claims an image before working on it by creating
+a lease file in the folder's .work directory with O_EXCL, which only one
+process can do. Leases name their annotator and expire unless renewed, so
+the images of a crashed workstation are handed out again. A saved image's
+lease is replaced by a .done marker, and each annotator appends finished
+images to its own .log, from which throughput is reported.
+
+    .work/leases/<key>.lease   {"path", "annotator", "host", "claimed_at", "expires_at"}
+    .work/done/<key>.done      {"path", "annotator", "done_at"}
+    .work/<annotator>.log      one JSON line per finished image
+
+key is a hash of the image's path relative to the folder, so every
+workstation agrees on it whatever the mount point. Refreshing the view of
+the folder lists only the live leases and reads only what was appended to
+the logs since the last refresh, however many images are done.
+"""
+import os
+import re
+import json
+import time
+import socket
+import getpass
+import hashlib
+import bisect
+import argparse
+import threading
+from image_index import DirectoryIndex
+
+WORK_DIR_NAME = ".work"
+TAKEOVER_TIMEOUT = 60  # seconds after which a takeover lock left by a crash is ignored
+
+def default_annotator():
+    return f"{getpass.getuser()}@{socket.gethostname()}"
+
+def annotator_slug(annotator):
+    """annotator reduced to characters safe in a file name"""
+    return re.sub(r"[^A-Za-z0-9_.@-]+", "_", annotator).strip("._") or "annotator"
+
+class DirectoryWorkStore:
+    """Lease records as small JSON files in a (shared) directory"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def create(self, name, record):
+        """Write record under name only if nothing is there yet; False if it already exists"""
+        try:
+            fd = os.open(self._file(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        return True
+
+    def read(self, name):
+        """Record under name, {} if it is being written or unreadable, None if missing"""
+        try:
+            with open(self._file(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return {}
+
+    def replace(self, name, record):
+        tmp = self._file(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, self._file(name))
+
+    def remove(self, name):
+        try:
+            os.remove(self._file(name))
+        except FileNotFoundError:
+            pass
+
+    def names(self):
+        return os.listdir(self.path)
+
+    def append(self, name, record):
+        with open(self._file(name), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def lines(self, name, offset=0):
+        """Records appended to name from byte offset on, and the offset after the last complete one"""
+        try:
+            with open(self._file(name), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset
+        end = data.rfind(b"\n") + 1  # a line still being written is read next time
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+        return records, offset + end
+
+    def sub(self, name):
+        return DirectoryWorkStore(self._file(name))
+
+class MemoryWorkStore:
+    """In-process stand-in for DirectoryWorkStore: share one between several WorkQueues to simulate annotators"""
+
+    def __init__(self):
+        self.records = {}
+        self.logs = {}
+        self.subs = {}
+        self._lock = threading.Lock()
+
+    def create(self, name, record):
+        with self._lock:
+            if name in self.records:
+                return False
+            self.records[name] = dict(record)
+            return True
+
+    def read(self, name):
+        with self._lock:
+            record = self.records.get(name)
+            return dict(record) if record is not None else None
+
+    def replace(self, name, record):
+        with self._lock:
+            self.records[name] = dict(record)
+
+    def remove(self, name):
+        with self._lock:
+            self.records.pop(name, None)
+
+    def names(self):
+        with self._lock:
+            return list(self.records) + list(self.logs)
+
+    def append(self, name, record):
+        with self._lock:
+            self.logs.setdefault(name, []).append(dict(record))
+
+    def lines(self, name, offset=0):
+        with self._lock:
+            records = self.logs.get(name, [])
+            return [dict(r) for r in records[offset:]], len(records)
+
+    def sub(self, name):
+        with self._lock:
+            return self.subs.setdefault(name, MemoryWorkStore())
+
+class WorkQueue:
+    """One annotator's view of the claims on a folder.
+
+    Claims are decided by the store's atomic create, so they hold across
+    workstations; snapshot() re-reads which images are claimed and catches up
+    on the logs to learn which are done, which next_index() and status() use
+    without touching the store per image. clock is time.time, replaceable to
+    test expiry.
+    """
+
+    def __init__(self, root, annotator=None, lease_seconds=900, store=None, clock=time.time):
+        self.root = os.path.abspath(root)
+        self.annotator = annotator or default_annotator()
+        self.lease_seconds = lease_seconds
+        self.store = store or DirectoryWorkStore(os.path.join(self.root, WORK_DIR_NAME))
+        self.lease_store = self.store.sub("leases")
+        self.done_store = self.store.sub("done")
+        self.clock = clock
+        self.log_name = f"{annotator_slug(self.annotator)}.log"
+        self.leases = {}
+        self.done = set()
+        self.log_entries = {}
+        self._log_offsets = {}
+        self._log_seconds = {}
+        self.snapshot()
+
+    def _rel(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def _rel_key(self, rel):
+        return hashlib.sha1(rel.encode()).hexdigest()[:20]
+
+    def key(self, path):
+        return self._rel_key(self._rel(path))
+
+    def _lease_record(self, path):
+        now = self.clock()
+        return {"path": self._rel(path), "annotator": self.annotator, "host": socket.gethostname(),
+                "claimed_at": now, "expires_at": now + self.lease_seconds}
+
+    def _expired(self, record):
+        # A record being written ({}) counts as live
+        return record is None or ("expires_at" in record and record["expires_at"] < self.clock())
+
+    def snapshot(self):
+        """Re-read the live leases and the log lines appended since the last snapshot"""
+        leases = {}
+        for name in self.lease_store.names():
+            key, ext = os.path.splitext(name)
+            if ext == ".lease":
+                record = self.lease_store.read(name)
+                if not self._expired(record):
+                    leases[key] = record
+        self.leases = leases
+        for name in self.store.names():
+            if not name.endswith(".log"):
+                continue
+            records, self._log_offsets[name] = self.store.lines(name, self._log_offsets.get(name, 0))
+            self.log_entries.setdefault(name, []).extend(records)
+            self.done.update(self._rel_key(r["path"]) for r in records if "path" in r)
+            seconds = self._log_seconds.setdefault(name, [])
+            for r in records:
+                if r.get("seconds") is not None:
+                    bisect.insort(seconds, r["seconds"])
+
+    def owner(self, path):
+        """Annotator holding a live lease on path, or None"""
+        record = self.leases.get(self.key(path))
+        return record.get("annotator", "?") if record is not None else None
+
+    def status(self, path):
+        """Claim status of path: "done", "mine", "claimed" (by someone else) or None"""
+        key = self.key(path)
+        if key in self.done:
+            return "done"
+        record = self.leases.get(key)
+        if record is None:
+            return None
+        return "mine" if record.get("annotator") == self.annotator else "claimed"
+
+    def claim(self, path):
+        """Take (or keep) the lease on path; False if another annotator holds it or it is done"""
+        key = self.key(path)
+        if self.done_store.read(f"{key}.done") is not None:
+            self.done.add(key)
+            return False
+        record = self._lease_record(path)
+        name = f"{key}.lease"
+        if not self.lease_store.create(name, record):
+            current = self.lease_store.read(name)
+            if current is not None and current.get("annotator") == self.annotator:
+                self.lease_store.replace(name, record)
+            elif not self._expired(current) or not self._take_over(name, record):
+                if current:
+                    self.leases[key] = current
+                return False
+        self.leases[key] = record
+        return True
+
+    def _take_over(self, name, record):
+        """Replace an expired lease; a takeover lock makes sure only one annotator does"""
+        lock = f"{name}.takeover"
+        if not self.lease_store.create(lock, {"annotator": self.annotator, "at": self.clock()}):
+            held = self.lease_store.read(lock)
+            if held is None or (held and held.get("at", 0) > self.clock() - TAKEOVER_TIMEOUT):
+                return False
+            self.lease_store.remove(lock)
+            if not self.lease_store.create(lock, {"annotator": self.annotator, "at": self.clock()}):
+                return False
+        try:
+            if not self._expired(self.lease_store.read(name)):
+                return False
+            self.lease_store.replace(name, record)
+            return True
+        finally:
+            self.lease_store.remove(lock)
+
+    def renew(self, path):
+        """Extend our lease on path; False if it expired and another annotator took (or finished) it"""
+        key = self.key(path)
+        current = self.lease_store.read(f"{key}.lease")
+        if (current and current.get("annotator") != self.annotator) or self.done_store.read(f"{key}.done") is not None:
+            return False
+        record = self._lease_record(path)
+        if current:
+            record["claimed_at"] = current.get("claimed_at", record["claimed_at"])
+        self.lease_store.replace(f"{key}.lease", record)
+        self.leases[key] = record
+        return True
+
+    def release(self, path):
+        """Give up our lease on path so another annotator can take it"""
+        key = self.key(path)
+        current = self.lease_store.read(f"{key}.lease")
+        if current and current.get("annotator") == self.annotator:
+            self.lease_store.remove(f"{key}.lease")
+        self.leases.pop(key, None)
+
+    def complete(self, path):
+        """Mark path done by us and log it for throughput"""
+        key = self.key(path)
+        now = self.clock()
+        lease = self.leases.get(key) or self.lease_store.read(f"{key}.lease") or {}
+        record = {"path": self._rel(path), "annotator": self.annotator, "done_at": now}
+        self.done_store.replace(f"{key}.done", record)
+        self.release(path)
+        self.done.add(key)
+        seconds = now - lease["claimed_at"] if lease.get("annotator") == self.annotator else None
+        self.store.append(self.log_name, dict(record, seconds=seconds))
+
+    def next_index(self, files, start):
+        """Index of the first image from start on (wrapping around) that we could claim, claiming it; None if all are taken"""
+        n = len(files)
+        for offset in range(n):
+            i = (start + offset) % n
+            if self.status(files[i]) in ("done", "claimed"):
+                continue
+            if self.claim(files[i]):
+                return i
+        return None
+
+    def held_index(self, files):
+        """Index of an image we still hold a live lease on (e.g. after a restart), or None"""
+        mine = {key for key, record in self.leases.items() if record.get("annotator") == self.annotator}
+        if not mine:
+            return None
+        return next((i for i, path in enumerate(files) if self.key(path) in mine), None)
+
+    def throughput(self, window=3600):
+        """{annotator: {"done", "recent", "per_hour", "median_seconds"}} from every annotator's log, as of the last snapshot()"""
+        now = self.clock()
+        report = {}
+        for name, entries in self.log_entries.items():
+            if not entries:
+                continue
+            recent = 0  # logs are appended in time order, so only their tails are in the window
+            for e in reversed(entries):
+                if e.get("done_at", 0) < now - window:
+                    break
+                recent += 1
+            seconds = self._log_seconds.get(name, [])
+            report[entries[-1].get("annotator", name[:-4])] = {
+                "done": len(entries),
+                "recent": recent,
+                "per_hour": recent * 3600.0 / window,
+                "median_seconds": seconds[len(seconds) // 2] if seconds else None,
+            }
+        return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the annotation progress of a shared image folder.")
+    parser.add_argument("image_dir", help="shared image directory")
+    parser.add_argument("--window", type=float, default=60, help="minutes over which throughput is measured")
+    args = parser.parse_args(argv)
+
+    files = DirectoryIndex(args.image_dir).all_files()
+    work = WorkQueue(args.image_dir, annotator="report")
+    statuses = [work.status(path) for path in files]
+    print(f"{len(files)} images: {statuses.count('done')} done, "
+          f"{statuses.count('claimed')} being annotated, {statuses.count(None)} unclaimed")
+    for record in sorted(work.leases.values(), key=lambda r: r.get("annotator", "")):
+        print(f"  {record.get('annotator', '?'):<30} {record.get('path', '?')}")
+    report = work.throughput(args.window * 60)
+    for annotator, stats in sorted(report.items()):
+        median = f"{stats['median_seconds']:.0f} s/image" if stats["median_seconds"] is not None else "-"
+        print(f"{annotator:<30} {stats['done']:>6} done {stats['per_hour']:>7.1f}/h  {median}")
+    if report:
+        print(f"{'team':<30} {sum(s['done'] for s in report.values()):>6} done "
+              f"{sum(s['per_hour'] for s in report.values()):>7.1f}/h")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import queue
+import threading
+
+class SaveQueue:
+    """Background writer threads for ROI and metadata saves.
+
+    Jobs with the same key (the image path) always go to the same thread,
+    so saves for one image complete in submission order while different
+    images are written in parallel.
+    """
+
+    def __init__(self, workers=1):
+        self._queues = [queue.Queue() for _ in range(max(1, workers))]
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = []
+        self._threads = [threading.Thread(target=self._run, args=(q,), name=f"save-writer-{i}", daemon=True)
+                         for i, q in enumerate(self._queues)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, key, description, func, *args):
+        with self._lock:
+            self.pending += 1
+        self._queues[hash(key) % len(self._queues)].put((description, func, args))
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            description, func, args = job
+            try:
+                func(*args)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            self._events.put((description, error))
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                if error:
+                    self.failed.append((description, error))
+
+    def drain_events(self):
+        """(description, error) for every job finished since the last call; error is None on success"""
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        """Finish every queued job, then stop the writer threads"""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()